@@ -36,6 +36,11 @@
 #include <map>
 #include <functional>
 #include <filesystem>
+#include <algorithm>
+#include <fstream>
+#include <sstream>
+#include <list>
+#include <unordered_map>
 
 #include <cmath>
 #include <cstring>
@@ -232,38 +237,277 @@ struct MAPE
     }
 };
 
+/**
+ * Interface for computing the error between two images at a single pixel.
+ * All errors are non-negative, which allows stopping a comparison early once
+ * the accumulated error exceeds the threshold.
+ */
+class PixelMetric
+{
+public:
+    virtual ~PixelMetric() = default;
+    virtual double operator()(uint32_t x, uint32_t y) const = 0;
+};
+
+/// Pixel metric averaging a per-channel metric over the color (and optionally alpha) channels.
 template<typename Metric>
-double compare(const Image& imageA, const Image& imageB, bool alpha, float* errorMap)
+class ChannelMetric : public PixelMetric
+{
+public:
+    ChannelMetric(const Image& imageA, const Image& imageB, bool alpha) : mImageA(imageA), mImageB(imageB), mChannels(alpha ? 4 : 3) {}
+
+    double operator()(uint32_t x, uint32_t y) const override
+    {
+        size_t offset = (size_t(y) * mImageA.getWidth() + x) * 4;
+        return Metric()(mImageA.getData() + offset, mImageB.getData() + offset, mChannels);
+    }
+
+private:
+    const Image& mImageA;
+    const Image& mImageB;
+    size_t mChannels;
+};
+
+/**
+ * Structural dissimilarity computed on luminance using a 7x7 box window.
+ * The per-pixel error is (1 - SSIM) / 2, which is in [0, 1].
+ */
+class SSIMMetric : public PixelMetric
+{
+public:
+    SSIMMetric(const Image& imageA, const Image& imageB, bool alpha) : mWidth(imageA.getWidth()), mHeight(imageA.getHeight())
+    {
+        // Build summed area tables of the luminance moments.
+        size_t stride = mWidth + 1;
+        for (auto& table : mTables)
+            table.assign(stride * (mHeight + 1), 0.0);
+
+        const float* a = imageA.getData();
+        const float* b = imageB.getData();
+        for (uint32_t y = 0; y < mHeight; ++y)
+        {
+            for (uint32_t x = 0; x < mWidth; ++x)
+            {
+                size_t i = size_t(y) * mWidth + x;
+                double la = luminance(a + i * 4);
+                double lb = luminance(b + i * 4);
+                double values[5] = {la, lb, la * la, lb * lb, la * lb};
+                size_t j = (y + 1) * stride + x + 1;
+                for (size_t k = 0; k < 5; ++k)
+                    mTables[k][j] = values[k] + mTables[k][j - 1] + mTables[k][j - stride] - mTables[k][j - stride - 1];
+            }
+        }
+    }
+
+    double operator()(uint32_t x, uint32_t y) const override
+    {
+        const double kC1 = sqr(0.01);
+        const double kC2 = sqr(0.03);
+
+        uint32_t x0 = x >= kRadius ? x - kRadius : 0;
+        uint32_t y0 = y >= kRadius ? y - kRadius : 0;
+        uint32_t x1 = std::min(x + kRadius + 1, mWidth);
+        uint32_t y1 = std::min(y + kRadius + 1, mHeight);
+        double n = double(x1 - x0) * (y1 - y0);
+
+        double m[5];
+        size_t stride = mWidth + 1;
+        for (size_t k = 0; k < 5; ++k)
+        {
+            const auto& t = mTables[k];
+            m[k] = (t[y1 * stride + x1] - t[y0 * stride + x1] - t[y1 * stride + x0] + t[y0 * stride + x0]) / n;
+        }
+
+        double varA = m[2] - sqr(m[0]);
+        double varB = m[3] - sqr(m[1]);
+        double covAB = m[4] - m[0] * m[1];
+        double ssim = ((2.0 * m[0] * m[1] + kC1) * (2.0 * covAB + kC2)) / ((sqr(m[0]) + sqr(m[1]) + kC1) * (varA + varB + kC2));
+        return clamp((1.0 - ssim) * 0.5, 0.0, 1.0);
+    }
+
+private:
+    static constexpr uint32_t kRadius = 3;
+
+    static double luminance(const float* c) { return 0.2126 * c[0] + 0.7152 * c[1] + 0.0722 * c[2]; }
+
+    uint32_t mWidth;
+    uint32_t mHeight;
+    std::vector<double> mTables[5];
+};
+
+/**
+ * Simplified FLIP-style perceptual color difference.
+ * Images are treated as display-referred, clamped to [0, 1], converted to CIELAB,
+ * prefiltered with a small Gaussian (approximating the contrast sensitivity of the
+ * human visual system) and compared using the HyAB distance. The distance is mapped
+ * to [0, 1] the same way as in FLIP's color pipeline. FLIP's feature (edge and point)
+ * pipeline is not included.
+ */
+class FLIPMetric : public PixelMetric
+{
+public:
+    FLIPMetric(const Image& imageA, const Image& imageB, bool alpha) : mWidth(imageA.getWidth()), mHeight(imageA.getHeight())
+    {
+        mLabA = filteredLab(imageA);
+        mLabB = filteredLab(imageB);
+
+        float green[3] = {0.f, 1.f, 0.f};
+        float blue[3] = {0.f, 0.f, 1.f};
+        float labGreen[3], labBlue[3];
+        rgbToLab(green, labGreen);
+        rgbToLab(blue, labBlue);
+        mMaxDistance = std::pow(hyab(labGreen, labBlue), 0.7);
+    }
+
+    double operator()(uint32_t x, uint32_t y) const override
+    {
+        const double kPc = 0.4;
+        const double kPt = 0.95;
+
+        size_t i = (size_t(y) * mWidth + x) * 3;
+        double d = std::pow(hyab(&mLabA[i], &mLabB[i]), 0.7);
+        double e = d < kPc * mMaxDistance ? (kPt / (kPc * mMaxDistance)) * d
+                                          : kPt + ((d - kPc * mMaxDistance) / (mMaxDistance - kPc * mMaxDistance)) * (1.0 - kPt);
+        return clamp(e, 0.0, 1.0);
+    }
+
+private:
+    static double hyab(const float* a, const float* b)
+    {
+        return std::fabs(a[0] - b[0]) + std::sqrt(sqr(double(a[1] - b[1])) + sqr(double(a[2] - b[2])));
+    }
+
+    static void rgbToLab(const float* rgb, float* lab)
+    {
+        // Linear sRGB to XYZ (D65), normalized by the reference white.
+        float r = clamp(rgb[0], 0.f, 1.f), g = clamp(rgb[1], 0.f, 1.f), b = clamp(rgb[2], 0.f, 1.f);
+        float xyz[3] = {
+            (0.4124564f * r + 0.3575761f * g + 0.1804375f * b) / 0.950428f,
+            (0.2126729f * r + 0.7151522f * g + 0.0721750f * b),
+            (0.0193339f * r + 0.1191920f * g + 0.9503041f * b) / 1.088900f,
+        };
+        auto f = [](float t) { return t > 0.008856f ? std::cbrt(t) : 7.787f * t + 16.f / 116.f; };
+        lab[0] = 116.f * f(xyz[1]) - 16.f;
+        lab[1] = 500.f * (f(xyz[0]) - f(xyz[1]));
+        lab[2] = 200.f * (f(xyz[1]) - f(xyz[2]));
+    }
+
+    std::vector<float> filteredLab(const Image& image) const
+    {
+        const int kRadius = 3;
+        const float kSigma = 1.f;
+        float weights[2 * kRadius + 1];
+        float weightSum = 0.f;
+        for (int i = -kRadius; i <= kRadius; ++i)
+            weightSum += weights[i + kRadius] = std::exp(-float(i * i) / (2.f * kSigma * kSigma));
+
+        size_t count = size_t(mWidth) * mHeight;
+        std::vector<float> lab(count * 3);
+        for (size_t i = 0; i < count; ++i)
+            rgbToLab(image.getData() + i * 4, &lab[i * 3]);
+
+        // Separable Gaussian filter with clamp-to-edge addressing.
+        auto filter = [&](const std::vector<float>& src, std::vector<float>& dst, bool horizontal)
+        {
+            for (uint32_t y = 0; y < mHeight; ++y)
+            {
+                for (uint32_t x = 0; x < mWidth; ++x)
+                {
+                    float sum[3] = {0.f, 0.f, 0.f};
+                    for (int i = -kRadius; i <= kRadius; ++i)
+                    {
+                        int sx = horizontal ? clamp(int(x) + i, 0, int(mWidth) - 1) : int(x);
+                        int sy = horizontal ? int(y) : clamp(int(y) + i, 0, int(mHeight) - 1);
+                        const float* s = &src[(size_t(sy) * mWidth + sx) * 3];
+                        for (size_t c = 0; c < 3; ++c)
+                            sum[c] += weights[i + kRadius] * s[c];
+                    }
+                    float* d = &dst[(size_t(y) * mWidth + x) * 3];
+                    for (size_t c = 0; c < 3; ++c)
+                        d[c] = sum[c] / weightSum;
+                }
+            }
+        };
+        std::vector<float> tmp(count * 3);
+        filter(lab, tmp, true);
+        filter(tmp, lab, false);
+        return lab;
+    }
+
+    uint32_t mWidth;
+    uint32_t mHeight;
+    std::vector<float> mLabA;
+    std::vector<float> mLabB;
+    double mMaxDistance;
+};
+
+struct CompareResult
+{
+    double error;   ///< Mean error (a lower bound of the mean error if the comparison stopped early).
+    bool stopped;   ///< True if the comparison stopped early.
+};
+
+/**
+ * Compare two images tile by tile.
+ * If earlyExit is set, the comparison stops as soon as the accumulated error divided by the
+ * total pixel count exceeds the threshold. As all per-pixel errors are non-negative, this is a
+ * lower bound of the final mean error, so the comparison is guaranteed to fail.
+ */
+static CompareResult compare(
+    const PixelMetric& metric,
+    uint32_t width,
+    uint32_t height,
+    uint32_t tileSize,
+    double threshold,
+    bool earlyExit,
+    float* errorMap
+)
 {
-    Metric metric;
     double sum = 0.0;
-    const float* a = imageA.getData();
-    const float* b = imageB.getData();
-    size_t count = imageA.getWidth() * imageA.getHeight();
-    for (size_t i = 0; i < count; ++i)
-    {
-        double error = metric(a, b, alpha ? 4 : 3);
-        if (errorMap)
-            *errorMap++ = float(error);
-        sum += error;
-        a += 4;
-        b += 4;
-    }
-    return sum / count;
+    double count = double(width) * height;
+    for (uint32_t ty = 0; ty < height; ty += tileSize)
+    {
+        for (uint32_t tx = 0; tx < width; tx += tileSize)
+        {
+            for (uint32_t y = ty; y < std::min(ty + tileSize, height); ++y)
+            {
+                for (uint32_t x = tx; x < std::min(tx + tileSize, width); ++x)
+                {
+                    double error = metric(x, y);
+                    if (errorMap)
+                        errorMap[size_t(y) * width + x] = float(error);
+                    sum += error;
+                }
+            }
+
+            if (earlyExit && (sum / count > threshold || std::isnan(sum)))
+                return {sum / count, true};
+        }
+    }
+    return {sum / count, false};
+}
+
+template<typename Metric>
+std::unique_ptr<PixelMetric> createMetric(const Image& imageA, const Image& imageB, bool alpha)
+{
+    return std::make_unique<Metric>(imageA, imageB, alpha);
 }
 
 struct ErrorMetric
 {
     std::string name;
     std::string desc;
-    std::function<double(const Image& imageA, const Image& imageB, bool alpha, float* errorMap)> compare;
+    std::function<std::unique_ptr<PixelMetric>(const Image& imageA, const Image& imageB, bool alpha)> create;
 };
 
 static const std::vector<ErrorMetric> errorMetrics = {
-    {"mse", "Mean Squared Error", compare<MSE>},
-    {"rmse", "Relative Mean Squared Error", compare<RMSE>},
-    {"mae", "Mean Absolute Error", compare<MAE>},
-    {"mape", "Mean Absolute Percentage Error", compare<MAPE>},
+    {"mse", "Mean Squared Error", createMetric<ChannelMetric<MSE>>},
+    {"rmse", "Relative Mean Squared Error", createMetric<ChannelMetric<RMSE>>},
+    {"relmse", "Relative Mean Squared Error (same as rmse)", createMetric<ChannelMetric<RMSE>>},
+    {"mae", "Mean Absolute Error", createMetric<ChannelMetric<MAE>>},
+    {"mape", "Mean Absolute Percentage Error", createMetric<ChannelMetric<MAPE>>},
+    {"ssim", "Structural Dissimilarity (1 - SSIM) / 2 of luminance", createMetric<SSIMMetric>},
+    {"flip", "FLIP-style perceptual color difference", createMetric<FLIPMetric>},
 };
 
 static std::shared_ptr<Image> generateHeatMap(uint32_t width, uint32_t height, const float* errorMap)
@@ -298,76 +542,409 @@ static std::shared_ptr<Image> generateHeatMap(uint32_t width, uint32_t height, c
     return image;
 }
 
-static bool compareImages(
+/**
+ * LRU cache of decoded images keyed by path.
+ * Used in batch mode for the first image of each pair, as the same reference image is often compared against several result images.
+ */
+class ImageCache
+{
+public:
+    ImageCache(size_t capacity) : mCapacity(capacity) {}
+
+    std::shared_ptr<Image> load(const std::filesystem::path& path)
+    {
+        auto key = path.string();
+        auto it = mEntries.find(key);
+        if (it != mEntries.end())
+        {
+            mOrder.splice(mOrder.begin(), mOrder, it->second.second);
+            return it->second.first;
+        }
+
+        auto image = Image::loadFromFile(path);
+        if (mCapacity == 0)
+            return image;
+        if (mEntries.size() >= mCapacity)
+        {
+            mEntries.erase(mOrder.back());
+            mOrder.pop_back();
+        }
+        mOrder.push_front(key);
+        mEntries[key] = {image, mOrder.begin()};
+        return image;
+    }
+
+private:
+    size_t mCapacity;
+    std::list<std::string> mOrder;
+    std::unordered_map<std::string, std::pair<std::shared_ptr<Image>, std::list<std::string>::iterator>> mEntries;
+};
+
+struct CompareOptions
+{
+    bool alpha = false;
+    uint32_t tileSize = 64;
+    bool earlyExit = false;
+    bool heatMapOnFail = false;
+};
+
+struct CompareOutcome
+{
+    bool success = false;
+    bool compared = false; ///< False if the images could not be compared (message is set).
+    double error = 0.0;
+    bool lowerBound = false; ///< True if the comparison stopped early and the error is a lower bound.
+    std::string message;
+};
+
+static CompareOutcome compareImages(
+    ImageCache& cache,
     const std::filesystem::path& pathA,
     const std::filesystem::path& pathB,
-    ErrorMetric metric,
+    const ErrorMetric& metric,
     float threshold,
-    bool alpha,
-    const std::filesystem::path& heatMapPath
+    const std::filesystem::path& heatMapPath,
+    const CompareOptions& options
 )
 {
-    auto loadImage = [](const std::filesystem::path& path)
+    CompareOutcome outcome;
+
+    auto loadImage = [&](const std::filesystem::path& path, bool cached)
     {
         try
         {
-            return Image::loadFromFile(path);
+            return cached ? cache.load(path) : Image::loadFromFile(path);
         }
         catch (const std::runtime_error& e)
         {
-            std::cerr << "Cannot load image from '" << path.string() << "' (Error: " << e.what() << ")." << std::endl;
+            outcome.message = "Cannot load image from '" + path.string() + "' (Error: " + e.what() + ").";
             return std::shared_ptr<Image>{};
         }
     };
 
-    auto saveImage = [](const Image& image, const std::filesystem::path& path)
+    // Load images (only the first image is cached).
+    auto imageA = loadImage(pathA, true);
+    if (!imageA)
+        return outcome;
+    auto imageB = loadImage(pathB, false);
+    if (!imageB)
+        return outcome;
+
+    // Check resolution.
+    if (imageA->getWidth() != imageB->getWidth() || imageA->getHeight() != imageB->getHeight())
+    {
+        outcome.message = "Cannot compare images with different resolutions.";
+        return outcome;
+    }
+
+    uint32_t width = imageA->getWidth();
+    uint32_t height = imageB->getHeight();
+
+    // Compare images. A comparison stopping early always fails, which writes the heat map, so early exit
+    // is only used if no heat map is requested (the heat map needs the error of every pixel).
+    std::unique_ptr<float[]> errorMap = heatMapPath.empty() ? nullptr : std::make_unique<float[]>(size_t(width) * height);
+    auto pixelMetric = metric.create(*imageA, *imageB, options.alpha);
+    CompareResult result =
+        compare(*pixelMetric, width, height, std::max(options.tileSize, 1u), threshold, options.earlyExit && !errorMap, errorMap.get());
+
+    // Treat nans and infs as errors.
+    outcome.compared = true;
+    outcome.error = result.error;
+    outcome.lowerBound = result.stopped;
+    outcome.success = !std::isnan(result.error) && !std::isinf(result.error) && !result.stopped && result.error <= threshold;
+
+    // Generate heat map.
+    if (errorMap && !(options.heatMapOnFail && outcome.success))
     {
+        auto heatMap = generateHeatMap(width, height, errorMap.get());
         try
         {
-            image.saveToFile(path);
+            heatMap->saveToFile(heatMapPath);
         }
         catch (const std::runtime_error& e)
         {
-            std::cerr << "Cannot save image to '" << path.string() << "' (Error: " << e.what() << ")." << std::endl;
+            std::cerr << "Cannot save image to '" << heatMapPath.string() << "' (Error: " << e.what() << ")." << std::endl;
         }
-    };
+    }
 
-    // Load images.
-    auto imageA = loadImage(pathA);
-    if (!imageA)
+    return outcome;
+}
+
+static const ErrorMetric* findMetric(const std::string& name)
+{
+    auto it = std::find_if(errorMetrics.begin(), errorMetrics.end(), [&name](const ErrorMetric& metric) { return metric.name == name; });
+    return it != errorMetrics.end() ? &*it : nullptr;
+}
+
+/**
+ * Compare a list of image pairs read from a file.
+ * Every line contains the tab separated fields: metric, threshold, image1, image2 and heat map filename (may be empty).
+ * For every line, a line "<passed|failed> <error>" or "error <message>" is written to stdout.
+ * If the comparison stopped early, " (lower bound)" is appended to the error.
+ * The first images are kept in an LRU cache, so pairs sharing the first image should be listed next to each other.
+ */
+static bool compareBatch(const std::filesystem::path& batchPath, size_t cacheSize, const CompareOptions& options)
+{
+    std::ifstream batchFile(batchPath);
+    if (!batchFile)
+    {
+        std::cerr << "Cannot open batch file '" << batchPath.string() << "'." << std::endl;
         return false;
-    auto imageB = loadImage(pathB);
-    if (!imageB)
+    }
+
+    ImageCache cache(cacheSize);
+    std::string line;
+    while (std::getline(batchFile, line))
+    {
+        if (!line.empty() && line.back() == '\r')
+            line.pop_back();
+        if (line.empty())
+            continue;
+
+        std::vector<std::string> fields;
+        std::stringstream stream(line);
+        std::string field;
+        while (std::getline(stream, field, '\t'))
+            fields.push_back(field);
+        fields.resize(std::max<size_t>(fields.size(), 5));
+
+        const ErrorMetric* metric = findMetric(fields[0]);
+        if (!metric)
+        {
+            std::cout << "error Unknown error metric '" << fields[0] << "'." << std::endl;
+            continue;
+        }
+
+        float threshold;
+        try
+        {
+            threshold = std::stof(fields[1]);
+        }
+        catch (const std::exception&)
+        {
+            std::cout << "error Invalid threshold '" << fields[1] << "'." << std::endl;
+            continue;
+        }
+
+        CompareOutcome outcome = compareImages(cache, fields[2], fields[3], *metric, threshold, fields[4], options);
+        if (outcome.compared)
+            std::cout << (outcome.success ? "passed " : "failed ") << outcome.error << (outcome.lowerBound ? " (lower bound)" : "") << std::endl;
+        else
+            std::cout << "error " << outcome.message << std::endl;
+    }
+
+    return true;
+}
+
+/**
+ * Write a downscaled preview of an image, so that its larger side is at most maxSize pixels (images are never upscaled).
+ * Pixels are box filtered. High dynamic range images (EXR, PFM, HDR) are tonemapped by clamping and sRGB encoding,
+ * which matches the default view of the image test viewer.
+ */
+static bool writePreview(const std::filesystem::path& path, const std::filesystem::path& previewPath, uint32_t maxSize)
+{
+    std::shared_ptr<Image> image;
+    try
+    {
+        image = Image::loadFromFile(path);
+    }
+    catch (const std::runtime_error& e)
+    {
+        std::cerr << "Cannot load image from '" << path.string() << "' (Error: " << e.what() << ")." << std::endl;
         return false;
+    }
+
+    const uint32_t width = image->getWidth();
+    const uint32_t height = image->getHeight();
+    const float scale = std::min(1.f, float(std::max(maxSize, 1u)) / std::max({width, height, 1u}));
+    const uint32_t previewWidth = std::max(1u, uint32_t(std::round(width * scale)));
+    const uint32_t previewHeight = std::max(1u, uint32_t(std::round(height * scale)));
+
+    auto preview = Image::create(previewWidth, previewHeight);
+    const float* src = image->getData();
+    float* dst = preview->getData();
+    for (uint32_t y = 0; y < previewHeight; ++y)
+    {
+        uint32_t y0 = uint32_t(uint64_t(y) * height / previewHeight);
+        uint32_t y1 = std::max(y0 + 1, uint32_t(uint64_t(y + 1) * height / previewHeight));
+        for (uint32_t x = 0; x < previewWidth; ++x)
+        {
+            uint32_t x0 = uint32_t(uint64_t(x) * width / previewWidth);
+            uint32_t x1 = std::max(x0 + 1, uint32_t(uint64_t(x + 1) * width / previewWidth));
+            float sum[4] = {0.f, 0.f, 0.f, 0.f};
+            for (uint32_t sy = y0; sy < y1; ++sy)
+            {
+                for (uint32_t sx = x0; sx < x1; ++sx)
+                {
+                    const float* pixel = src + (size_t(sy) * width + sx) * 4;
+                    for (size_t i = 0; i < 4; ++i)
+                        sum[i] += pixel[i];
+                }
+            }
+            const float count = float((y1 - y0) * (x1 - x0));
+            for (size_t i = 0; i < 4; ++i)
+                *dst++ = sum[i] / count;
+        }
+    }
+
+    // Tonemap high dynamic range images.
+    FREE_IMAGE_FORMAT fifFormat = FreeImage_GetFIFFromFilename(path.string().c_str());
+    if (fifFormat == FIF_EXR || fifFormat == FIF_PFM || fifFormat == FIF_HDR)
+    {
+        float* data = preview->getData();
+        for (size_t i = 0; i < size_t(previewWidth) * previewHeight * 4; ++i)
+        {
+            if (i % 4 == 3)
+                continue;
+            float v = std::isnan(data[i]) ? 0.f : clamp(data[i], 0.f, 1.f);
+            data[i] = v <= 0.0031308f ? 12.92f * v : 1.055f * std::pow(v, 1.f / 2.4f) - 0.055f;
+        }
+    }
+
+    try
+    {
+        preview->saveToFile(previewPath, false);
+    }
+    catch (const std::runtime_error& e)
+    {
+        std::cerr << "Cannot save image to '" << previewPath.string() << "' (Error: " << e.what() << ")." << std::endl;
+        return false;
+    }
+
+    return true;
+}
+
+/**
+ * Loss functions of the per-pixel loss maps (same definitions as the loss maps computed by the JERI viewer).
+ */
+static const std::vector<std::string> lossFunctions = {"L1", "L2", "MAPE", "MRSE", "SMAPE", "SSIM"};
+
+/**
+ * Write the loss maps of two images to <directory>/<function>.exr.
+ * As in JERI, the second image is used as the reference for the relative loss functions.
+ * SSIM is computed on the luminance of the untonemapped images using a 5x5 window.
+ */
+static bool writeLossMaps(const std::filesystem::path& pathA, const std::filesystem::path& pathB, const std::filesystem::path& directory)
+{
+    std::shared_ptr<Image> imageA, imageB;
+    for (auto [path, image] : {std::make_pair(&pathA, &imageA), std::make_pair(&pathB, &imageB)})
+    {
+        try
+        {
+            *image = Image::loadFromFile(*path);
+        }
+        catch (const std::runtime_error& e)
+        {
+            std::cerr << "Cannot load image from '" << path->string() << "' (Error: " << e.what() << ")." << std::endl;
+            return false;
+        }
+    }
 
-    // Check resolution.
     if (imageA->getWidth() != imageB->getWidth() || imageA->getHeight() != imageB->getHeight())
     {
         std::cerr << "Cannot compare images with different resolutions." << std::endl;
         return false;
     }
 
-    uint32_t width = imageA->getWidth();
-    uint32_t height = imageB->getHeight();
+    const uint32_t width = imageA->getWidth();
+    const uint32_t height = imageA->getHeight();
+    const size_t count = size_t(width) * height * 4;
+    const float* a = imageA->getData();
+    const float* b = imageB->getData();
 
-    // Compare images.
-    std::unique_ptr<float[]> errorMap = heatMapPath.empty() ? nullptr : std::make_unique<float[]>(width * height);
-    double error = metric.compare(*imageA, *imageB, alpha, errorMap.get());
+    auto writeMap = [&](const std::string& function, const Image& map)
+    {
+        // EXR images are written with half precision.
+        auto path = directory / (function + ".exr");
+        try
+        {
+            map.saveToFile(path, false);
+        }
+        catch (const std::runtime_error& e)
+        {
+            std::cerr << "Cannot save image to '" << path.string() << "' (Error: " << e.what() << ")." << std::endl;
+            return false;
+        }
+        return true;
+    };
 
-    // Generate heat map.
-    if (errorMap)
+    auto map = Image::create(width, height);
+    float* dst = map->getData();
+    for (const auto& function : lossFunctions)
     {
-        auto heatMap = generateHeatMap(width, height, errorMap.get());
-        saveImage(*heatMap, heatMapPath);
+        if (function == "SSIM")
+            continue;
+        for (size_t i = 0; i < count; ++i)
+        {
+            if (i % 4 == 3)
+            {
+                dst[i] = 1.f;
+                continue;
+            }
+            float diff = a[i] - b[i];
+            if (function == "L1")
+                dst[i] = std::abs(diff);
+            else if (function == "L2")
+                dst[i] = diff * diff;
+            else if (function == "MAPE")
+                dst[i] = std::abs(diff) / (std::abs(b[i]) + 1e-2f);
+            else if (function == "MRSE")
+                dst[i] = diff * diff / (b[i] * b[i] + 1e-4f);
+            else
+                dst[i] = 2.f * std::abs(diff) / (std::abs(a[i]) + std::abs(b[i]) + 2e-2f);
+        }
+        if (!writeMap(function, *map))
+            return false;
     }
 
-    std::cout << error << std::endl;
+    // Build summed area tables of the luminance moments for SSIM.
+    const size_t stride = width + 1;
+    std::vector<double> tables[5];
+    for (auto& table : tables)
+        table.assign(stride * (height + 1), 0.0);
+    for (uint32_t y = 0; y < height; ++y)
+    {
+        for (uint32_t x = 0; x < width; ++x)
+        {
+            size_t i = (size_t(y) * width + x) * 4;
+            double la = 0.2126 * a[i] + 0.7152 * a[i + 1] + 0.0722 * a[i + 2];
+            double lb = 0.2126 * b[i] + 0.7152 * b[i + 1] + 0.0722 * b[i + 2];
+            double values[5] = {la, lb, la * la, lb * lb, la * lb};
+            size_t j = (y + 1) * stride + x + 1;
+            for (size_t k = 0; k < 5; ++k)
+                tables[k][j] = values[k] + tables[k][j - 1] + tables[k][j - stride] - tables[k][j - stride - 1];
+        }
+    }
 
-    // Treat nans and infs as errors.
-    if (std::isnan(error) || std::isinf(error))
-        return false;
+    const uint32_t radius = 2;
+    const double c1 = sqr(0.01);
+    const double c2 = sqr(0.03);
+    for (uint32_t y = 0; y < height; ++y)
+    {
+        uint32_t y0 = y >= radius ? y - radius : 0;
+        uint32_t y1 = std::min(y + radius + 1, height);
+        for (uint32_t x = 0; x < width; ++x)
+        {
+            uint32_t x0 = x >= radius ? x - radius : 0;
+            uint32_t x1 = std::min(x + radius + 1, width);
+            double n = double(x1 - x0) * (y1 - y0);
+            double m[5];
+            for (size_t k = 0; k < 5; ++k)
+            {
+                const auto& t = tables[k];
+                m[k] = (t[y1 * stride + x1] - t[y0 * stride + x1] - t[y1 * stride + x0] + t[y0 * stride + x0]) / n;
+            }
+            double varA = m[2] - sqr(m[0]);
+            double varB = m[3] - sqr(m[1]);
+            double covAB = m[4] - m[0] * m[1];
+            double ssim = ((2.0 * m[0] * m[1] + c1) * (2.0 * covAB + c2)) / ((sqr(m[0]) + sqr(m[1]) + c1) * (varA + varB + c2));
+            float* pixel = dst + (size_t(y) * width + x) * 4;
+            pixel[0] = pixel[1] = pixel[2] = float(1.0 - ssim);
+            pixel[3] = 1.f;
+        }
+    }
 
-    return error <= threshold;
+    return writeMap("SSIM", *map);
 }
 
 static void printMetrics(std::ostream& stream = std::cout)
@@ -389,8 +966,16 @@ int main(int argc, char** argv)
     args::ValueFlag<float> thresholdFlag(parser, "threshold", "The error threshold.", {'t'});
     args::Flag alphaFlag(parser, "", "Include alpha channel.", {'a'});
     args::ValueFlag<std::string> heatMapFlag(parser, "filename", "Generate error heat map.", {'e'});
-    args::Positional<std::string> image1(parser, "image1", "The first image.", args::Options::Required);
-    args::Positional<std::string> image2(parser, "image2", "The second image.", args::Options::Required);
+    args::Flag heatMapOnFailFlag(parser, "", "Only write the error heat map if the comparison fails.", {'f'});
+    args::Flag earlyExitFlag(parser, "", "Stop as soon as the error is known to exceed the threshold (the reported error is a lower bound). Ignored if a heat map is written.", {'x'});
+    args::ValueFlag<uint32_t> tileSizeFlag(parser, "size", "Tile size used for comparing images (default: 64).", {"tile-size"});
+    args::ValueFlag<std::string> batchFlag(parser, "filename", "Compare the image pairs listed in a file instead of two images.", {"batch"});
+    args::ValueFlag<uint32_t> cacheSizeFlag(parser, "count", "Number of decoded first images cached in batch mode (default: 4).", {"cache-size"});
+    args::ValueFlag<std::string> previewFlag(parser, "filename", "Write a downscaled and tonemapped preview of the first image.", {"preview"});
+    args::ValueFlag<uint32_t> previewSizeFlag(parser, "size", "Maximum width and height of the preview (default: 256).", {"preview-size"});
+    args::ValueFlag<std::string> lossMapsFlag(parser, "directory", "Write the L1, L2, MAPE, MRSE, SMAPE and SSIM loss maps of the two images to a directory.", {"loss-maps"});
+    args::Positional<std::string> image1(parser, "image1", "The first image.");
+    args::Positional<std::string> image2(parser, "image2", "The second image.");
     args::CompletionFlag completionFlag(parser, {"complete"});
 
     try
@@ -426,28 +1011,63 @@ int main(int argc, char** argv)
         return 0;
     }
 
-    ErrorMetric metric = errorMetrics.front();
+    CompareOptions options;
+    options.alpha = alphaFlag;
+    options.tileSize = tileSizeFlag ? args::get(tileSizeFlag) : 64;
+    options.earlyExit = earlyExitFlag;
+    options.heatMapOnFail = heatMapOnFailFlag;
+
+    if (batchFlag)
+        return compareBatch(args::get(batchFlag), cacheSizeFlag ? args::get(cacheSizeFlag) : 4, options) ? 0 : 1;
+
+    if (previewFlag)
+    {
+        if (!image1)
+        {
+            std::cerr << "An image is required." << std::endl;
+            std::cerr << parser;
+            return 1;
+        }
+        return writePreview(args::get(image1), args::get(previewFlag), previewSizeFlag ? args::get(previewSizeFlag) : 256) ? 0 : 1;
+    }
+
+    if (!image1 || !image2)
+    {
+        std::cerr << "Two images are required." << std::endl;
+        std::cerr << parser;
+        return 1;
+    }
+
+    if (lossMapsFlag)
+        return writeLossMaps(args::get(image1), args::get(image2), args::get(lossMapsFlag)) ? 0 : 1;
+
+    const ErrorMetric* metric = &errorMetrics.front();
     if (metricFlag)
     {
-        auto name = args::get(metricFlag);
-        auto it =
-            std::find_if(errorMetrics.begin(), errorMetrics.end(), [&name](const ErrorMetric& metric) { return metric.name == name; });
-        if (it == errorMetrics.end())
+        metric = findMetric(args::get(metricFlag));
+        if (!metric)
         {
             std::cerr << "Unknown error metric '" << args::get(metricFlag) << "'." << std::endl;
             printMetrics(std::cerr);
             return 1;
         }
-        metric = *it;
     }
 
-    bool success = compareImages(
+    ImageCache cache(0);
+    CompareOutcome outcome = compareImages(
+        cache,
         args::get(image1),
         args::get(image2),
-        metric,
+        *metric,
         thresholdFlag ? args::get(thresholdFlag) : 0.f,
-        alphaFlag ? args::get(alphaFlag) : false,
-        heatMapFlag ? args::get(heatMapFlag) : ""
+        heatMapFlag ? args::get(heatMapFlag) : "",
+        options
     );
-    return success ? 0 : 1;
+    if (!outcome.compared)
+    {
+        std::cerr << outcome.message << std::endl;
+        return 1;
+    }
+    std::cout << outcome.error << (outcome.lowerBound ? " (lower bound)" : "") << std::endl;
+    return outcome.success ? 0 : 1;
 }
@@ -0,0 +1,81 @@
+import argparse
+import time
+
+import torch
+
+import mesh_utils
+
+
+def create_grid_mesh(resolution: int, device):
+    """
+    Create a wavy grid mesh with resolution x resolution vertices and 2 * (resolution - 1)^2 triangles.
+    """
+    u, v = torch.meshgrid(
+        torch.linspace(0.0, 1.0, resolution, device=device),
+        torch.linspace(0.0, 1.0, resolution, device=device),
+        indexing="ij",
+    )
+    height = 0.1 * torch.sin(10.0 * u) * torch.cos(10.0 * v)
+    v_pos = torch.stack([u, v, height], dim=-1).reshape(-1, 3)
+    v_texcrd = torch.stack([u, v, torch.zeros_like(u)], dim=-1).reshape(-1, 3)
+
+    i = torch.arange(resolution - 1, device=device)
+    corner = (i[:, None] * resolution + i[None, :]).reshape(-1)
+    tri_idx = torch.cat([
+        torch.stack([corner, corner + resolution, corner + 1], dim=-1),
+        torch.stack([corner + 1, corner + resolution, corner + resolution + 1], dim=-1),
+    ]).to(torch.int32)
+    return mesh_utils.Mesh(tri_idx=tri_idx, v_pos=v_pos, v_texcrd=v_texcrd)
+
+
+def scatter_normals(mesh: mesh_utils.Mesh):
+    """
+    Previous implementation of Mesh.compute_normals (before normalization), used as a baseline.
+    """
+    idx = [mesh.tri_idx[:, i].type(torch.int64) for i in range(3)]
+    pos = [mesh.v_pos[idx[i], :] for i in range(3)]
+    face_normals = torch.cross(pos[1] - pos[0], pos[2] - pos[0], dim=-1)
+    v_normals = torch.zeros_like(mesh.v_pos)
+    for i in range(3):
+        v_normals.scatter_add_(0, idx[i][:, None].repeat(1, 3), face_normals)
+    return v_normals
+
+
+def benchmark(name, fn, device, iterations):
+    fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+    elapsed = (time.perf_counter() - start) / iterations
+    print("  {:<28s} {:8.2f} ms".format(name, elapsed * 1000.0))
+
+
+def main(args):
+    devices = [args.device] if args.device else ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+    for device in map(torch.device, devices):
+        mesh = create_grid_mesh(args.resolution, device)
+        print("{}: {} vertices, {} triangles".format(device, mesh.v_pos.shape[0], mesh.tri_idx.shape[0]))
+
+        # Check that the sparse splat matches the scatter baseline.
+        topology = mesh.get_topology()
+        pos = topology.corners(mesh.v_pos)
+        normals = topology.splat(torch.cross(pos[1] - pos[0], pos[2] - pos[0], dim=-1))
+        max_diff = (normals - scatter_normals(mesh)).abs().max().item()
+        print("  max difference to baseline: {:.3g}".format(max_diff))
+
+        benchmark("topology (built once)", lambda: mesh_utils.MeshTopology(mesh.tri_idx, mesh.v_pos.shape[0], device), device, args.iterations)
+        benchmark("scatter normals (baseline)", lambda: scatter_normals(mesh), device, args.iterations)
+        benchmark("compute_normals", mesh.compute_normals, device, args.iterations)
+        benchmark("compute_tangents", mesh.compute_tangents, device, args.iterations)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark vertex normal and tangent computation of mesh_utils.Mesh.")
+    parser.add_argument("--resolution", type=int, default=708, help="Grid resolution (708 gives about one million triangles).")
+    parser.add_argument("--iterations", type=int, default=10, help="Number of timed iterations.")
+    parser.add_argument("--device", type=str, default=None, help="Device to run on (default: cpu and cuda if available).")
+    main(parser.parse_args())
@@ -0,0 +1,108 @@
+import argparse
+import sys
+
+import torch
+
+from material_layout import MaterialParamLayoutPlan
+
+
+# Mock material types and parameter layouts (offsets and sizes within the parameters of a material).
+MOCK_PARAM_KEYS = {
+    "Standard": ["base_color", "metallic", "roughness"],
+    "Diffuse": ["diffuse"],
+    "Conductor": ["eta", "k", "roughness"],
+}
+MOCK_LAYOUTS = {
+    "Standard": {"base_color": {"offset": 0, "size": 3}, "metallic": {"offset": 4, "size": 1}, "roughness": {"offset": 5, "size": 1}},
+    "Diffuse": {"diffuse": {"offset": 2, "size": 3}},
+    "Conductor": {"eta": {"offset": 0, "size": 3}, "k": {"offset": 3, "size": 3}, "roughness": {"offset": 8, "size": 2}},
+}
+MOCK_PARAM_SIZE = 20
+
+
+def reference_dicts(material_types, raw_params):
+    """
+    Slow reference conversion from flattened parameters to parameter dictionaries (one slice per material and key).
+    """
+    res = {}
+    for material_type, keys in MOCK_PARAM_KEYS.items():
+        idx = [i for i, t in enumerate(material_types) if t == material_type]
+        res[material_type] = {"idx": idx}
+        for key in keys:
+            offset = MOCK_LAYOUTS[material_type][key]["offset"]
+            size = MOCK_LAYOUTS[material_type][key]["size"]
+            slices = [raw_params[i * MOCK_PARAM_SIZE + offset : i * MOCK_PARAM_SIZE + offset + size] for i in idx]
+            res[material_type][key] = torch.cat(slices) if slices else raw_params.new_zeros(0)
+    return res
+
+
+def check(name, condition):
+    print("  {:<40s} : {}".format(name, "PASSED" if condition else "FAILED"))
+    return condition
+
+
+def check_plan(material_types, device, generator):
+    """
+    Check the layout plan of a list of material types on flattened parameters with random values.
+    """
+    raw_params = torch.rand(MOCK_PARAM_SIZE * len(material_types), generator=generator).to(device)
+    plan = MaterialParamLayoutPlan(material_types, MOCK_LAYOUTS, MOCK_PARAM_SIZE, MOCK_PARAM_KEYS)
+    success = True
+
+    # Flattened parameters -> dictionaries matches the reference conversion.
+    dicts = plan.to_dicts(raw_params)
+    expected = reference_dicts(material_types, raw_params)
+    success &= check("to_dicts matches reference", all(
+        dicts[t]["idx"] == expected[t]["idx"] and all(torch.equal(dicts[t][k], expected[t][k]) for k in keys)
+        for t, keys in MOCK_PARAM_KEYS.items()
+    ))
+
+    # Dictionaries -> flattened parameters gives back the input.
+    success &= check("round trip", torch.equal(plan.to_raw_params(dicts, raw_params), raw_params))
+
+    # Modified dictionaries only change the parameters covered by the layouts.
+    modified = {t: {k: (v + 1.0 if k != "idx" else v) for k, v in d.items()} for t, d in dicts.items()}
+    updated = plan.to_raw_params(modified, raw_params)
+    covered = torch.zeros_like(raw_params, dtype=torch.bool)
+    covered[plan.index(device)] = True
+    success &= check("update", torch.allclose(updated[covered], raw_params[covered] + 1.0) and torch.equal(updated[~covered], raw_params[~covered]))
+
+    # Gradient path: gradients of the flattened parameters (as returned by Falcor) converted with to_dicts
+    # match the gradients flowing back through to_raw_params.
+    weights = torch.rand(raw_params.shape, generator=generator).to(device)
+    leaves = {t: {k: v.detach().clone().requires_grad_(True) for k, v in d.items() if k != "idx"} for t, d in dicts.items()}
+    inputs = {t: dict(leaves[t], idx=dicts[t]["idx"]) for t in dicts}
+    (plan.to_raw_params(inputs, raw_params) * weights).sum().backward()
+    grads = plan.to_dicts(weights)
+    success &= check("gradient of to_raw_params", all(
+        leaves[t][k].numel() == 0 or torch.allclose(leaves[t][k].grad, grads[t][k]) for t, keys in MOCK_PARAM_KEYS.items() for k in keys
+    ))
+
+    # Gradients flow back through to_dicts to the covered parameters.
+    raw_leaf = raw_params.clone().requires_grad_(True)
+    sum(d[k].sum() for d in plan.to_dicts(raw_leaf).values() for k in d if k != "idx").backward()
+    success &= check("gradient of to_dicts", torch.equal(raw_leaf.grad, covered.to(raw_params.dtype)))
+
+    return success
+
+
+def main(args):
+    device = torch.device(args.device)
+    generator = torch.Generator().manual_seed(0)
+    types = list(MOCK_PARAM_KEYS.keys())
+    material_types = [types[i] for i in torch.randint(0, len(types), (args.materials,), generator=generator).tolist()]
+
+    success = True
+    print("All material types:")
+    success &= check_plan(material_types, device, generator)
+    # Material types without materials have empty parameters.
+    print("Without {} materials:".format(types[1]))
+    success &= check_plan([t if t != types[1] else types[0] for t in material_types], device, generator)
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check MaterialParamLayoutPlan on CPU tensors with a mock layout (Falcor is not required).")
+    parser.add_argument("--materials", type=int, default=64, help="Number of materials.")
+    parser.add_argument("--device", type=str, default="cpu", help="Device to run on.")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,79 @@
+import torch
+
+
+class MaterialParamLayoutPlan:
+    """
+    Precomputed mapping between flattened Falcor material parameters and parameter dictionaries.
+
+    All parameters of the dictionaries are concatenated (by material type and key, each one ordered
+    by material) into a single vector, which is gathered from the flattened parameters with one
+    `index_select` and scattered back with one `index_copy_`.
+    The plan only depends on the material types and parameter layouts, so it can be built without
+    a scene or Falcor (e.g. from CPU tensors and a mock layout, see check_material_layout.py).
+    """
+
+    def __init__(self, material_types, layouts, material_param_size, param_keys):
+        """
+        @param[in] material_types: material type of each material.
+        @param[in] layouts: dictionary mapping material types to parameter layouts ({key: {"offset", "size"}}).
+        @param[in] material_param_size: number of flattened parameters per material.
+        @param[in] param_keys: dictionary mapping material types to their parameter keys (see material_utils.MATERIAL_PARAM_KEYS).
+        """
+        self.material_count = len(material_types)
+        self.material_param_size = material_param_size
+        self.idx = {material_type: [] for material_type in param_keys}
+        for i, material_type in enumerate(material_types):
+            self.idx[material_type].append(i)
+
+        # Slices of the concatenated parameters (material_type, key, start, length).
+        self.slices = []
+        indices = []
+        start = 0
+        for material_type, keys in param_keys.items():
+            material_offsets = torch.tensor(self.idx[material_type], dtype=torch.int64) * material_param_size
+            for key in keys:
+                # Layouts are only required for material types used by the materials.
+                if material_offsets.numel() == 0:
+                    key_indices = torch.zeros(0, dtype=torch.int64)
+                else:
+                    offset = layouts[material_type][key]["offset"]
+                    size = layouts[material_type][key]["size"]
+                    key_indices = (material_offsets[:, None] + offset + torch.arange(size, dtype=torch.int64)[None, :]).reshape(-1)
+                indices.append(key_indices)
+                self.slices.append((material_type, key, start, key_indices.numel()))
+                start += key_indices.numel()
+        self.index_cpu = torch.cat(indices)
+        self.indices = {}
+
+    def index(self, device):
+        """
+        Return the gather index on a device (copied once per device).
+        """
+        device = torch.device(device)
+        if device not in self.indices:
+            self.indices[device] = self.index_cpu.to(device)
+        return self.indices[device]
+
+    def to_dicts(self, raw_params):
+        """
+        @param[in] raw_params: torch.FloatTensor[material_param_size * M], flattened material parameters.
+        @return parameter dictionaries (parameters are views of a single gathered tensor).
+        """
+        values = raw_params.index_select(0, self.index(raw_params.device))
+        params_dicts = {material_type: {} for material_type in self.idx}
+        for material_type, key, start, length in self.slices:
+            params_dicts[material_type][key] = values[start : start + length]
+        for material_type, idx in self.idx.items():
+            params_dicts[material_type]["idx"] = list(idx)
+        return params_dicts
+
+    def to_raw_params(self, params_dicts, input_raw_params):
+        """
+        @param[in] params_dicts: parameter dictionaries.
+        @param[in] input_raw_params: torch.FloatTensor[material_param_size * M], original flattened material parameters.
+        @return updated flattened material parameters.
+        """
+        values = torch.cat([params_dicts[material_type][key].reshape(-1) for material_type, key, _, _ in self.slices])
+        res = input_raw_params.clone()
+        res.index_copy_(0, self.index(res.device), values.to(res.dtype))
+        return res
@@ -51,7 +51,7 @@ class DiffRenderFunction(torch.autograd.Function):
 
         # Convert material parameter dictionaries to flattened raw parameters for Falcor.
         material_params_raw = material_utils.dicts_to_raw_params(
-            testbed.scene, params["material_ids"], new_dicts, params["init_material_raw"]
+            testbed.scene, params["material_ids"], new_dicts, params["init_material_raw"], params["material_layout_plan"]
         )
 
         material_ids_buffer : falcor.Buffer = context["buffers"]["material_ids"]
@@ -88,6 +88,7 @@ class DiffRenderFunction(torch.autograd.Function):
             testbed.scene,
             context["params"]["material_ids"],
             grad_raw[falcor.GradientType.Material],
+            context["params"]["material_layout_plan"],
         )
 
         return (
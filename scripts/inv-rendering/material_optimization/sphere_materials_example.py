@@ -135,14 +135,19 @@ class SphereMaterialsExample:
         init_scene.get_material_params(material_ids_buffer, material_params_buffer)
         device.render_context.wait_for_falcor()
         self.init_raw_material_params = falcor_to_torch(material_params_buffer)
+        # The layout plan is reused by every forward and backward pass.
+        self.material_layout_plan = material_utils.build_layout_plan(
+            init_scene, material_ids, falcor.Material.PARAM_COUNT
+        )
         self.init_material_params = material_utils.raw_params_to_dicts(
-            init_scene, material_ids, self.init_raw_material_params
+            init_scene, material_ids, self.init_raw_material_params, self.material_layout_plan
         )
 
         params = {
             "init_material_dicts": self.init_material_params,
             "init_material_raw": self.init_raw_material_params,
             "material_ids": material_ids,
+            "material_layout_plan": self.material_layout_plan,
         }
 
         init_img = common.render_primal(spp["ref"], self.testbed, self.passes)
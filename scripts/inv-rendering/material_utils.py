@@ -3,81 +3,55 @@ import falcor
 import numpy as np
 
 from loss import compute_render_loss_L2
+from material_layout import MaterialParamLayoutPlan
 
 
-def raw_params_to_dicts(scene : falcor.Scene, material_ids, raw_params):
+# Parameter keys of the material types supported by the parameter dictionaries.
+MATERIAL_PARAM_KEYS = {
+    falcor.MaterialType.Standard: ["base_color", "metallic", "roughness"],
+    falcor.MaterialType.PBRTDiffuse: ["diffuse"],
+    falcor.MaterialType.PBRTConductor: ["eta", "k", "roughness"],
+}
+
+
+def build_layout_plan(scene : falcor.Scene, material_ids, material_param_size):
+    """
+    Build the layout plan of the materials of a scene.
+    Material types are only queried once per material and layouts once per material type.
+    @param[in] scene: falcor.Scene.
+    @param[in] material_ids: torch.IntTensor[M], material ids.
+    @param[in] material_param_size: number of flattened parameters per material.
+    """
+    material_types = [scene.get_material(int(material_id)).type for material_id in material_ids]
+    layouts = {material_type: falcor.get_material_param_layout(material_type) for material_type in set(material_types)}
+    return MaterialParamLayoutPlan(material_types, layouts, material_param_size, MATERIAL_PARAM_KEYS)
+
+
+def raw_params_to_dicts(scene : falcor.Scene, material_ids, raw_params, plan=None):
     """
     @param[in] scene: falcor.Scene.
     @param[in] material_ids: torch.IntTensor[M], material ids.
     @param[in] raw_params: torch.FloatTensor[20 * M], flattened material parameters from Falcor.
+    @param[in] plan: layout plan (see build_layout_plan), built from the scene if not given.
     @return parameter dictionaries.
     """
-    device = torch.device("cuda:0")
-    params_dicts = {
-        falcor.MaterialType.Standard: {
-            "base_color": torch.zeros(0, device=device),
-            "metallic": torch.zeros(0, device=device),
-            "roughness": torch.zeros(0, device=device),
-            "idx": [],
-        },
-        falcor.MaterialType.PBRTDiffuse: {
-            "diffuse": torch.zeros(0, device=device),
-            "idx": [],
-        },
-        falcor.MaterialType.PBRTConductor: {
-            "eta": torch.zeros(0, device=device),
-            "k": torch.zeros(0, device=device),
-            "roughness": torch.zeros(0, device=device),
-            "idx": [],
-        }
-    }
-
-    material_param_size = raw_params.shape[0] // material_ids.shape[0]
-    for i in range(material_ids.shape[0]):
-        material_type = scene.get_material(material_ids[i]).type
-        params = params_dicts[material_type]
-        layout = falcor.get_material_param_layout(material_type)
-        for key in params:
-            if key == "idx":
-                params[key].append(i)
-            else:
-                offset = layout[key]["offset"]
-                size = layout[key]["size"]
-                params[key] = torch.concat(
-                    (
-                        params[key],
-                        raw_params[i * material_param_size + offset : i * material_param_size + offset + size],
-                    )
-                )
-
-    return params_dicts
+    if plan is None:
+        plan = build_layout_plan(scene, material_ids, raw_params.shape[0] // material_ids.shape[0])
+    return plan.to_dicts(raw_params)
 
 
-def dicts_to_raw_params(scene, material_ids, params_dicts, input_raw_params):
+def dicts_to_raw_params(scene, material_ids, params_dicts, input_raw_params, plan=None):
     """
     @param[in] scene: falcor.Scene.
     @param[in] material_ids: torch.IntTensor[M], material ids.
     @param[in] params_dicts: parameter dictionaries.
     @param[in] input_raw_params: torch.FloatTensor[20 * M], original flattened material parameters.
+    @param[in] plan: layout plan (see build_layout_plan), built from the scene if not given.
     @return updated flattened material parameters for Falcor
     """
-    material_parameter_count = input_raw_params.shape[0] // material_ids.shape[0]
-    res = input_raw_params.clone()
-    for material_type in params_dicts:
-        layout = falcor.get_material_param_layout(material_type)
-        params = params_dicts[material_type]
-        for i in range(len(params["idx"])):
-            idx = params["idx"][i]
-            for key in params:
-                if key == "idx":
-                    continue
-                offset = layout[key]["offset"]
-                size = layout[key]["size"]
-                res[
-                    idx * material_parameter_count + offset : idx * material_parameter_count + offset + size
-                ] = params[key][i * size : i * size + size]
-
-    return res
+    if plan is None:
+        plan = build_layout_plan(scene, material_ids, input_raw_params.shape[0] // material_ids.shape[0])
+    return plan.to_raw_params(params_dicts, input_raw_params)
 
 
 def compute_loss_params(params_dicts, ref_params_dicts):
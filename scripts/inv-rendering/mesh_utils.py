@@ -21,6 +21,45 @@ def normalize_safe(x: torch.Tensor, eps: float = EPS) -> torch.Tensor:
     return x / length_safe(x, eps)
 
 
+class MeshTopology:
+    """
+    Per-vertex accumulation of per-triangle values, built once per triangle index tensor.
+    The sparse vertex-triangle incidence matrix (V x F) has a one for every corner of every triangle,
+    so summing the values of the triangles adjacent to each vertex is a single sparse matmul.
+    """
+
+    def __init__(self, tri_idx: torch.Tensor, vertex_count: int, device):
+        self.tri_idx = tri_idx
+        self.vertex_count = vertex_count
+        self.device = torch.device(device)
+
+        self.idx = tri_idx.to(device=self.device, dtype=torch.int64)
+        triangle_count = self.idx.shape[0]
+        rows = self.idx.reshape(-1)
+        cols = torch.arange(triangle_count, dtype=torch.int64, device=self.device).repeat_interleave(3)
+        # Coalescing sums duplicate entries, so degenerate triangles are counted per corner.
+        self.incidence = torch.sparse_coo_tensor(
+            torch.stack([rows, cols]),
+            torch.ones(rows.shape[0], dtype=torch.float32, device=self.device),
+            (vertex_count, triangle_count),
+        ).coalesce()
+
+    def matches(self, tri_idx: torch.Tensor, vertex_count: int, device) -> bool:
+        return self.tri_idx is tri_idx and self.vertex_count == vertex_count and self.device == torch.device(device)
+
+    def corners(self, v_attr: torch.Tensor):
+        """
+        Return the vertex attributes of the three corners of every triangle.
+        """
+        return v_attr[self.idx[:, 0], :], v_attr[self.idx[:, 1], :], v_attr[self.idx[:, 2], :]
+
+    def splat(self, tri_values: torch.Tensor) -> torch.Tensor:
+        """
+        Sum per-triangle values to the vertices of the triangles.
+        """
+        return torch.sparse.mm(self.incidence.to(tri_values.dtype), tri_values)
+
+
 class Mesh:
     def __init__(
         self,
@@ -35,6 +74,7 @@ class Mesh:
         self.v_norm = v_norm
         self.v_tangent = v_tangent
         self.v_texcrd = v_texcrd
+        self.topology = None
 
         self.buffers = {
             "triangleIndices": None,
@@ -105,28 +145,30 @@ class Mesh:
         tangents = self.compute_tangents()
         return normals, tangents
 
+    def get_topology(self) -> MeshTopology:
+        """
+        Return the topology of the mesh, which is rebuilt only when another triangle index tensor is assigned
+        or the vertex count or device of the positions change.
+        """
+        if self.topology is None or not self.topology.matches(self.tri_idx, self.v_pos.shape[0], self.v_pos.device):
+            self.topology = MeshTopology(self.tri_idx, self.v_pos.shape[0], self.v_pos.device)
+        return self.topology
+
     # From nvdiffrec.
     # Compute smooth vertex normals.
     def compute_normals(self):
-        idx = [
-            self.tri_idx[:, 0].type(torch.int64),
-            self.tri_idx[:, 1].type(torch.int64),
-            self.tri_idx[:, 2].type(torch.int64),
-        ]
-        pos = [self.v_pos[idx[0], :], self.v_pos[idx[1], :], self.v_pos[idx[2], :]]
-        face_normals = torch.cross(pos[1] - pos[0], pos[2] - pos[0])
+        topology = self.get_topology()
+        pos = topology.corners(self.v_pos)
+        face_normals = torch.cross(pos[1] - pos[0], pos[2] - pos[0], dim=-1)
 
         # Splat face normals to vertices.
-        v_normals = torch.zeros_like(self.v_pos)
-        v_normals.scatter_add_(0, idx[0][:, None].repeat(1, 3), face_normals)
-        v_normals.scatter_add_(0, idx[1][:, None].repeat(1, 3), face_normals)
-        v_normals.scatter_add_(0, idx[2][:, None].repeat(1, 3), face_normals)
+        v_normals = topology.splat(face_normals)
 
         # Normalize, replace zero (degenerated) normals with some default value.
         v_normals = torch.where(
             length(v_normals) > EPS,
             v_normals,
-            torch.tensor([0.0, 0.0, 1.0], dtype=torch.float32, device="cuda"),
+            torch.tensor([0.0, 0.0, 1.0], dtype=v_normals.dtype, device=v_normals.device),
         )
         v_normals = normalize_safe(v_normals)
 
@@ -140,19 +182,9 @@ class Mesh:
     # Compute tangent space from texture map coordinates.
     # Follows http://www.mikktspace.com/ conventions.
     def compute_tangents(self):
-        idx = [
-            self.tri_idx[:, 0].type(torch.int64),
-            self.tri_idx[:, 1].type(torch.int64),
-            self.tri_idx[:, 2].type(torch.int64),
-        ]
-        pos = [self.v_pos[idx[0], :], self.v_pos[idx[1], :], self.v_pos[idx[2], :]]
-        texcrd = [
-            self.v_texcrd[idx[0], :],
-            self.v_texcrd[idx[1], :],
-            self.v_texcrd[idx[2], :],
-        ]
-
-        v_tangents = torch.zeros_like(self.v_norm)
+        topology = self.get_topology()
+        pos = topology.corners(self.v_pos)
+        texcrd = topology.corners(self.v_texcrd)
 
         # Compute tangent space for each triangle.
         uve1 = texcrd[1] - texcrd[0]
@@ -169,20 +201,12 @@ class Mesh:
         )
 
         # Update all 3 vertices.
-        for i in range(3):
-            t_idx = idx[i][:, None].repeat(1, 3)
-            v_tangents.scatter_add_(0, t_idx, tang)
+        v_tangents = topology.splat(tang)
 
         # Normalize, replace zero (degenerated) tangents with some default value.
-        default_tangents = torch.where(
-            dot(
-                self.v_norm,
-                torch.tensor([1.0, 0.0, 0.0], dtype=torch.float32, device="cuda"),
-            )
-            > 0.9999,
-            torch.tensor([0.0, 1.0, 0.0], dtype=torch.float32, device="cuda"),
-            torch.tensor([1.0, 0.0, 0.0], dtype=torch.float32, device="cuda"),
-        )
+        x_axis = torch.tensor([1.0, 0.0, 0.0], dtype=v_tangents.dtype, device=v_tangents.device)
+        y_axis = torch.tensor([0.0, 1.0, 0.0], dtype=v_tangents.dtype, device=v_tangents.device)
+        default_tangents = torch.where(dot(self.v_norm, x_axis) > 0.9999, y_axis, x_axis)
         v_tangents = torch.where(length(v_tangents) > EPS, v_tangents, default_tangents)
         v_tangents = normalize_safe(v_tangents)
 
@@ -0,0 +1,9 @@
+@echo off
+
+set pwd=%~dp0
+set project_dir=%pwd%..\
+set python=%project_dir%tools\.packman\python\python.exe
+
+if not exist %python% call %project_dir%setup.bat
+
+call %python% %pwd%testing/compact_image_tests.py %*
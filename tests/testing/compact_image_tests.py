@@ -0,0 +1,139 @@
+'''
+Utility for pruning and compacting image test results.
+
+Keeps the most recent runs of every branch and removes older runs, drops result
+images of passing tests that are identical to their references and packs the
+remaining files of each run into a single indexed archive read by the viewer.
+'''
+
+import os
+import sys
+import argparse
+from pathlib import Path
+
+from core import Environment, config
+from core.helpers import hash_file
+from core.ref_store import read_json, write_json
+from core.results import ResultLayout, pack_run, remove_run
+
+def prune_runs(layout: ResultLayout, keep, dry_run):
+    '''
+    Remove all but the keep most recent finished runs of every branch.
+    Runs are grouped by the RETENTION_GROUP_TAGS recorded in their reports, falling back to the
+    tags of their run directories for reports not containing them (runs of older versions).
+    Returns the list of removed run directories.
+    '''
+    groups = {}
+    dates = {}
+    for run_dir in layout.finished_runs():
+        run = read_json(layout.result_dir / run_dir / 'report.json') or {}
+        tags = run if all(tag in run for tag in config.RETENTION_GROUP_TAGS) else layout.tags(run_dir)
+        key = tuple(tags.get(tag) for tag in config.RETENTION_GROUP_TAGS)
+        groups.setdefault(key, []).append(run_dir)
+        dates[run_dir] = run.get('date', '')
+
+    removed = []
+    for run_dirs in groups.values():
+        run_dirs.sort(key=lambda r: dates[r], reverse=True)
+        for run_dir in run_dirs[keep:]:
+            print(f'  Removing run {run_dir}')
+            if not dry_run:
+                remove_run(layout.result_dir, run_dir)
+            removed.append(run_dir)
+
+    return removed
+
+def drop_identical_images(layout: ResultLayout, run_dir, dry_run):
+    '''
+    Remove result images (and their error images) of a run that passed and are identical to their references.
+    Dropped images are marked with "dropped" and their hash in the test report, so the viewer shows the
+    reference instead. Returns the number of dropped images and their total size.
+    '''
+    count = 0
+    size = 0
+    for report_file in (layout.result_dir / run_dir).glob('*/**/report.json'):
+        test = read_json(report_file)
+        if not test or not 'ref_dir' in test:
+            continue
+
+        modified = False
+        for image in test.get('images', []):
+            if not image.get('success', False) or image.get('dropped', False):
+                continue
+            result_file = report_file.parent / image['name']
+            ref_file = Path(test['ref_dir']) / image['name']
+            if not result_file.exists() or not ref_file.exists() or result_file.stat().st_size != ref_file.stat().st_size:
+                continue
+            digest = hash_file(result_file)
+            if digest != hash_file(ref_file):
+                continue
+
+            count += 1
+            size += result_file.stat().st_size
+            if not dry_run:
+                result_file.unlink()
+                error_file = report_file.parent / (image['name'] + config.ERROR_IMAGE_SUFFIX)
+                if error_file.exists():
+                    error_file.unlink()
+                image['dropped'] = True
+                image['sha256'] = digest
+                modified = True
+
+        if modified:
+            write_json(report_file, test)
+
+    # Touch the run report, so result indexes pick up the modified test reports.
+    if count > 0 and not dry_run:
+        os.utime(layout.result_dir / run_dir / 'report.json')
+
+    return count, size
+
+def compact_results(layout: ResultLayout, keep, drop_identical, pack, dry_run):
+    '''
+    Prune old runs and compact the remaining ones.
+    '''
+    print(f'Result directory: {layout.result_dir}')
+
+    removed = []
+    if keep > 0 and not 'build_id' in layout.run_tags:
+        # Without a build ID in the layout, every run replaces the previous one in its run directory.
+        print('Not pruning runs (the result directory layout stores a single run per run directory)')
+    elif keep > 0:
+        print(f'Pruning runs (keeping {keep} runs per branch)')
+        removed = prune_runs(layout, keep, dry_run)
+        print(f'Removed {len(removed)} runs')
+
+    for run_dir in layout.finished_runs():
+        if run_dir in removed:
+            continue
+        if drop_identical:
+            count, size = drop_identical_images(layout, run_dir, dry_run)
+            if count > 0:
+                print(f'  {run_dir}: dropped {count} images identical to references ({size / (1 << 20):.1f} MB)')
+        if pack and not dry_run:
+            count, size = pack_run(layout.result_dir / run_dir)
+            if count > 0:
+                print(f'  {run_dir}: packed {count} files ({size / (1 << 20):.1f} MB)')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-e', '--environment', type=str, action='store', help='Environment', default=None)
+    parser.add_argument('--keep', type=int, action='store', help=f'Number of runs to keep per branch, 0 keeps all runs (default: {config.DEFAULT_RETAINED_RUNS})', default=config.DEFAULT_RETAINED_RUNS)
+    parser.add_argument('--drop-identical', action='store_true', help='Remove result images of passing tests that are identical to their references')
+    parser.add_argument('--pack', action='store_true', help=f'Pack the files of every finished run into a single archive ({config.RESULT_ARCHIVE_FILE})')
+    parser.add_argument('--dry-run', action='store_true', help='Only print what would be removed')
+
+    args = parser.parse_args()
+
+    # Load environment (the build configuration is not relevant for accessing results).
+    try:
+        env = Environment(args.environment, next(iter(config.BUILD_CONFIGS)))
+    except Exception as e:
+        print(e)
+        sys.exit(1)
+
+    layout = ResultLayout(env)
+    compact_results(layout, args.keep, args.drop_identical, args.pack, args.dry_run)
+
+if __name__ == '__main__':
+    main()
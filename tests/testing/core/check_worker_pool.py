@@ -0,0 +1,114 @@
+'''
+Check of the worker pool protocol using stand-in python workers instead of Mogwai.
+
+Run from the tests/testing directory:
+
+    python -m core.check_worker_pool
+
+Stand-in workers serve requests with worker_pool.serve() like Mogwai workers do
+(see mogwai_worker.py). Instead of running a test script, they reply with their key
+and process id, fail if the request contains "fail" and sleep for "sleep" seconds.
+'''
+
+import argparse
+import concurrent.futures
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from .worker_pool import WorkerPool, serve
+
+# Timeout in seconds for requests that are expected to finish.
+REQUEST_TIMEOUT = 30
+
+def launch_stand_in_worker(key, address, token):
+    '''
+    Launch a stand-in worker process (same signature as launch_mogwai_worker without the environment).
+    '''
+    args = [sys.executable, '-m', 'core.check_worker_pool', '--serve', key, address[0], str(address[1]), token]
+    return subprocess.Popen(args, cwd=Path(__file__).parent.parent)
+
+def serve_stand_in_worker(key, address, token):
+    '''
+    Worker side of a stand-in worker.
+    '''
+    def run_test(request):
+        time.sleep(request.get('sleep', 0))
+        return not request.get('fail', False), [key, os.getpid()]
+
+    serve(address, token, run_test)
+
+def check_mixed_keys():
+    '''
+    Requests with different keys running concurrently are only executed by workers with a matching key.
+    '''
+    keys = ['d3d12', 'vulkan', 'd3d12', 'vulkan', 'vulkan', 'd3d12', 'd3d12', 'vulkan']
+    with WorkerPool(2, launch_stand_in_worker, 100) as pool:
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda key: pool.run_test(key, {'sleep': 0.1}, REQUEST_TIMEOUT), keys))
+    return all(success and messages[0] == key for key, (success, messages) in zip(keys, results))
+
+def check_reuse():
+    '''
+    Consecutive requests with the same key are executed by the same worker.
+    '''
+    with WorkerPool(1, launch_stand_in_worker, 100) as pool:
+        pids = [pool.run_test('d3d12', {}, REQUEST_TIMEOUT)[1][1] for _ in range(3)]
+    return len(set(pids)) == 1
+
+def check_recycle_on_failure():
+    '''
+    A worker is recycled after a failed test.
+    '''
+    with WorkerPool(1, launch_stand_in_worker, 100) as pool:
+        _, (_, first) = pool.run_test('d3d12', {}, REQUEST_TIMEOUT)
+        success, (_, failed) = pool.run_test('d3d12', {'fail': True}, REQUEST_TIMEOUT)
+        _, (_, last) = pool.run_test('d3d12', {}, REQUEST_TIMEOUT)
+    return not success and first == failed and last != failed
+
+def check_recycle_after_max_tests():
+    '''
+    A worker is recycled once it has executed the maximum number of tests.
+    '''
+    with WorkerPool(1, launch_stand_in_worker, 2) as pool:
+        pids = [pool.run_test('d3d12', {}, REQUEST_TIMEOUT)[1][1] for _ in range(3)]
+    return pids[0] == pids[1] and pids[2] != pids[1]
+
+def check_timeout():
+    '''
+    A worker exceeding the timeout is killed and the next request gets a new worker.
+    '''
+    with WorkerPool(1, launch_stand_in_worker, 100) as pool:
+        _, (_, first) = pool.run_test('d3d12', {}, REQUEST_TIMEOUT)
+        success, messages = pool.run_test('d3d12', {'sleep': 10}, 0.5)
+        _, (_, last) = pool.run_test('d3d12', {}, REQUEST_TIMEOUT)
+    return not success and messages == ['Process killed due to timeout'] and last != first
+
+def run_checks():
+    '''
+    Run all checks and return True if all of them passed.
+    '''
+    checks = [check_mixed_keys, check_reuse, check_recycle_on_failure, check_recycle_after_max_tests, check_timeout]
+    success = True
+    for check in checks:
+        passed = check()
+        success = success and passed
+        print(f'  {check.__name__:<40} : {"PASSED" if passed else "FAILED"}')
+    return success
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the worker pool protocol using stand-in python workers.')
+    parser.add_argument('--serve', nargs=4, metavar=('KEY', 'HOST', 'PORT', 'TOKEN'), help='Run as a stand-in worker (used internally)')
+    args = parser.parse_args()
+
+    if args.serve:
+        key, host, port, token = args.serve
+        serve_stand_in_worker(key, (host, int(port)), token)
+        return
+
+    sys.exit(0 if run_checks() else 1)
+
+if __name__ == '__main__':
+    main()
@@ -13,20 +13,196 @@ DEFAULT_PLATFORMS = ["windows-x86_64", "linux-x86_64"]
 # Default image comparison tolerance.
 DEFAULT_TOLERANCE = 0.0
 
+# Image comparison metrics supported by ImageCompare (selected using "metric" in the IMAGE_TEST header).
+IMAGE_COMPARE_METRICS = ['mse', 'rmse', 'relmse', 'mae', 'mape', 'ssim', 'flip']
+
+# Default image comparison metric.
+DEFAULT_METRIC = 'mse'
+
 # Default image test timeout.
 DEFAULT_TIMEOUT = 600
 
+# Adaptive timeouts: predicted timeout is the 99th percentile of the last
+# ADAPTIVE_TIMEOUT_HISTORY durations times ADAPTIVE_TIMEOUT_FACTOR, clamped to
+# [ADAPTIVE_TIMEOUT_MIN, ADAPTIVE_TIMEOUT_MAX]. Requires at least
+# ADAPTIVE_TIMEOUT_MIN_SAMPLES recorded durations.
+ADAPTIVE_TIMEOUT_HISTORY = 20
+ADAPTIVE_TIMEOUT_MIN_SAMPLES = 3
+ADAPTIVE_TIMEOUT_FACTOR = 3.0
+ADAPTIVE_TIMEOUT_MIN = 60
+ADAPTIVE_TIMEOUT_MAX = 1800
+
+# Default time in seconds without log output after which a test is reported as stalled.
+DEFAULT_STALL_TIMEOUT = 120
+
+# Default number of times a failed test is rerun before it is reported as failed.
+DEFAULT_RERUN_COUNT = 0
+
+# Flakiness tracking: tolerances are suggested as the mean plus FLAKY_TOLERANCE_SIGMA
+# standard deviations of the last FLAKY_ERROR_HISTORY errors of passing comparisons of
+# each image (requires at least FLAKY_MIN_SAMPLES errors), but at most
+# FLAKY_MAX_TOLERANCE_FACTOR times the tolerance of the test header. Tests which only
+# passed after a rerun in at least FLAKY_QUARANTINE_COUNT of their last FLAKY_RUN_HISTORY
+# runs are quarantined.
+FLAKY_ERROR_HISTORY = 50
+FLAKY_MIN_SAMPLES = 5
+FLAKY_TOLERANCE_SIGMA = 3.0
+FLAKY_MAX_TOLERANCE_FACTOR = 2.0
+FLAKY_RUN_HISTORY = 20
+FLAKY_QUARANTINE_COUNT = 3
+
 # Default number of processes (it will be this or # of CPUs, whichever is lower)
 DEFAULT_PROCESS_COUNT = 4
 
+# Default number of canary tests run before the remaining tests.
+DEFAULT_CANARY_COUNT = 4
+
+# Default number of tests a persistent Mogwai worker runs before it is recycled.
+DEFAULT_WORKER_MAX_TESTS = 20
+
 IMAGE_TESTS_DIR = "tests/image_tests"
 
+# Default directory of the local databases and caches below, relative to the project directory
+# (overridden by the optional image_tests.cache_dir of the environment config).
+IMAGE_TESTS_CACHE_DIR = "tests/data/cache"
+
+# Database of historical image test runtimes (in the cache directory).
+IMAGE_TESTS_RUNTIME_DB = "runtimes.db"
+
+# Database of image test outcomes and image errors used for detecting flaky tests (in the cache directory).
+IMAGE_TESTS_FLAKINESS_DB = "flakiness.db"
+
+# Index of image test results used by the viewer (in the cache directory).
+IMAGE_TESTS_RESULT_INDEX_DB = "result_index.db"
+
+# Minimum time in seconds between two scans of the result directory by the viewer.
+RESULT_INDEX_SCAN_INTERVAL = 2
+
+# Cache of image previews and loss maps generated by the viewer (in the cache directory).
+IMAGE_TESTS_PREVIEW_CACHE_DIR = "previews"
+
+# Maximum width and height of image previews by name.
+PREVIEW_SIZES = {
+    'thumbnail': 128,
+    'preview': 1024
+}
+
+# Timeout in seconds for generating a single image preview.
+PREVIEW_TIMEOUT = 60
+
+# Loss functions of the loss maps shown when comparing images in the viewer.
+LOSS_MAP_FUNCTIONS = ['L1', 'L2', 'MAPE', 'MRSE', 'SMAPE', 'SSIM']
+
+# Timeout in seconds for generating the loss maps of an image pair.
+LOSS_MAP_TIMEOUT = 120
+
+# Number of runs or tests shown per page by the viewer.
+VIEWER_PAGE_SIZE = 50
+
+# Run tags the viewer's list of runs can be filtered by.
+VIEWER_FILTER_TAGS = ['branch', 'build_config', 'hostname']
+
+# Size in bytes of the chunks test logs are loaded in by the viewer.
+LOG_CHUNK_SIZE = 256 * 1024
+
+# Regular expressions of lines indexed by level in test logs (the first matching level is used).
+LOG_LEVEL_PATTERNS = {
+    'error': r'\((Fatal|Error)\)|Traceback \(most recent call last\)',
+    'warning': r'\(Warning\)'
+}
+
+# Maximum number of lines per level in the index of a test log.
+LOG_INDEX_LIMIT = 1000
+
+# Maximum number of matching lines returned by a search of a test log.
+LOG_GREP_LIMIT = 1000
+
+# Maximum length of the string searched for in a test log.
+LOG_GREP_MAX_PATTERN_LENGTH = 256
+
+# Number of test log indices cached by the viewer.
+LOG_INDEX_CACHE_SIZE = 64
+
+# Number of most recent runs included in trends shown by the viewer.
+TREND_RUN_COUNT = 30
+
+# Number of preceding runs a test duration is compared against to detect performance regressions.
+TREND_WINDOW = 10
+
+# Minimum number of preceding runs required to detect performance regressions.
+TREND_MIN_HISTORY = 3
+
+# Width of the noise band above the median duration in (normalized) median absolute deviations.
+TREND_NOISE_FACTOR = 3
+
+# Minimum relative and absolute (seconds) duration increase flagged as a performance regression.
+TREND_MIN_RELATIVE_INCREASE = 0.2
+TREND_MIN_DURATION_INCREASE = 1.0
+
+# Cache of parsed image test script headers (in the cache directory).
+IMAGE_TESTS_INDEX_FILE = "image_tests_index.json"
+
+# Minimum number of modified test scripts for parsing headers in parallel.
+DISCOVERY_PARALLEL_THRESHOLD = 64
+
+# Render pass sources (used for mapping render pass names to directories).
+RENDER_PASSES_DIR = "Source/RenderPasses"
+
+# Media directory (searched for scenes not found relative to the test script).
+MEDIA_DIR = "media"
+
+# Paths every image test depends on (used for test-impact analysis).
+# A change to any of these selects all tests.
+IMPACT_GLOBAL_DEPENDENCIES = [
+    "CMakeLists.txt",
+    "CMakePresets.json",
+    "dependencies.xml",
+    "cmake",
+    "external",
+    "Source/Falcor",
+    "Source/Modules",
+    "Source/Mogwai",
+    "Source/plugins",
+    "Source/Tools/ImageCompare",
+    "tests/testing",
+]
+
 # Supported image extensions.
 IMAGE_EXTENSIONS = ['.png', '.jpg', '.tga', '.bmp', '.pfm', '.exr']
 
 # Suffix to use for error images.
 ERROR_IMAGE_SUFFIX = '.error.png'
 
+# Suffix ImageCompare appends to errors of comparisons that stopped early (the error is a lower bound).
+LOWER_BOUND_SUFFIX = ' (lower bound)'
+
+# Name of the manifest caching image hashes in reference directories.
+REF_MANIFEST_FILE = 'manifest.json'
+
+# Number of threads used for hashing and copying reference images.
+REF_STORE_THREAD_COUNT = 8
+
+# Name of the file test scripts write phase timings and resource usage to (see core/profiler.py).
+PROFILE_FILE = 'profile.json'
+
+# Name of the append-only run journal in the result directory.
+JOURNAL_FILE = 'journal.jsonl'
+
+# Name of the file a run in progress writes the address of its live progress server to.
+LIVE_FILE = 'live.json'
+
+# Default port of the live progress server (see core/live.py).
+DEFAULT_LIVE_PORT = 8081
+
+# Name of the archive finished runs are packed into (see compact_image_tests.py).
+RESULT_ARCHIVE_FILE = 'results.zip'
+
+# Default number of runs kept per branch when pruning results.
+DEFAULT_RETAINED_RUNS = 10
+
+# Tags identifying the runs of one branch (stored in run reports, runs differing in other tags, e.g. build_id, are pruned together).
+RETENTION_GROUP_TAGS = ['vcs_root', 'hostname', 'branch', 'build_config']
+
 PYTHON_TESTS_DIR = "tests/python_tests"
 
 # Build configurations.
@@ -0,0 +1,138 @@
+'''
+Module for discovering image test scripts and parsing their headers.
+'''
+
+import ast
+import concurrent.futures
+import json
+import os
+from pathlib import Path
+
+from . import config
+
+# Version of the discovery index format. Bump to invalidate existing indices.
+INDEX_VERSION = 1
+
+def parse_header(source, script_file):
+    '''
+    Parse the IMAGE_TEST dictionary defined at the top of a script.
+    The dictionary is evaluated using ast.literal_eval, so it may only contain literals.
+    Returns an empty dictionary if the script has no header.
+    '''
+    # Cheap check before parsing the whole script.
+    if not source.lstrip().startswith('IMAGE_TEST'):
+        return {}
+
+    try:
+        module = ast.parse(source, filename=str(script_file))
+    except SyntaxError as e:
+        raise Exception(f'Failed to parse script header in {script_file} ({e})')
+
+    if not module.body:
+        return {}
+    statement = module.body[0]
+    if not isinstance(statement, ast.Assign) or len(statement.targets) != 1:
+        return {}
+    target = statement.targets[0]
+    if not isinstance(target, ast.Name) or target.id != 'IMAGE_TEST':
+        return {}
+
+    try:
+        header = ast.literal_eval(statement.value)
+    except ValueError as e:
+        raise Exception(f'Failed to parse script header in {script_file} ({e})')
+    if not isinstance(header, dict):
+        raise Exception(f'Failed to parse script header in {script_file} (IMAGE_TEST is not a dictionary)')
+    return header
+
+def read_header(script_file):
+    '''
+    Check if script has a IMAGE_TEST dictionary defined at the top and return it's content.
+    '''
+    with open(script_file) as f:
+        return parse_header(f.read(), script_file)
+
+def _read_header_entry(script_file):
+    '''
+    Helper for parsing headers in worker processes.
+    Returns a tuple containing the header and an error message.
+    '''
+    try:
+        return read_header(script_file), None
+    except Exception as e:
+        return None, str(e)
+
+class TestIndex:
+    '''
+    Index of parsed test script headers, cached on disk by path and modification time.
+    '''
+
+    def __init__(self, index_file: Path = None):
+        self.index_file = index_file
+        self.entries = {}
+        self.dirty = False
+        if index_file:
+            try:
+                with open(index_file) as f:
+                    index = json.load(f)
+                if index.get('version') == INDEX_VERSION:
+                    self.entries = index['files']
+            except (OSError, ValueError, KeyError):
+                pass
+
+    def save(self):
+        '''
+        Write the index back to disk if it has changed.
+        '''
+        if not self.index_file or not self.dirty:
+            return
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = self.index_file.with_suffix('.tmp')
+        with open(temp_file, 'w') as f:
+            json.dump({'version': INDEX_VERSION, 'files': self.entries}, f)
+        os.replace(temp_file, self.index_file)
+        self.dirty = False
+
+    def headers(self, script_files):
+        '''
+        Return a dictionary mapping each script file to its header.
+        Headers of new or modified scripts are parsed, in parallel if there are many of them.
+        Raises an exception if a header fails to parse.
+        '''
+        headers = {}
+        stale = []
+        stats = {}
+        for script_file in script_files:
+            stat = script_file.stat()
+            stats[script_file] = [stat.st_mtime_ns, stat.st_size]
+            entry = self.entries.get(str(script_file))
+            if entry and entry['stat'] == stats[script_file]:
+                headers[script_file] = entry['header']
+            else:
+                stale.append(script_file)
+
+        if len(stale) >= config.DISCOVERY_PARALLEL_THRESHOLD:
+            with concurrent.futures.ProcessPoolExecutor() as executor:
+                results = list(executor.map(_read_header_entry, stale, chunksize=16))
+        else:
+            results = list(map(_read_header_entry, stale))
+
+        for script_file, (header, error) in zip(stale, results):
+            if error:
+                raise Exception(error)
+            headers[script_file] = header
+            # Only cache headers that survive a JSON round trip unchanged (e.g. no tuples or sets).
+            try:
+                if json.loads(json.dumps(header)) == header:
+                    self.entries[str(script_file)] = {'stat': stats[script_file], 'header': header}
+                    self.dirty = True
+            except (TypeError, ValueError):
+                pass
+
+        # Drop entries of deleted scripts.
+        existing = set(str(f) for f in script_files)
+        for path in [p for p in self.entries if not p in existing]:
+            del self.entries[path]
+            self.dirty = True
+
+        return headers
@@ -81,7 +81,8 @@ class Environment:
                     'properties': {
                         'result_dir': { 'type': str },
                         'ref_dir': { 'type': str },
-                        'remote_ref_dir': { 'type': str, 'optional': True }
+                        'remote_ref_dir': { 'type': str, 'optional': True },
+                        'cache_dir': { 'type': str, 'optional': True }
                     }
                 }
             }
@@ -107,6 +108,16 @@ class Environment:
         self.image_tests_result_dir: str = env['image_tests']['result_dir']
         self.image_tests_ref_dir: str = env['image_tests']['ref_dir']
         self.image_tests_remote_ref_dir: str = env['image_tests'].get('remote_ref_dir', None)
+        # Local databases and caches (only ${project_dir} and ${project_drive} are substituted in the cache directory).
+        cache_dir = env['image_tests'].get('cache_dir', None)
+        if cache_dir:
+            cache_dir = string.Template(cache_dir).safe_substitute(project_dir=self.project_dir, project_drive=self.project_dir.drive)
+        self.image_tests_cache_dir = self.project_dir / (cache_dir or config.IMAGE_TESTS_CACHE_DIR)
+        self.image_tests_runtime_db = self.image_tests_cache_dir / config.IMAGE_TESTS_RUNTIME_DB
+        self.image_tests_flakiness_db = self.image_tests_cache_dir / config.IMAGE_TESTS_FLAKINESS_DB
+        self.image_tests_result_index_db = self.image_tests_cache_dir / config.IMAGE_TESTS_RESULT_INDEX_DB
+        self.image_tests_preview_cache_dir = self.image_tests_cache_dir / config.IMAGE_TESTS_PREVIEW_CACHE_DIR
+        self.image_tests_index_file = self.image_tests_cache_dir / config.IMAGE_TESTS_INDEX_FILE
         self.python_tests_dir = self.project_dir / config.PYTHON_TESTS_DIR
 
         self.vcs_root = helpers.get_vcs_root(self.project_dir)
@@ -0,0 +1,117 @@
+'''
+Module containing a local database tracking flaky image tests.
+'''
+
+import datetime
+import math
+import sqlite3
+from pathlib import Path
+
+from . import config
+
+class FlakinessTracker:
+    '''
+    SQLite database recording the outcome of test runs and the comparison error of every image.
+    A run is flaky if the test failed and then passed when rerun. The distribution of the
+    errors of passing comparisons is used to suggest statistically justified tolerances,
+    and tests that are flaky too often are considered chronic flakes and can be quarantined.
+    '''
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS test_runs (
+                test TEXT NOT NULL,
+                build_config TEXT NOT NULL,
+                date TEXT NOT NULL,
+                result TEXT NOT NULL,
+                attempts INTEGER NOT NULL
+            )''')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS image_errors (
+                test TEXT NOT NULL,
+                build_config TEXT NOT NULL,
+                image TEXT NOT NULL,
+                date TEXT NOT NULL,
+                error REAL NOT NULL,
+                tolerance REAL NOT NULL,
+                success INTEGER NOT NULL,
+                metric TEXT
+            )''')
+        # Errors recorded before the metric was stored have no metric and are never used for suggesting tolerances.
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(image_errors)')]
+        if not 'metric' in columns:
+            self.connection.execute('ALTER TABLE image_errors ADD COLUMN metric TEXT')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS test_runs_test ON test_runs (test, build_config)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS image_errors_test ON image_errors (test, build_config, image)')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, test_name, build_config, result, attempts, image_reports):
+        '''
+        Record the outcome of a test run and the image reports of all of its attempts.
+        Errors of comparisons that stopped early are only lower bounds and are not recorded.
+        '''
+        date = datetime.datetime.now().isoformat()
+        self.connection.execute(
+            'INSERT INTO test_runs (test, build_config, date, result, attempts) VALUES (?, ?, ?, ?, ?)',
+            (test_name, build_config, date, result, attempts))
+        self.connection.executemany(
+            'INSERT INTO image_errors (test, build_config, image, date, error, tolerance, success, metric) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            [(test_name, build_config, r['name'], date, r['error'], r['tolerance'], r['success'], r.get('metric', config.DEFAULT_METRIC))
+             for r in image_reports if r['error'] != None and not r.get('error_is_lower_bound', False)])
+        self.connection.commit()
+
+    def errors(self, test_name, build_config, metric, limit=config.FLAKY_ERROR_HISTORY):
+        '''
+        Return a dictionary mapping image names to the most recent errors of their passing comparisons using a metric.
+        '''
+        rows = self.connection.execute(
+            'SELECT image, error FROM image_errors WHERE test = ? AND build_config = ? AND metric = ? AND success ORDER BY rowid DESC',
+            (test_name, build_config, metric))
+        errors = {}
+        for image, error in rows:
+            image_errors = errors.setdefault(image, [])
+            if len(image_errors) < limit:
+                image_errors.append(error)
+        return errors
+
+    def suggest_tolerance(self, test_name, build_config, metric, tolerance):
+        '''
+        Suggest a tolerance for a test as the largest mean plus FLAKY_TOLERANCE_SIGMA standard
+        deviations of the errors of passing comparisons of its images using a metric, capped at
+        FLAKY_MAX_TOLERANCE_FACTOR times the tolerance of the test header. Errors of failed
+        comparisons are never used, so a regression cannot raise the tolerance until it passes.
+        Returns None if there is not enough history.
+        '''
+        suggestion = None
+        for image, errors in self.errors(test_name, build_config, metric).items():
+            if len(errors) < config.FLAKY_MIN_SAMPLES:
+                continue
+            mean = sum(errors) / len(errors)
+            std = math.sqrt(sum((e - mean) ** 2 for e in errors) / (len(errors) - 1))
+            image_tolerance = mean + config.FLAKY_TOLERANCE_SIGMA * std
+            suggestion = image_tolerance if suggestion == None else max(suggestion, image_tolerance)
+        if suggestion == None:
+            return None
+        return min(suggestion, config.FLAKY_MAX_TOLERANCE_FACTOR * tolerance)
+
+    def flake_stats(self, test_name, build_config, limit=config.FLAKY_RUN_HISTORY):
+        '''
+        Return a tuple containing the number of flaky runs and the number of runs among the most recent runs of a test.
+        '''
+        rows = list(self.connection.execute(
+            'SELECT result, attempts FROM test_runs WHERE test = ? AND build_config = ? ORDER BY rowid DESC LIMIT ?',
+            (test_name, build_config, limit)))
+        flaky = sum(1 for result, attempts in rows if result == 'PASSED' and attempts > 1)
+        return flaky, len(rows)
+
+    def is_quarantined(self, test_name, build_config):
+        '''
+        Check if a test is a chronic flake, i.e. was flaky in at least FLAKY_QUARANTINE_COUNT of its recent runs.
+        '''
+        flaky, _ = self.flake_stats(test_name, build_config)
+        return flaky >= config.FLAKY_QUARANTINE_COUNT
@@ -2,9 +2,9 @@
 Module with various helpers functions.
 '''
 
+import hashlib
 import os
 import re
-import subprocess
 import socket
 from urllib.parse import urlparse
 
@@ -50,14 +50,12 @@ def get_vcs_root(path):
     print("Error. Unknown VCS root `" + url.netloc + "`")
     return url[0].lower()
 
-def mirror_folders(src_dir, dst_dir):
+def hash_file(path):
     '''
-    Mirror contents from src_dir to dst_dir.
+    Return the SHA-256 hex digest of a file.
     '''
-    if os.name != 'nt':
-        raise RuntimeError('mirror_folders() is not implemented for this OS')
-
-    args = ["Robocopy.exe", str(src_dir), str(dst_dir), "/MIR", "/FFT", "/Z", "/XA:H", "/W:5", "/np"]
-    process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    output = process.communicate()[0]
-    return process.returncode <= 7, output.decode('ascii')
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
@@ -0,0 +1,385 @@
+'''
+Module for static test-impact analysis of image tests.
+
+Test scripts are parsed (not executed) to determine the files they depend on:
+imported modules (e.g. graphs/*.py, helpers.py), scripts run via exec(open(...)),
+the render passes created using createPass() and the scenes loaded using
+m.loadScene(). Render pass names are mapped to their Source/RenderPasses
+directories by scanning the plugin registration code.
+'''
+
+import ast
+import bisect
+import hashlib
+import os
+import re
+import subprocess
+from pathlib import Path
+
+from . import config
+from .helpers import hash_file
+
+# Regular expressions for finding render pass registrations in Source/RenderPasses.
+REGISTER_CLASS_REGEX = re.compile(r'registerClass\s*<\s*RenderPass\s*,\s*(\w+)\s*>')
+PLUGIN_CLASS_REGEX = re.compile(r'FALCOR_PLUGIN_CLASS\s*\(\s*(\w+)\s*,\s*"(\w+)"')
+
+def find_render_pass_dirs(render_passes_dir: Path):
+    '''
+    Return a dictionary mapping render pass names to the directory (below render_passes_dir) implementing them.
+    '''
+    pass_dirs = {}
+    for pass_dir in sorted(render_passes_dir.iterdir()):
+        if not pass_dir.is_dir():
+            continue
+        class_names = {}
+        registered = []
+        for source_file in pass_dir.glob('**/*'):
+            if not source_file.suffix in ['.h', '.cpp']:
+                continue
+            source = source_file.read_text(errors='replace')
+            for class_name, pass_name in PLUGIN_CLASS_REGEX.findall(source):
+                class_names[class_name] = pass_name
+            registered += REGISTER_CLASS_REGEX.findall(source)
+        for class_name in registered:
+            pass_dirs[class_names.get(class_name, class_name)] = pass_dir
+    return pass_dirs
+
+def get_changed_files(project_dir: Path, rev):
+    '''
+    Return the list of files (relative to project_dir) that changed since the given git revision.
+    This includes uncommitted and untracked files.
+    Raises an exception if git fails.
+    '''
+    commands = [
+        ['git', 'diff', '--name-only', rev, '--'],
+        ['git', 'ls-files', '--others', '--exclude-standard']
+    ]
+    changed_files = []
+    for args in commands:
+        process = subprocess.run(args, cwd=project_dir, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        if process.returncode != 0:
+            raise Exception(f'Failed to determine changed files since "{rev}": {process.stderr.decode("utf-8", "replace").strip()}')
+        changed_files += process.stdout.decode('utf-8').splitlines()
+    return sorted(set(changed_files))
+
+class SourceHashes:
+    '''
+    Content hashes of files and directories in the project.
+    Unmodified tracked files use their git object ids, so only modified and
+    untracked files need to be read. Without git, all files are hashed.
+    '''
+
+    def __init__(self, project_dir: Path):
+        self.project_dir = project_dir
+        self.hashes = {}
+        self.cache = {}
+        self.use_git = True
+        try:
+            tracked = subprocess.run(['git', 'ls-files', '-s', '-z'], cwd=project_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+            modified = subprocess.run(['git', 'ls-files', '-m', '-o', '--exclude-standard', '-z'], cwd=project_dir, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        except (OSError, subprocess.CalledProcessError):
+            self.use_git = False
+            return
+
+        # Entries are "<mode> <object> <stage>\t<path>".
+        for entry in tracked.stdout.decode('utf-8').split('\0'):
+            if entry:
+                info, path = entry.split('\t', 1)
+                self.hashes[path] = info.split()[1]
+        for path in set(modified.stdout.decode('utf-8').split('\0')):
+            if not path:
+                continue
+            try:
+                self.hashes[path] = hash_file(project_dir / path)
+            except OSError:
+                # Deleted file.
+                self.hashes.pop(path, None)
+        self.paths = sorted(self.hashes)
+
+    def _walk(self, path):
+        '''
+        Return (path, hash) pairs of all files below a path not known to git.
+        '''
+        full_path = self.project_dir / path
+        if full_path.is_file():
+            return [(path, hash_file(full_path))]
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(full_path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                file = Path(dirpath) / filename
+                entries.append((self.relative(file), hash_file(file)))
+        return entries
+
+    def relative(self, path: Path):
+        return Path(path).relative_to(self.project_dir).as_posix()
+
+    def get_hash(self, path):
+        '''
+        Return a hash of the content of a file or directory (relative to the project directory).
+        Returns 'missing' for paths that do not exist.
+        '''
+        if path in self.cache:
+            return self.cache[path]
+
+        entries = []
+        if self.use_git:
+            if path in self.hashes:
+                entries = [(path, self.hashes[path])]
+            else:
+                prefix = path.rstrip('/') + '/'
+                index = bisect.bisect_left(self.paths, prefix)
+                while index < len(self.paths) and self.paths[index].startswith(prefix):
+                    entries.append((self.paths[index], self.hashes[self.paths[index]]))
+                    index += 1
+        # Paths outside of git (e.g. media files) are hashed directly.
+        if not entries and (self.project_dir / path).exists():
+            entries = self._walk(path)
+
+        if entries:
+            h = hashlib.sha256()
+            for entry_path, entry_hash in entries:
+                h.update(f'{entry_path} {entry_hash}\n'.encode('utf-8'))
+            digest = h.hexdigest()
+        else:
+            digest = 'missing'
+        self.cache[path] = digest
+        return digest
+
+class ScriptInfo:
+    '''
+    Information extracted from a single Python script.
+    '''
+
+    def __init__(self):
+        self.modules = []       # Imported module names.
+        self.search_dirs = []   # Directories added using sys.path.append/insert.
+        self.exec_files = []    # Files run using exec(open(...).read()).
+        self.passes = []        # Render pass names used in createPass().
+        self.scenes = []        # Scene files loaded using loadScene().
+        self.assets = []        # Other asset files referenced by createPass() properties.
+
+def _string_value(node, constants):
+    '''
+    Evaluate an expression to a string, supporting string literals, module level
+    string constants and os.path.abspath(). Returns None for other expressions.
+    '''
+    if isinstance(node, ast.Constant) and isinstance(node.value, str):
+        return node.value
+    if isinstance(node, ast.Name):
+        return constants.get(node.id, None)
+    if isinstance(node, ast.Call) and len(node.args) == 1 and ast.unparse(node.func) in ['os.path.abspath', 'abspath']:
+        return _string_value(node.args[0], constants)
+    return None
+
+def parse_script(source, script_file):
+    '''
+    Parse a script and return a ScriptInfo.
+    '''
+    module = ast.parse(source, filename=str(script_file))
+    info = ScriptInfo()
+
+    # Collect module level string constants (e.g. sceneFile = '...').
+    constants = {}
+    for statement in module.body:
+        if isinstance(statement, ast.Assign) and len(statement.targets) == 1 and isinstance(statement.targets[0], ast.Name):
+            value = _string_value(statement.value, constants)
+            if value != None:
+                constants[statement.targets[0].id] = value
+
+    for node in ast.walk(module):
+        if isinstance(node, ast.Import):
+            info.modules += [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            if node.module and node.level == 0:
+                info.modules.append(node.module)
+        elif isinstance(node, ast.Call):
+            func = ast.unparse(node.func)
+            args = [_string_value(arg, constants) for arg in node.args]
+            if func in ['sys.path.append', 'sys.path.insert'] and args and args[-1] != None:
+                info.search_dirs.append(args[-1])
+            elif func == 'exec' and args and isinstance(node.args[0], ast.Call):
+                # exec(open('file').read())
+                read = node.args[0]
+                if isinstance(read.func, ast.Attribute) and read.func.attr == 'read' and isinstance(read.func.value, ast.Call):
+                    open_call = read.func.value
+                    if ast.unparse(open_call.func) == 'open' and open_call.args:
+                        path = _string_value(open_call.args[0], constants)
+                        if path != None:
+                            info.exec_files.append(path)
+            elif func == 'createPass' or func.endswith('.createPass'):
+                if args and args[0] != None:
+                    info.passes.append(args[0])
+                # Asset files passed as properties (e.g. ImageLoader filename).
+                if len(node.args) > 1 and isinstance(node.args[1], ast.Dict):
+                    for key, value in zip(node.args[1].keys, node.args[1].values):
+                        if _string_value(key, constants) == 'filename':
+                            path = _string_value(value, constants)
+                            if path != None:
+                                info.assets.append(path)
+            elif func.endswith('loadScene'):
+                if args and args[0] != None:
+                    info.scenes.append(args[0])
+
+    return info
+
+class DependencyMap:
+    '''
+    Maps image test scripts to the files, render passes and scenes they depend on.
+    All paths are relative to the project directory and use forward slashes.
+    '''
+
+    def __init__(self, project_dir: Path, render_passes_dir: Path = None, media_dir: Path = None):
+        self.project_dir = project_dir
+        self.render_passes_dir = render_passes_dir or project_dir / config.RENDER_PASSES_DIR
+        self.media_dir = media_dir or project_dir / config.MEDIA_DIR
+        self.pass_dirs = None
+        self.source_hashes = None
+        self.scripts = {}
+        self.dependencies = {}
+
+    def relative(self, path: Path):
+        '''
+        Return a path relative to the project directory (or the absolute path if it is outside of it).
+        '''
+        path = Path(os.path.normpath(path))
+        try:
+            return path.relative_to(self.project_dir).as_posix()
+        except ValueError:
+            return path.as_posix()
+
+    def parse(self, script_file: Path):
+        '''
+        Parse a script, caching the result. Returns None if the script cannot be parsed.
+        '''
+        if not script_file in self.scripts:
+            try:
+                self.scripts[script_file] = parse_script(script_file.read_text(), script_file)
+            except (OSError, SyntaxError, ValueError):
+                self.scripts[script_file] = None
+        return self.scripts[script_file]
+
+    def resolve_module(self, name, search_dirs):
+        '''
+        Resolve a module name to a script file in one of the search directories.
+        '''
+        parts = name.split('.')
+        for search_dir in search_dirs:
+            for candidate in [search_dir.joinpath(*parts).with_suffix('.py'), search_dir.joinpath(*parts, '__init__.py')]:
+                if candidate.is_file():
+                    return candidate
+        return None
+
+    def resolve_scene(self, path, cwd: Path):
+        '''
+        Resolve a scene or asset path the way Falcor does: relative to the working
+        directory first, then relative to the media directory.
+        '''
+        candidate = cwd / path
+        if candidate.exists():
+            return candidate
+        return self.media_dir / path
+
+    def scene_files(self, scene_file: Path):
+        '''
+        Return files referenced by a Python scene file (relative to the scene directory).
+        '''
+        files = []
+        if scene_file.suffix == '.pyscene' and scene_file.is_file():
+            try:
+                module = ast.parse(scene_file.read_text(), filename=str(scene_file))
+            except (OSError, SyntaxError, ValueError):
+                return files
+            for node in ast.walk(module):
+                if isinstance(node, ast.Constant) and isinstance(node.value, str) and len(node.value) < 260:
+                    candidate = scene_file.parent / node.value
+                    try:
+                        if candidate.is_file():
+                            files.append(candidate)
+                    except OSError:
+                        pass
+        return files
+
+    def get_dependencies(self, script_file: Path):
+        '''
+        Return a dictionary with the dependencies of a test script:
+          files     - Python scripts (the test script, imported modules and exec'd scripts)
+          passes    - render pass names created by the scripts
+          pass_dirs - Source/RenderPasses directories implementing the render passes
+          scenes    - scene and asset files loaded by the scripts
+        '''
+        if script_file in self.dependencies:
+            return self.dependencies[script_file]
+
+        if self.pass_dirs == None:
+            self.pass_dirs = find_render_pass_dirs(self.render_passes_dir) if self.render_passes_dir.exists() else {}
+
+        # The test script is run with its directory as working directory and python search path.
+        cwd = script_file.parent
+        files = []
+        passes = []
+        scenes = []
+        search_dirs = [cwd]
+        pending = [script_file]
+        while pending:
+            current = Path(os.path.normpath(pending.pop(0)))
+            if current in files:
+                continue
+            files.append(current)
+            info = self.parse(current)
+            if info == None:
+                continue
+            search_dirs += [Path(os.path.normpath(cwd / d)) for d in info.search_dirs if not Path(os.path.normpath(cwd / d)) in search_dirs]
+            for name in info.modules:
+                module_file = self.resolve_module(name, search_dirs)
+                if module_file:
+                    pending.append(module_file)
+            pending += [cwd / f for f in info.exec_files if (cwd / f).is_file()]
+            passes += info.passes
+            for path in info.scenes + info.assets:
+                scene_file = self.resolve_scene(path, cwd)
+                for f in [scene_file] + self.scene_files(scene_file):
+                    if not f in scenes:
+                        scenes.append(f)
+
+        pass_dirs = sorted(set(self.relative(self.pass_dirs[p]) for p in passes if p in self.pass_dirs))
+
+        dependencies = {
+            'files': sorted(self.relative(f) for f in files),
+            'passes': sorted(set(passes)),
+            'pass_dirs': pass_dirs,
+            'scenes': sorted(set(self.relative(f) for f in scenes))
+        }
+        self.dependencies[script_file] = dependencies
+        return dependencies
+
+    def get_paths(self, script_file: Path):
+        '''
+        Return the list of all paths (files and directories) a test script depends on,
+        including the global dependencies shared by all tests.
+        '''
+        dependencies = self.get_dependencies(script_file)
+        return dependencies['files'] + dependencies['pass_dirs'] + dependencies['scenes'] + config.IMPACT_GLOBAL_DEPENDENCIES
+
+    def is_affected(self, script_file: Path, changed_files):
+        '''
+        Check if any of the changed files (relative to the project directory) is a dependency of the test script.
+        '''
+        paths = self.get_paths(script_file)
+        for changed_file in changed_files:
+            for path in paths:
+                if changed_file == path or changed_file.startswith(path.rstrip('/') + '/'):
+                    return True
+        return False
+
+    def get_hash(self, script_file: Path):
+        '''
+        Return a hash over the content of all dependencies of a test script.
+        The hash changes whenever any file the test depends on changes.
+        '''
+        if self.source_hashes == None:
+            self.source_hashes = SourceHashes(self.project_dir)
+        h = hashlib.sha256()
+        for path in sorted(set(self.get_paths(script_file))):
+            h.update(f'{path} {self.source_hashes.get_hash(path)}\n'.encode('utf-8'))
+        return h.hexdigest()
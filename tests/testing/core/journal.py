@@ -0,0 +1,90 @@
+'''
+Module containing the append-only run journal for image tests.
+
+The journal is a JSON-lines file written to the result directory while tests
+are running. The first line describes the run, every following line records
+one finished test:
+
+    {"type": "run", "date": <iso date>, "tests": [<test names>]}
+    {"type": "test", "name": <name>, "result": <PASSED|FAILED|SKIPPED>, "elapsed_time": <s>, "messages": [...], "quarantined": <bool>}
+
+As lines are flushed immediately, a crashed or interrupted run still leaves
+a usable summary behind, which can be resumed or shown by the viewer.
+'''
+
+import json
+import os
+import threading
+
+class RunJournal:
+    '''
+    Writer for a run journal file.
+    '''
+
+    def __init__(self, path, resume=False):
+        '''
+        Open the journal at path. Unless resume is True, existing entries are discarded.
+        '''
+        self.path = path
+        self.mutex = threading.Lock()
+        self.file = open(path, 'a' if resume else 'w', encoding='utf-8')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, entry):
+        '''
+        Append a single entry and flush it to disk.
+        '''
+        with self.mutex:
+            self.file.write(json.dumps(entry) + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+
+    def close(self):
+        with self.mutex:
+            self.file.close()
+
+def read_journal(path, offset=0):
+    '''
+    Read entries from a journal file starting at the given byte offset.
+    Returns a tuple containing the list of entries and the offset of the first
+    unread byte, which can be passed in again to read new entries incrementally.
+    Incomplete trailing lines (e.g. from a crash) are ignored.
+    '''
+    entries = []
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                offset += len(line)
+                try:
+                    entries.append(json.loads(line.decode('utf-8')))
+                except ValueError:
+                    continue
+    except OSError:
+        pass
+    return entries, offset
+
+def summarize_journal(entries):
+    '''
+    Split journal entries into the run entry (or None) and a dictionary of test entries by name.
+    A resumed run appends another run entry, which extends the list of tests of the first one.
+    If a test was recorded more than once, the last entry wins.
+    '''
+    run = None
+    tests = {}
+    for entry in entries:
+        if entry.get('type') == 'run':
+            if run:
+                run = dict(run, tests=run['tests'] + [t for t in entry['tests'] if not t in run['tests']])
+            else:
+                run = entry
+        elif entry.get('type') == 'test':
+            tests[entry['name']] = entry
+    return run, tests
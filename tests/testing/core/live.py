@@ -0,0 +1,148 @@
+'''
+Module serving progress events of a running image test run over HTTP.
+
+The server is registered as an event listener on the process controller and
+provides two endpoints:
+
+    /state   JSON snapshot of the run (queued, running and finished tests)
+    /events  Server-Sent Events stream of progress events
+
+Every event sent on /events is extended with the current queue depth and the
+number of running tests. Clients reconnecting with a Last-Event-ID header only
+receive the events they have missed. The address of the server is written to
+the run's result directory, so the viewer can subscribe to it. By default, the
+server only accepts connections from the local machine.
+'''
+
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Event types forwarded to clients (process output is too verbose to stream).
+LIVE_EVENT_TYPES = ['run_started', 'test_started', 'test_rerun', 'test_finished', 'run_finished', 'interrupted', 'aborted']
+
+# Host the server binds to unless remote access is allowed.
+LIVE_LOCAL_HOST = '127.0.0.1'
+
+# Interval in seconds at which keep-alive comments are sent to idle clients.
+KEEPALIVE_INTERVAL = 15
+
+class LiveServer:
+    '''
+    HTTP server streaming progress events of a run.
+    If allow_remote is True, the server binds to all interfaces, so anyone on the network
+    can read the names, timings and messages of the tests.
+    '''
+
+    def __init__(self, port, allow_remote=False):
+        self.events = []
+        self.state = {'result': 'RUNNING', 'tests': [], 'queued': [], 'running': {}, 'finished': []}
+        self.condition = threading.Condition()
+        self.closed = False
+
+        live = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path.split('?')[0]
+                if path == '/state':
+                    live.send_state(self)
+                elif path == '/events':
+                    live.send_events(self)
+                else:
+                    self.send_error(404)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('' if allow_remote else LIVE_LOCAL_HOST, port), Handler)
+        self.server.daemon_threads = True
+        self.port = self.server.server_address[1]
+        self.thread = threading.Thread(target=self.server.serve_forever, name='live-server', daemon=True)
+        self.thread.start()
+
+    def __call__(self, event):
+        if not event['type'] in LIVE_EVENT_TYPES:
+            return
+        with self.condition:
+            self.update_state(event)
+            event = dict(event, id=len(self.events) + 1, queue_depth=len(self.state['queued']), running=len(self.state['running']))
+            self.events.append(event)
+            self.condition.notify_all()
+
+    def update_state(self, event):
+        state = self.state
+        test = event.get('test', None)
+        if event['type'] == 'run_started':
+            state['tests'] = event['tests']
+            state['queued'] = list(event['tests'])
+            state['start_time'] = event['time']
+        elif event['type'] == 'test_started':
+            if test in state['queued']:
+                state['queued'].remove(test)
+            state['running'][test] = event['time']
+        elif event['type'] == 'test_finished':
+            if test in state['queued']:
+                state['queued'].remove(test)
+            state['running'].pop(test, None)
+            state['finished'].append({k: event[k] for k in ['test', 'result', 'elapsed_time', 'attempts', 'quarantined']})
+        elif event['type'] == 'run_finished':
+            state['result'] = event['result']
+            state['elapsed_time'] = event['elapsed_time']
+
+    def send_headers(self, handler, content_type):
+        handler.send_response(200)
+        handler.send_header('Content-Type', content_type)
+        handler.send_header('Cache-Control', 'no-cache')
+        # The viewer subscribes from a different origin.
+        handler.send_header('Access-Control-Allow-Origin', '*')
+
+    def send_state(self, handler):
+        with self.condition:
+            state = dict(self.state, queue_depth=len(self.state['queued']), time=time.time())
+            data = json.dumps(state).encode('utf-8')
+        self.send_headers(handler, 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        handler.end_headers()
+        handler.wfile.write(data)
+
+    def send_events(self, handler):
+        '''
+        Stream events until the run has finished, the server is closed or the client disconnects.
+        '''
+        try:
+            next_id = int(handler.headers.get('Last-Event-ID', 0))
+        except ValueError:
+            next_id = 0
+
+        self.send_headers(handler, 'text/event-stream')
+        handler.end_headers()
+        try:
+            while True:
+                with self.condition:
+                    if next_id >= len(self.events) and not self.closed:
+                        self.condition.wait(KEEPALIVE_INTERVAL)
+                    events = self.events[next_id:]
+                    closed = self.closed
+                if events:
+                    for event in events:
+                        handler.wfile.write(f'id: {event["id"]}\nevent: {event["type"]}\ndata: {json.dumps(event)}\n\n'.encode('utf-8'))
+                    next_id = events[-1]['id']
+                else:
+                    handler.wfile.write(b': keepalive\n\n')
+                handler.wfile.flush()
+                if closed or any(e['type'] == 'run_finished' for e in events):
+                    break
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def close(self):
+        '''
+        Close all event streams and stop the server.
+        '''
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.server.shutdown()
+        self.server.server_close()
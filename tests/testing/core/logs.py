@@ -0,0 +1,95 @@
+'''
+Module for reading large test logs without loading them at once.
+
+Logs are read in chunks of whole lines starting at a byte offset. An index of
+the byte offsets of error and warning lines (see LOG_LEVEL_PATTERNS) is built
+in a single streaming pass and cached by the log's identity (path, size and
+modification time), so the viewer can jump to problems without reading the
+whole log again. Searching a log streams it line by line as well. Searches only
+match literal strings, as user-supplied regular expressions could backtrack
+catastrophically and block a server thread.
+'''
+
+import re
+import threading
+from collections import OrderedDict
+
+from . import config
+
+def read_chunk(f, offset, length=config.LOG_CHUNK_SIZE):
+    '''
+    Read a chunk of whole lines from a binary log file, starting at offset and containing at least length bytes
+    (unless the end of the log is reached). Returns a tuple containing the text and the offset of the next chunk,
+    or None if the end of the log has been reached.
+    '''
+    f.seek(offset)
+    data = f.read(length)
+    if data and not data.endswith(b'\n'):
+        data += f.readline()
+    next_offset = offset + len(data)
+    return data.decode('utf-8', errors='replace'), next_offset if f.read(1) else None
+
+def index_log(f):
+    '''
+    Build the index of a binary log file.
+    Returns a dictionary containing the number of lines and, for each level of LOG_LEVEL_PATTERNS,
+    the list of matching lines (at most LOG_INDEX_LIMIT) with their line number, byte offset and text.
+    '''
+    patterns = {level: re.compile(pattern.encode('utf-8')) for level, pattern in config.LOG_LEVEL_PATTERNS.items()}
+    index = {'lines': 0, 'levels': {level: [] for level in patterns}, 'truncated': False}
+    offset = 0
+    for number, line in enumerate(f, 1):
+        for level, pattern in patterns.items():
+            if pattern.search(line):
+                lines = index['levels'][level]
+                if len(lines) < config.LOG_INDEX_LIMIT:
+                    lines.append({'line': number, 'offset': offset, 'text': line.decode('utf-8', errors='replace').rstrip()})
+                else:
+                    index['truncated'] = True
+                break
+        offset += len(line)
+        index['lines'] = number
+    return index
+
+def grep_log(f, pattern):
+    '''
+    Search a binary log file for lines containing a string (case-insensitive for ASCII characters).
+    Returns a tuple containing the list of matching lines (at most LOG_GREP_LIMIT) with their line number,
+    byte offset and text, and a flag indicating if there are more matches.
+    '''
+    pattern = pattern.encode('utf-8').lower()
+    matches = []
+    offset = 0
+    for number, line in enumerate(f, 1):
+        if pattern in line.lower():
+            if len(matches) == config.LOG_GREP_LIMIT:
+                return matches, True
+            matches.append({'line': number, 'offset': offset, 'text': line.decode('utf-8', errors='replace').rstrip()})
+        offset += len(line)
+    return matches, False
+
+class LogIndexCache:
+    '''
+    In-memory LRU cache of log indices keyed by the identity of the log.
+    '''
+
+    def __init__(self, size=config.LOG_INDEX_CACHE_SIZE):
+        self.size = size
+        self.indices = OrderedDict()
+        self.mutex = threading.Lock()
+
+    def get(self, key, open_log):
+        '''
+        Return the index of a log, building it from the binary file returned by open_log if it is not cached.
+        '''
+        with self.mutex:
+            if key in self.indices:
+                self.indices.move_to_end(key)
+                return self.indices[key]
+        with open_log() as f:
+            index = index_log(f)
+        with self.mutex:
+            self.indices[key] = index
+            while len(self.indices) > self.size:
+                self.indices.popitem(last=False)
+        return index
@@ -0,0 +1,111 @@
+'''
+Persistent image test worker running inside Mogwai.
+
+This module is imported by a small bootstrap script passed to Mogwai via --script.
+It connects back to the runner (see worker_pool.py) and runs the requested test
+scripts one after another, resetting Mogwai's state in between.
+'''
+
+import os
+import sys
+import traceback
+
+import falcor
+
+from . import profiler, worker_pool
+
+def module_dir(module):
+    '''
+    Return the directory a module was loaded from (None for built-in modules).
+    '''
+    path = getattr(module, '__file__', None)
+    if path:
+        return os.path.dirname(os.path.abspath(path))
+    # Namespace packages (e.g. graph directories without __init__.py) only have a search path.
+    paths = list(getattr(module, '__path__', None) or [])
+    return os.path.abspath(paths[0]) if paths else None
+
+def is_in_dirs(path, dirs):
+    '''
+    Check if a path lies inside any of a list of absolute directories.
+    '''
+    for d in dirs:
+        try:
+            if os.path.commonpath([path, d]) == d:
+                return True
+        except ValueError:
+            # Paths on different drives.
+            pass
+    return False
+
+def reset_state(m, context, context_keys, module_keys, sys_path, cwd, script_dir):
+    '''
+    Reset Mogwai and the python interpreter to the state before running a test.
+    '''
+    m.unloadScene()
+    while m.activeGraph:
+        m.removeGraph(m.activeGraph)
+
+    # Remove globals defined by the test script.
+    for key in list(context.keys()):
+        if key not in context_keys:
+            del context[key]
+
+    # Unload modules imported by the test script (e.g. render graphs and helpers) from its directory
+    # and the directories it added to sys.path. Other modules imported during the test (e.g. lazily
+    # imported falcor submodules or C extensions) are kept, as they cannot be safely imported again.
+    test_dirs = [os.path.abspath(os.path.join(script_dir, p)) for p in sys.path if p not in sys_path]
+    for key, module in list(sys.modules.items()):
+        if key not in module_keys:
+            path = module_dir(module)
+            if path and is_in_dirs(path, test_dirs):
+                del sys.modules[key]
+
+    sys.path[:] = sys_path
+    os.chdir(cwd)
+    falcor.__dict__.pop('IMAGE_TEST_RUN_ONLY', None)
+
+def run(m, context, address, token):
+    '''
+    Serve test requests until the runner asks the worker to exit.
+    m is the Mogwai renderer and context the globals of the bootstrap script.
+    '''
+    # Test scripts call exit() once they are done, which would terminate Mogwai.
+    falcor_exit = falcor.exit
+    falcor.exit = lambda errorCode=0: None
+
+    context_keys = set(context.keys())
+    module_keys = set(sys.modules.keys())
+    sys_path = list(sys.path)
+    cwd = os.getcwd()
+    log_file = falcor.Logger.log_file_path
+
+    def run_test(request):
+        script_file = request['script_file']
+        script_dir = os.path.dirname(os.path.abspath(script_file))
+        falcor.Logger.log_file_path = request['log_file']
+        if request['run_only']:
+            falcor.__dict__['IMAGE_TEST_RUN_ONLY'] = True
+        m.frameCapture.outputDir = request['output_dir']
+
+        # Mirror the working directory setup of a regular test run.
+        os.chdir(script_dir)
+        sys.path.insert(0, script_dir)
+
+        # Measure test phases using a proxy of the renderer.
+        proxy = profiler.RendererProxy(m)
+        context['m'] = proxy
+
+        try:
+            m.script(script_file)
+            return True, []
+        except BaseException as e:
+            return False, traceback.format_exception_only(type(e), e)
+        finally:
+            proxy.write_profile(request['profile_file'])
+            context['m'] = m
+            reset_state(m, context, context_keys, module_keys, sys_path, cwd, script_dir)
+            falcor.Logger.log_file_path = log_file
+
+    worker_pool.serve(address, token, run_test)
+    falcor_exit(0)
@@ -0,0 +1,245 @@
+'''
+Module containing an asyncio based orchestrator for running image tests.
+
+All Mogwai and ImageCompare processes are started with asyncio.create_subprocess_exec
+and multiplexed on a single event loop instead of blocking one thread per test.
+Blocking work (e.g. requests to persistent workers or hashing images) runs on a
+thread pool of the orchestrator. Process output is captured line by line while the
+process is running, SIGTERM and Ctrl-C cancel all running tests, and progress is
+reported as structured events:
+
+    {"type": "test_started", "time": 1700000000.0, "test": "..."}
+
+Event types are run_started, test_started, test_rerun, test_finished, run_finished,
+process_started, process_output, process_finished, interrupted and aborted.
+'''
+
+import asyncio
+import concurrent.futures
+import functools
+import json
+import signal
+import threading
+import time
+
+# Maximum length of a single line of process output.
+STREAM_LIMIT = 1 << 24
+
+class ProcessResult:
+    '''
+    Outcome of a process run by the orchestrator.
+    '''
+
+    def __init__(self):
+        self.returncode = None
+        self.stdout = []
+        self.stderr = []
+        self.timed_out = False
+        self.killed = False
+        self.launch_time = time.time()
+        self.spawned_time = self.launch_time
+
+class EventLog:
+    '''
+    Event listener writing progress events to a JSON lines file.
+    '''
+
+    def __init__(self, path):
+        self.file = open(path, 'w')
+        self.mutex = threading.Lock()
+
+    def __call__(self, event):
+        with self.mutex:
+            self.file.write(json.dumps(event) + '\n')
+            self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class Orchestrator:
+    '''
+    Runs coroutines on an event loop, limiting the number of concurrently running tests
+    to thread_count. Processes started outside the event loop (e.g. persistent workers)
+    can be registered with add_process, so they are killed on exit as well.
+    '''
+
+    def __init__(self, thread_count):
+        self.thread_count = thread_count
+        self.is_exiting = threading.Event()
+        self.processes = {}
+        self.processes_mutex = threading.Lock()
+        self.listeners = []
+        self.slots = None
+        self.task = None
+        self.loop = None
+        self.executor = None
+
+    def add_listener(self, listener):
+        '''
+        Add a callable receiving all progress events.
+        '''
+        self.listeners.append(listener)
+
+    def emit(self, type, **fields):
+        event = {'type': type, 'time': time.time()}
+        event.update(fields)
+        for listener in self.listeners:
+            listener(event)
+
+    def is_interrupted(self):
+        return self.is_exiting.is_set()
+
+    def interrupt_and_exit(self):
+        self.abort("Received interrupt (e.g. Ctrl-C), shutting down tests and exiting")
+
+    def abort(self, reason):
+        '''
+        Kill all running processes and prevent new ones from being started.
+        '''
+        print(reason)
+        self.emit('aborted', reason=reason)
+        self.is_exiting.set()
+        self.kill_all()
+
+    def kill_all(self):
+        with self.processes_mutex:
+            processes = list(self.processes.values())
+        for p in processes:
+            try:
+                p.kill()
+            except ProcessLookupError:
+                pass
+
+    def add_process(self, name, p):
+        with self.processes_mutex:
+            if self.is_exiting.is_set():
+                p.kill()
+                return False
+            self.processes[name] = p
+            return True
+
+    def remove_process(self, name):
+        with self.processes_mutex:
+            self.processes.pop(name, None)
+
+    def run_in_thread(self, func, *args):
+        '''
+        Run a blocking function on the orchestrator's thread pool and return an awaitable of its result.
+        '''
+        return self.loop.run_in_executor(self.executor, functools.partial(func, *args))
+
+    def call_soon_threadsafe(self, callback, *args):
+        '''
+        Call a callback on the event loop thread (e.g. for printing from other threads).
+        The callback is called directly if no run is in progress.
+        '''
+        loop = self.loop
+        if loop != None and not loop.is_closed():
+            try:
+                loop.call_soon_threadsafe(callback, *args)
+                return
+            except RuntimeError:
+                # The loop has been closed in the meantime.
+                pass
+        callback(*args)
+
+    def run(self, coro):
+        '''
+        Run a coroutine on a new event loop until it completes.
+        Raises KeyboardInterrupt if the run has been cancelled by SIGTERM or Ctrl-C.
+        '''
+        return asyncio.run(self._main(coro))
+
+    async def _main(self, coro):
+        loop = asyncio.get_running_loop()
+        self.task = asyncio.current_task()
+        self.slots = asyncio.Semaphore(self.thread_count)
+        self.executor = concurrent.futures.ThreadPoolExecutor(self.thread_count)
+        self.loop = loop
+
+        # Cancel the run on SIGTERM and Ctrl-C (restoring the previous handlers afterwards).
+        handlers = {}
+        for signum in [signal.SIGINT, signal.SIGTERM]:
+            try:
+                previous = signal.getsignal(signum)
+                loop.add_signal_handler(signum, self._interrupt, signum)
+                handlers[signum] = previous
+            except (NotImplementedError, RuntimeError):
+                # Signal handlers are not supported by the event loop on Windows.
+                pass
+
+        try:
+            return await coro
+        except asyncio.CancelledError:
+            if self.is_exiting.is_set():
+                raise KeyboardInterrupt
+            raise
+        finally:
+            for signum, previous in handlers.items():
+                loop.remove_signal_handler(signum)
+                signal.signal(signum, previous)
+            # Do not wait for threads still blocked in requests to workers (they return once the workers are killed).
+            self.loop = None
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _interrupt(self, signum):
+        self.emit('interrupted', signal=signal.Signals(signum).name)
+        self.is_exiting.set()
+        self.kill_all()
+        self.task.cancel()
+
+    async def run_process(self, name, args, cwd=None, timeout=None, merge_stderr=False):
+        '''
+        Run a process, capturing stdout and stderr line by line while it is running.
+        The process is killed if it does not finish within timeout seconds or the run is interrupted.
+        '''
+        result = ProcessResult()
+        if self.is_interrupted():
+            result.killed = True
+            return result
+
+        result.launch_time = time.time()
+        p = await asyncio.create_subprocess_exec(
+            *args, cwd=cwd, limit=STREAM_LIMIT,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT if merge_stderr else asyncio.subprocess.PIPE)
+        result.spawned_time = time.time()
+        if not self.add_process(name, p):
+            await p.wait()
+            result.killed = True
+            return result
+        self.emit('process_started', name=name, pid=p.pid)
+
+        async def read_stream(stream, lines, stream_name):
+            async for line in stream:
+                line = line.decode('utf-8', 'replace').rstrip('\r\n')
+                lines.append(line)
+                self.emit('process_output', name=name, stream=stream_name, line=line)
+
+        tasks = [asyncio.create_task(read_stream(p.stdout, result.stdout, 'stdout'))]
+        if not merge_stderr:
+            tasks.append(asyncio.create_task(read_stream(p.stderr, result.stderr, 'stderr')))
+        tasks.append(asyncio.create_task(p.wait()))
+
+        try:
+            _, pending = await asyncio.wait(tasks, timeout=timeout)
+            result.timed_out = len(pending) > 0
+        finally:
+            # Make sure the process does not outlive a timeout or cancellation.
+            if p.returncode == None:
+                try:
+                    p.kill()
+                except ProcessLookupError:
+                    pass
+                await p.wait()
+            # Give the readers a moment to drain the pipes (they may be held open by child processes).
+            _, pending = await asyncio.wait(tasks, timeout=1)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.remove_process(name)
+
+        result.returncode = p.returncode
+        result.killed = self.is_interrupted() and p.returncode != 0
+        self.emit('process_finished', name=name, returncode=p.returncode, elapsed_time=time.time() - result.launch_time)
+        return result
@@ -0,0 +1,179 @@
+'''
+Module generating downscaled and tonemapped previews of test images.
+
+Previews are written by ImageCompare (--preview) as PNG files and cached on
+disk, keyed by the hash of the image and the preview size, so identical
+images (e.g. references shared by many runs) share a single preview.
+
+The cache also holds the loss maps (L1, L2, MAPE, MRSE, SMAPE and SSIM) shown
+by the compare view. They are written by ImageCompare (--loss-maps) as half
+precision EXR files, keyed by the hashes of both images, so they are computed
+once instead of by the browser every time an image pair is viewed. Errors of
+image pairs computed by ImageCompare are cached the same way.
+'''
+
+import contextlib
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import uuid
+from pathlib import Path
+
+from . import config
+from .helpers import hash_file
+
+class PreviewCache:
+    '''
+    On-disk cache of image previews.
+    '''
+
+    def __init__(self, cache_dir: Path, image_compare_exe: Path):
+        self.cache_dir = cache_dir
+        self.image_compare_exe = image_compare_exe
+        # Hashes of image files by (path, size, modification time).
+        self.hashes = {}
+        self.hashes_mutex = threading.Lock()
+
+    def file_hash(self, path: Path):
+        '''
+        Return the hash of an image file, only hashing files that have been modified since they were last hashed.
+        '''
+        stat = path.stat()
+        key = (str(path), stat.st_size, stat.st_mtime_ns)
+        with self.hashes_mutex:
+            digest = self.hashes.get(key, None)
+        if digest == None:
+            digest = hash_file(path)
+            with self.hashes_mutex:
+                self.hashes[key] = digest
+        return digest
+
+    def image_hash(self, image):
+        return self.file_hash(image) if isinstance(image, Path) else hashlib.sha256(image).hexdigest()
+
+    @contextlib.contextmanager
+    def image_files(self, images):
+        '''
+        Context manager returning the paths of images given as tuples (path or contents, suffix).
+        ImageCompare reads files only, so image contents are written to temporary files.
+        '''
+        temp_files = []
+        try:
+            paths = []
+            for image, suffix in images:
+                if isinstance(image, Path):
+                    paths.append(image)
+                    continue
+                with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+                    temp_files.append(Path(f.name))
+                    f.write(image)
+                paths.append(temp_files[-1])
+            yield paths
+        finally:
+            for f in temp_files:
+                f.unlink()
+
+    def get(self, image, suffix, size):
+        '''
+        Return the path to the preview of an image (given as a path or its contents) no larger than size pixels.
+        The suffix (e.g. '.exr') determines the image format. Returns None if the preview cannot be generated.
+        '''
+        try:
+            digest = self.image_hash(image)
+        except OSError:
+            return None
+        preview_file = self.cache_dir / digest[0:2] / f'{digest}_{size}.png'
+        if preview_file.exists():
+            return preview_file
+
+        preview_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = preview_file.parent / f'.{preview_file.stem}.{uuid.uuid4().hex[:8]}.png'
+        try:
+            with self.image_files([(image, suffix)]) as paths:
+                args = [str(self.image_compare_exe), '--preview', str(temp_file), '--preview-size', str(size), str(paths[0])]
+                p = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=config.PREVIEW_TIMEOUT)
+            if p.returncode != 0 or not temp_file.exists():
+                return None
+            os.replace(temp_file, preview_file)
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        finally:
+            if temp_file.exists():
+                temp_file.unlink()
+
+        return preview_file
+
+    def error(self, image, ref_image, suffix, ref_suffix, metric):
+        '''
+        Return the error of an image compared to a reference (both given as paths or contents) using an ImageCompare metric.
+        Returns 0 for identical files and None if the images cannot be compared.
+        '''
+        try:
+            digest = self.image_hash(image)
+            ref_digest = self.image_hash(ref_image)
+        except OSError:
+            return None
+        if digest == ref_digest:
+            return 0.0
+        error_file = self.cache_dir / digest[0:2] / f'{digest}_{ref_digest}_{metric}.txt'
+        try:
+            return float(error_file.read_text())
+        except (OSError, ValueError):
+            pass
+
+        try:
+            with self.image_files([(image, suffix), (ref_image, ref_suffix)]) as paths:
+                # ImageCompare fails for errors above the threshold (zero by default), so only the output is checked.
+                args = [str(self.image_compare_exe), '-m', metric, str(paths[1]), str(paths[0])]
+                p = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=config.LOSS_MAP_TIMEOUT)
+            error = float(p.stdout.decode().strip())
+        except (OSError, ValueError, subprocess.TimeoutExpired):
+            return None
+
+        error_file.parent.mkdir(parents=True, exist_ok=True)
+        temp_file = error_file.parent / f'.{error_file.stem}.{uuid.uuid4().hex[:8]}.txt'
+        temp_file.write_text(str(error))
+        os.replace(temp_file, error_file)
+        return error
+
+    def loss_map(self, image, ref_image, suffix, ref_suffix, function):
+        '''
+        Return the path to the loss map of an image compared to its reference (both given as paths or contents).
+        All loss maps of an image pair are generated at once. Returns None if they cannot be generated.
+        '''
+        if not function in config.LOSS_MAP_FUNCTIONS:
+            return None
+        try:
+            digest = self.image_hash(image)
+            ref_digest = self.image_hash(ref_image)
+        except OSError:
+            return None
+        maps_dir = self.cache_dir / digest[0:2] / f'{digest}_{ref_digest}'
+        map_file = maps_dir / f'{function}.exr'
+        if map_file.exists():
+            return map_file
+
+        maps_dir.parent.mkdir(parents=True, exist_ok=True)
+        temp_dir = maps_dir.parent / f'.{maps_dir.name}.{uuid.uuid4().hex[:8]}'
+        try:
+            temp_dir.mkdir()
+            with self.image_files([(image, suffix), (ref_image, ref_suffix)]) as paths:
+                # The reference is the second image, as it is used to normalize the relative loss functions.
+                args = [str(self.image_compare_exe), '--loss-maps', str(temp_dir), str(paths[0]), str(paths[1])]
+                p = subprocess.run(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=config.LOSS_MAP_TIMEOUT)
+            if p.returncode != 0 or not (temp_dir / map_file.name).exists():
+                return None
+            try:
+                os.replace(temp_dir, maps_dir)
+            except OSError:
+                # The maps have been generated concurrently.
+                pass
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        finally:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
+        return map_file if map_file.exists() else None
@@ -0,0 +1,154 @@
+'''
+Profiling of image test scripts running inside Mogwai.
+
+The Mogwai renderer object m is replaced by a RendererProxy before running a
+test script. The proxy forwards everything to the renderer while measuring the
+time spent loading scenes, rendering frames and writing frame captures. After
+the script has finished, the measured timings, timestamps and resource usage
+of the Mogwai process are written to a JSON file read back by the runner.
+'''
+
+import json
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def read_process_stats():
+    '''
+    Return resource usage of the current process: CPU time (s), peak resident set size (bytes)
+    and bytes read and written from storage. Statistics not available on the platform are omitted.
+    '''
+    stats = {}
+    if resource:
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        stats['cpu_time'] = usage.ru_utime + usage.ru_stime
+        # ru_maxrss is reported in kilobytes on Linux.
+        stats['peak_rss'] = usage.ru_maxrss * 1024
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':')
+                if key in ['read_bytes', 'write_bytes']:
+                    stats[key] = int(value)
+    except (OSError, ValueError):
+        pass
+    return stats
+
+class PhaseTimer:
+    '''
+    Accumulates the time spent in named phases.
+    '''
+
+    class Measurement:
+        def __init__(self, timer, phase):
+            self.timer = timer
+            self.phase = phase
+
+        def __enter__(self):
+            self.start_time = time.time()
+
+        def __exit__(self, *args):
+            self.timer.phases[self.phase] = self.timer.phases.get(self.phase, 0) + time.time() - self.start_time
+            self.timer.counts[self.phase] = self.timer.counts.get(self.phase, 0) + 1
+
+    def __init__(self):
+        self.phases = {}
+        self.counts = {}
+
+    def measure(self, phase):
+        return PhaseTimer.Measurement(self, phase)
+
+class Proxy:
+    '''
+    Forwards attribute access to a wrapped object.
+    '''
+
+    def __init__(self, target, timer):
+        object.__setattr__(self, '_target', target)
+        object.__setattr__(self, '_timer', timer)
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+    def __setattr__(self, name, value):
+        setattr(self._target, name, value)
+
+class FrameCaptureProxy(Proxy):
+    def capture(self, *args, **kwargs):
+        with self._timer.measure('capture_write'):
+            return self._target.capture(*args, **kwargs)
+
+class RendererProxy(Proxy):
+    '''
+    Proxy for the Mogwai renderer measuring scene loading, frame rendering and frame capture.
+    '''
+
+    def __init__(self, target):
+        super().__init__(target, PhaseTimer())
+        object.__setattr__(self, '_start_time', time.time())
+        object.__setattr__(self, '_start_stats', read_process_stats())
+
+    def loadScene(self, *args, **kwargs):
+        with self._timer.measure('scene_load'):
+            return self._target.loadScene(*args, **kwargs)
+
+    def renderFrame(self, *args, **kwargs):
+        with self._timer.measure('frame_render'):
+            return self._target.renderFrame(*args, **kwargs)
+
+    @property
+    def frameCapture(self):
+        return FrameCaptureProxy(self._target.frameCapture, self._timer)
+
+    def write_profile(self, profile_file):
+        '''
+        Write the timings and the resource usage of the process at the start and end of the script run to a JSON file.
+        '''
+        profile = {
+            'start_time': self._start_time,
+            'end_time': time.time(),
+            'phases': self._timer.phases,
+            'counts': self._timer.counts,
+            'start_stats': self._start_stats,
+            'end_stats': read_process_stats()
+        }
+        with open(profile_file, 'w') as f:
+            json.dump(profile, f)
+
+def load_profile(profile_file, launch_time, spawned_time, end_time, fresh_process):
+    '''
+    Load a profile written by RendererProxy.write_profile and convert it to a dictionary of
+    phase durations (s) and resource usage of the test. Used by the runner after Mogwai
+    has finished. launch_time and spawned_time are the times before and after starting
+    the Mogwai process (or sending the request to a persistent worker) and end_time is the
+    time the test finished. For a fresh process, resource usage covers the whole process,
+    otherwise only the script run. Missing information (e.g. after a crash) is omitted.
+    '''
+    phases = {'process_spawn': spawned_time - launch_time}
+    resources = {}
+    try:
+        with open(profile_file) as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        phases['mogwai'] = end_time - spawned_time
+        return {'phases': phases, 'resources': resources}
+
+    phases['mogwai_init'] = profile['start_time'] - spawned_time
+    for phase in ['scene_load', 'frame_render', 'capture_write']:
+        phases[phase] = profile['phases'].get(phase, 0)
+    script_time = profile['end_time'] - profile['start_time']
+    phases['script_other'] = max(0, script_time - sum(profile['phases'].values()))
+    phases['shutdown'] = end_time - profile['end_time']
+
+    start_stats = profile['start_stats']
+    end_stats = profile['end_stats']
+    for key, value in end_stats.items():
+        if key == 'peak_rss' or fresh_process:
+            resources[key] = value
+        elif key in start_stats:
+            resources[key] = value - start_stats[key]
+
+    return {'phases': phases, 'counts': profile['counts'], 'resources': resources}
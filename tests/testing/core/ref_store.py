@@ -0,0 +1,248 @@
+'''
+Module containing a content-addressed store for reference images.
+
+The store is a plain directory (local or on a network share) laid out as:
+
+    objects/<xx>/<sha256>                    - file blobs, named by content hash
+    manifests/<branch>/<build_config>.json   - maps file paths to blob hashes
+
+References consist of the reference images and the other files generated with
+them (e.g. the test logs). Identical files of different branches and build
+configurations are stored only once. Pushing and pulling only transfers blobs
+missing on the other side.
+Blobs and manifests are written to temporary files and renamed, and manifests
+are written after all their blobs, so readers never see partial state.
+
+Reference directories contain a local manifest caching the hashes of their
+files (keyed on size and modification time) to avoid rehashing unchanged files.
+'''
+
+import concurrent.futures
+import datetime
+import json
+import os
+import shutil
+import uuid
+from pathlib import Path
+
+from . import config
+from .helpers import hash_file
+
+# Version of the manifest format.
+MANIFEST_VERSION = 1
+
+def atomic_copy(src: Path, dst: Path):
+    '''
+    Copy a file so that dst either does not exist or is complete.
+    '''
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = dst.with_name(f'.{dst.name}.{uuid.uuid4().hex[:8]}.tmp')
+    try:
+        shutil.copyfile(src, temp_file)
+        os.replace(temp_file, dst)
+    finally:
+        if temp_file.exists():
+            temp_file.unlink()
+
+def write_json(path: Path, data):
+    '''
+    Write a JSON file atomically.
+    '''
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_file = path.with_name(f'.{path.name}.{uuid.uuid4().hex[:8]}.tmp')
+    with open(temp_file, 'w') as f:
+        json.dump(data, f, indent=4, sort_keys=True)
+    os.replace(temp_file, path)
+
+def read_json(path: Path):
+    '''
+    Read a JSON file. Returns None if it does not exist or is invalid.
+    '''
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def is_temp_file(path: Path):
+    '''
+    Check if a file is a temporary file written by atomic_copy or write_json.
+    '''
+    return path.name.startswith('.') and path.name.endswith('.tmp')
+
+def collect_ref_files(ref_dir: Path):
+    '''
+    Return a sorted list of all reference files (relative posix paths) in ref_dir, i.e. the reference
+    images and other files generated with them (e.g. logs). Error images, the local manifest and
+    temporary files are not part of the references.
+    '''
+    files = []
+    if ref_dir.exists():
+        for path in ref_dir.glob('**/*'):
+            if path.is_file() and path != ref_dir / config.REF_MANIFEST_FILE and not path.name.endswith(config.ERROR_IMAGE_SUFFIX) and not is_temp_file(path):
+                files.append(path.relative_to(ref_dir).as_posix())
+    return sorted(files)
+
+class LocalManifest:
+    '''
+    Manifest of a reference directory, caching file hashes by size and modification time.
+    '''
+
+    def __init__(self, ref_dir: Path):
+        self.ref_dir = ref_dir
+        self.path = ref_dir / config.REF_MANIFEST_FILE
+        manifest = read_json(self.path)
+        if not manifest or manifest.get('version') != MANIFEST_VERSION:
+            manifest = {}
+        # File hashes by file path.
+        self.files = manifest.get('files', {})
+        # Dependency hashes the references were generated from by test name.
+        self.tests = manifest.get('tests', {})
+
+    def save(self):
+        write_json(self.path, {'version': MANIFEST_VERSION, 'files': self.files, 'tests': self.tests})
+
+    def update(self, files=None, thread_count=config.REF_STORE_THREAD_COUNT):
+        '''
+        Update the hashes of the given files (all reference files by default), hashing only modified files.
+        Entries of files that no longer exist are removed.
+        Returns a dictionary mapping file paths to hashes.
+        '''
+        if files == None:
+            files = collect_ref_files(self.ref_dir)
+            existing = set(files)
+            self.files = {k: v for k, v in self.files.items() if k in existing}
+
+        stale = []
+        for file in files:
+            path = self.ref_dir / file
+            if not path.exists():
+                self.files.pop(file, None)
+                continue
+            stat = path.stat()
+            entry = self.files.get(file)
+            if not entry or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+                stale.append((file, stat))
+
+        with concurrent.futures.ThreadPoolExecutor(thread_count) as executor:
+            digests = executor.map(lambda s: hash_file(self.ref_dir / s[0]), stale)
+            for (file, stat), digest in zip(stale, digests):
+                self.files[file] = {'sha256': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+        return {file: self.files[file]['sha256'] for file in files if file in self.files}
+
+class RefStore:
+    '''
+    Content-addressed store of reference files.
+    '''
+
+    def __init__(self, root: Path, thread_count=config.REF_STORE_THREAD_COUNT):
+        self.root = root
+        self.thread_count = thread_count
+
+    def blob_path(self, digest):
+        return self.root / 'objects' / digest[:2] / digest
+
+    def manifest_path(self, branch, build_config):
+        branch = branch.replace('/', '^').replace('\\', '^')
+        return self.root / 'manifests' / branch / f'{build_config}.json'
+
+    def read_manifest(self, branch, build_config):
+        '''
+        Return the manifest of a branch and build configuration (or None).
+        '''
+        manifest = read_json(self.manifest_path(branch, build_config))
+        if not manifest or manifest.get('version') != MANIFEST_VERSION:
+            return None
+        return manifest
+
+    def write_manifest(self, branch, build_config, files, tests):
+        write_json(self.manifest_path(branch, build_config), {
+            'version': MANIFEST_VERSION,
+            'branch': branch,
+            'build_config': build_config,
+            'date': datetime.datetime.now().isoformat(),
+            'files': files,
+            'tests': tests
+        })
+
+    def _copy_all(self, copies):
+        '''
+        Copy a list of (src, dst) pairs in parallel.
+        Returns the number of bytes copied and a list of errors.
+        '''
+        def copy(pair):
+            src, dst = pair
+            try:
+                atomic_copy(src, dst)
+                return dst.stat().st_size, None
+            except OSError as e:
+                return 0, f'Failed to copy {src} to {dst} ({e})'
+
+        size = 0
+        errors = []
+        with concurrent.futures.ThreadPoolExecutor(self.thread_count) as executor:
+            for copied, error in executor.map(copy, copies):
+                size += copied
+                if error:
+                    errors.append(error)
+        return size, errors
+
+    def push(self, ref_dir: Path, branch, build_config):
+        '''
+        Push the reference files in ref_dir to the store, uploading only missing blobs.
+        Returns a tuple containing a success flag and a log string.
+        '''
+        local = LocalManifest(ref_dir)
+        files = local.update(thread_count=self.thread_count)
+        local.save()
+
+        blobs = {}
+        for file, digest in files.items():
+            blobs.setdefault(digest, file)
+        with concurrent.futures.ThreadPoolExecutor(self.thread_count) as executor:
+            exists = list(executor.map(lambda d: self.blob_path(d).exists(), blobs.keys()))
+        copies = [(ref_dir / file, self.blob_path(digest)) for (digest, file), e in zip(blobs.items(), exists) if not e]
+
+        size, errors = self._copy_all(copies)
+        if errors:
+            return False, '\n'.join(errors)
+
+        self.write_manifest(branch, build_config, files, local.tests)
+        return True, f'{len(files)} files, {len(copies)} new blobs uploaded ({size / (1 << 20):.1f} MB)'
+
+    def pull(self, ref_dir: Path, branch, build_config):
+        '''
+        Pull the reference files of a branch and build configuration from the store into ref_dir,
+        downloading only files that differ from the local ones. Local files not in the manifest are removed.
+        Returns a tuple containing a success flag and a log string.
+        '''
+        manifest = self.read_manifest(branch, build_config)
+        if manifest == None:
+            return False, f'No references found for branch "{branch}" and build configuration "{build_config}" in {self.root}'
+        files = manifest['files']
+
+        local = LocalManifest(ref_dir)
+        local_files = local.update(thread_count=self.thread_count)
+
+        copies = [(self.blob_path(digest), ref_dir / file) for file, digest in files.items() if local_files.get(file) != digest]
+        size, errors = self._copy_all(copies)
+
+        # Record hashes of downloaded files to avoid rehashing them.
+        for file, digest in files.items():
+            path = ref_dir / file
+            if local_files.get(file) != digest and path.exists():
+                stat = path.stat()
+                local.files[file] = {'sha256': digest, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+        removed = [file for file in local_files if not file in files]
+        for file in removed:
+            (ref_dir / file).unlink()
+            del local.files[file]
+
+        local.tests = manifest.get('tests', {})
+        local.save()
+
+        if errors:
+            return False, '\n'.join(errors)
+        return True, f'{len(files)} files, {len(copies)} downloaded ({size / (1 << 20):.1f} MB), {len(removed)} removed'
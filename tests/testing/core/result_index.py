@@ -0,0 +1,337 @@
+'''
+Module containing an SQLite index of image test results.
+
+The index mirrors the runs, tests and image results found in a result
+directory, so the viewer can answer queries without globbing and parsing
+every report. It is kept up to date by an incremental scanner: only the
+run-level files (run report, journal and archive) are checked on every scan,
+and the test reports of a run are only read again once one of them has
+changed. Test reports are only re-parsed if their modification time differs
+from the indexed one.
+'''
+
+import json
+import sqlite3
+import threading
+import time
+import datetime
+from pathlib import Path
+
+from . import config
+from .journal import read_journal, summarize_journal
+from .ref_store import read_json
+from .results import ResultLayout, RunArchive
+
+# Version of the index schema (the index is rebuilt if it does not match).
+INDEX_VERSION = 3
+
+class ResultIndex:
+    '''
+    SQLite index of the runs, tests and image results in a result directory.
+    '''
+
+    def __init__(self, path: Path, layout: ResultLayout):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.layout = layout
+        self.mutex = threading.Lock()
+        self.last_scan_time = 0
+        self.connection = sqlite3.connect(str(path), check_same_thread=False)
+
+        if self.connection.execute('PRAGMA user_version').fetchone()[0] != INDEX_VERSION:
+            for table in ['runs', 'run_tags', 'tests', 'images']:
+                self.connection.execute(f'DROP TABLE IF EXISTS {table}')
+            self.connection.execute(f'PRAGMA user_version = {INDEX_VERSION}')
+
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS runs (
+                run_dir TEXT PRIMARY KEY,
+                stamp TEXT NOT NULL,
+                date TEXT NOT NULL,
+                result TEXT NOT NULL,
+                duration REAL NOT NULL,
+                tests TEXT NOT NULL,
+                progress TEXT
+            )''')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS run_tags (
+                run_dir TEXT NOT NULL,
+                tag TEXT NOT NULL,
+                value TEXT NOT NULL
+            )''')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS tests (
+                run_dir TEXT NOT NULL,
+                test_dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                result TEXT NOT NULL,
+                duration REAL NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                error_ratio REAL,
+                report TEXT NOT NULL,
+                PRIMARY KEY (run_dir, test_dir)
+            )''')
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS images (
+                run_dir TEXT NOT NULL,
+                test_dir TEXT NOT NULL,
+                name TEXT NOT NULL,
+                success INTEGER NOT NULL,
+                error REAL,
+                tolerance REAL,
+                metric TEXT
+            )''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS runs_date ON runs (date)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS run_tags_value ON run_tags (tag, value, run_dir)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS tests_run ON tests (run_dir, result, test_dir)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS tests_name ON tests (name)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS images_test ON images (run_dir, test_dir)')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def scan(self, min_interval=0):
+        '''
+        Update the index from the result directory.
+        Nothing is done if the last scan has been less than min_interval seconds ago.
+        '''
+        with self.mutex:
+            if time.time() - self.last_scan_time < min_interval:
+                return
+            self.last_scan_time = time.time()
+
+            # Collect modification times of run-level files.
+            stamps = {}
+            for name in ['report.json', config.JOURNAL_FILE, config.RESULT_ARCHIVE_FILE]:
+                for f in self.layout.result_dir.glob(self.layout.run_glob(name)):
+                    run_dir = f.parent.relative_to(self.layout.result_dir).as_posix()
+                    try:
+                        stamps.setdefault(run_dir, {})[name] = f.stat().st_mtime_ns
+                    except OSError:
+                        continue
+
+            indexed = dict(self.connection.execute('SELECT run_dir, stamp FROM runs'))
+            for run_dir in indexed.keys() - stamps.keys():
+                self.remove_run(run_dir)
+            for run_dir, files in stamps.items():
+                stamp = json.dumps(files, sort_keys=True)
+                if indexed.get(run_dir) != stamp:
+                    self.index_run(run_dir, stamp)
+            self.connection.commit()
+
+    def remove_run(self, run_dir):
+        for table in ['runs', 'run_tags', 'tests', 'images']:
+            self.connection.execute(f'DELETE FROM {table} WHERE run_dir = ?', (run_dir,))
+
+    def remove_test(self, run_dir, test_dir):
+        for table in ['tests', 'images']:
+            self.connection.execute(f'DELETE FROM {table} WHERE run_dir = ? AND test_dir = ?', (run_dir, test_dir))
+
+    def index_run(self, run_dir, stamp):
+        '''
+        Index a run and the test reports that have changed since it was last indexed.
+        '''
+        run_path = self.layout.result_dir / run_dir
+
+        # Runs in progress are summarized from their journal.
+        run = read_json(run_path / 'report.json')
+        progress = None
+        if not run:
+            run, finished = summarize_journal(read_journal(run_path / config.JOURNAL_FILE)[0])
+            if not run:
+                self.remove_run(run_dir)
+                return
+            run = {'date': run['date'], 'result': 'RUNNING', 'tests': run['tests'], 'duration': 0}
+            progress = f"{len(finished)}/{len(run['tests'])}"
+
+        # Collect test reports (loose reports take precedence over the ones in the run's archive).
+        reports = {}
+        archive = None
+        archive_file = run_path / config.RESULT_ARCHIVE_FILE
+        if archive_file.exists():
+            archive = RunArchive(archive_file)
+            for name in archive.test_reports():
+                reports[name[:-len('/report.json')]] = (archive.mtime_ns, lambda name=name: archive.read(name))
+        for f in run_path.glob('*/**/report.json'):
+            try:
+                reports[f.parent.relative_to(run_path).as_posix()] = (f.stat().st_mtime_ns, f.read_bytes)
+            except OSError:
+                continue
+
+        try:
+            indexed = dict(self.connection.execute('SELECT test_dir, mtime_ns FROM tests WHERE run_dir = ?', (run_dir,)))
+            for test_dir in indexed.keys() - reports.keys():
+                self.remove_test(run_dir, test_dir)
+            for test_dir, (mtime_ns, read) in reports.items():
+                if indexed.get(test_dir) == mtime_ns:
+                    continue
+                self.remove_test(run_dir, test_dir)
+                try:
+                    test = json.loads(read())
+                except (OSError, ValueError, TypeError):
+                    continue
+                self.add_test(run_dir, test_dir, mtime_ns, test)
+        finally:
+            if archive:
+                archive.close()
+
+        self.connection.execute(
+            'INSERT OR REPLACE INTO runs (run_dir, stamp, date, result, duration, tests, progress) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (run_dir, stamp, run['date'], run['result'], run.get('duration', 0), json.dumps(run['tests']), progress))
+        self.connection.execute('DELETE FROM run_tags WHERE run_dir = ?', (run_dir,))
+        self.connection.executemany(
+            'INSERT INTO run_tags (run_dir, tag, value) VALUES (?, ?, ?)',
+            [(run_dir, tag, value) for tag, value in self.layout.tags(run_dir).items()])
+
+    def add_test(self, run_dir, test_dir, mtime_ns, test):
+        # The largest ratio of error to tolerance of the test's images is stored for trends.
+        ratios = [i['error'] / i['tolerance'] for i in test.get('images', []) if i.get('error') != None and (i.get('tolerance') or 0) > 0]
+        self.connection.execute(
+            'INSERT INTO tests (run_dir, test_dir, name, result, duration, mtime_ns, error_ratio, report) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (run_dir, test_dir, test.get('name', test_dir), test.get('result', ''), test.get('duration', 0), mtime_ns,
+                max(ratios) if ratios else None, json.dumps(test)))
+        self.connection.executemany(
+            'INSERT INTO images (run_dir, test_dir, name, success, error, tolerance, metric) VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(run_dir, test_dir, i['name'], i.get('success', False), i.get('error'), i.get('tolerance'), i.get('metric')) for i in test.get('images', [])])
+
+    def make_run(self, row):
+        run_dir, date, result, duration, tests, progress = row
+        run = {
+            'run_dir': run_dir,
+            'run_tags': self.layout.tags(run_dir),
+            'date': date,
+            'result': result,
+            'duration': duration,
+            'tests': json.loads(tests)
+        }
+        if progress != None:
+            run['progress'] = progress
+            run['duration'] = (datetime.datetime.now() - datetime.datetime.fromisoformat(date)).total_seconds()
+        return run
+
+    def runs(self, tags={}, result=None, date_from=None, date_to=None, offset=0, limit=None):
+        '''
+        Return a tuple containing a list of runs matching the given filters (sorted by date, most recent
+        first, starting at offset and containing at most limit runs) and the total number of matching runs.
+        Runs are filtered by tag values, result and date range (ISO dates, date_to is inclusive).
+        '''
+        conditions = []
+        params = []
+        for tag, value in tags.items():
+            conditions.append('run_dir IN (SELECT run_dir FROM run_tags WHERE tag = ? AND value = ?)')
+            params += [tag, value]
+        if result:
+            conditions.append('result = ?')
+            params.append(result)
+        if date_from:
+            conditions.append('date >= ?')
+            params.append(date_from)
+        if date_to:
+            # Include the whole day if only a date is given.
+            conditions.append('date <= ?')
+            params.append(date_to + 'T99' if len(date_to) == 10 else date_to)
+        where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+        with self.mutex:
+            total = self.connection.execute('SELECT COUNT(*) FROM runs' + where, params).fetchone()[0]
+            rows = self.connection.execute(
+                'SELECT run_dir, date, result, duration, tests, progress FROM runs' + where + ' ORDER BY date DESC LIMIT ? OFFSET ?',
+                params + [limit if limit != None else -1, offset]).fetchall()
+        return [self.make_run(row) for row in rows], total
+
+    def tag_values(self, tag):
+        '''
+        Return the sorted list of distinct values of a run tag.
+        '''
+        with self.mutex:
+            rows = self.connection.execute('SELECT DISTINCT value FROM run_tags WHERE tag = ? ORDER BY value', (tag,)).fetchall()
+        return [row[0] for row in rows]
+
+    def run(self, run_dir):
+        '''
+        Return a single run (or None).
+        '''
+        with self.mutex:
+            row = self.connection.execute('SELECT run_dir, date, result, duration, tests, progress FROM runs WHERE run_dir = ?', (run_dir,)).fetchone()
+        return self.make_run(row) if row else None
+
+    def tests(self, run_dir, result=None, search=None, offset=0, limit=None):
+        '''
+        Return a tuple containing the reports of the tests of a run matching the given filters (sorted by name,
+        starting at offset and containing at most limit tests) and the total number of matching tests.
+        Tests are filtered by result and a case-insensitive substring of their name.
+        '''
+        conditions = ['run_dir = ?']
+        params = [run_dir]
+        if result:
+            conditions.append('result = ?')
+            params.append(result)
+        if search:
+            conditions.append("name LIKE ? ESCAPE '\\'")
+            params.append('%' + search.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%')
+        where = ' WHERE ' + ' AND '.join(conditions)
+
+        with self.mutex:
+            total = self.connection.execute('SELECT COUNT(*) FROM tests' + where, params).fetchone()[0]
+            rows = self.connection.execute(
+                'SELECT report FROM tests' + where + ' ORDER BY test_dir LIMIT ? OFFSET ?',
+                params + [limit if limit != None else -1, offset]).fetchall()
+        return [json.loads(row[0]) for row in rows], total
+
+    def result_counts(self, run_dir):
+        '''
+        Return a dictionary mapping test results to the number of tests of a run with that result.
+        '''
+        with self.mutex:
+            rows = self.connection.execute('SELECT result, COUNT(*) FROM tests WHERE run_dir = ? GROUP BY result', (run_dir,)).fetchall()
+        return dict(rows)
+
+    def test(self, run_dir, test_dir):
+        '''
+        Return the report of a single test (or None).
+        '''
+        with self.mutex:
+            row = self.connection.execute('SELECT report FROM tests WHERE run_dir = ? AND test_dir = ?', (run_dir, test_dir)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def test_runs(self, name):
+        '''
+        Return a list of tuples (run directory, test directory) of the runs containing a test, most recent first.
+        '''
+        with self.mutex:
+            return self.connection.execute(
+                'SELECT tests.run_dir, tests.test_dir FROM tests JOIN runs ON tests.run_dir = runs.run_dir '
+                'WHERE tests.name = ? ORDER BY runs.date DESC', (name,)).fetchall()
+
+    def test_trends(self, run_dirs, name=None):
+        '''
+        Return a dictionary mapping test names to their results in the given runs (optionally only for a single test).
+        Results are dictionaries mapping run directories to tuples (test directory, result, duration, error ratio).
+        '''
+        params = list(run_dirs)
+        condition = f"run_dir IN ({', '.join('?' * len(params))})"
+        if name != None:
+            condition += ' AND name = ?'
+            params.append(name)
+        with self.mutex:
+            rows = self.connection.execute('SELECT name, run_dir, test_dir, result, duration, error_ratio FROM tests WHERE ' + condition, params).fetchall()
+        trends = {}
+        for name, run_dir, test_dir, result, duration, error_ratio in rows:
+            trends.setdefault(name, {})[run_dir] = (test_dir, result, duration, error_ratio)
+        return trends
+
+    def image_trends(self, run_dirs, name):
+        '''
+        Return a dictionary mapping the image names of a test to their results in the given runs.
+        Results are dictionaries mapping run directories to tuples (error, tolerance, success).
+        '''
+        params = list(run_dirs)
+        with self.mutex:
+            rows = self.connection.execute(
+                f"SELECT images.run_dir, images.name, images.error, images.tolerance, images.success FROM images "
+                f"JOIN tests ON images.run_dir = tests.run_dir AND images.test_dir = tests.test_dir "
+                f"WHERE tests.run_dir IN ({', '.join('?' * len(params))}) AND tests.name = ?", params + [name]).fetchall()
+        trends = {}
+        for run_dir, image, error, tolerance, success in rows:
+            trends.setdefault(image, {})[run_dir] = (error, tolerance, bool(success))
+        return trends
@@ -0,0 +1,163 @@
+'''
+Module for accessing image test result directories.
+
+Results are stored as <result_dir>/<run_dir>/<test_dir>, where run_dir is made
+up of the tags (e.g. branch and build_config) in the environment's result
+directory template. Finished runs can be packed into a single zip archive in
+the run directory, whose central directory serves as an index for reading
+single files without unpacking the archive.
+'''
+
+import os
+import re
+import shutil
+import threading
+import uuid
+import zipfile
+from pathlib import Path
+
+from . import config
+
+class ResultLayout:
+    '''
+    Layout of the result and reference directories of an environment.
+    '''
+
+    def __init__(self, env):
+        result_dir_template = env.image_tests_result_dir
+        ref_dir_template = env.image_tests_ref_dir
+
+        # Substitute project_dir as it is a static part of the path.
+        result_dir_template = result_dir_template.replace('${project_dir}', str(env.project_dir))
+        ref_dir_template = ref_dir_template.replace('${project_dir}', str(env.project_dir))
+        result_dir_template = result_dir_template.replace('${project_drive}', str(env.project_dir.drive))
+        ref_dir_template = ref_dir_template.replace('${project_drive}', str(env.project_dir.drive))
+
+        # Extract result directory and run pattern.
+        index = result_dir_template.index('$')
+        result_dir = result_dir_template[0:index]
+        run_pattern = result_dir_template[index:].replace('\\', '/')
+
+        # Extract reference directory.
+        index = ref_dir_template.index('$')
+        ref_dir = ref_dir_template[0:index]
+
+        # Extract the tags that make up a run directory.
+        run_tags = run_pattern.split('/')
+        run_tags = list(map(lambda f: re.fullmatch(r'\$\{([a-z_]+)\}', f)[1], run_tags))
+
+        self.result_dir = Path(result_dir)
+        self.ref_dir = Path(ref_dir)
+        self.run_tags = run_tags
+
+    def run_glob(self, name):
+        '''
+        Return a glob pattern matching a file in all run directories.
+        '''
+        return '/'.join(['*'] * len(self.run_tags)) + '/' + name
+
+    def split_path(self, path):
+        '''
+        Split a path relative to the result directory into the run directory and the remaining path.
+        '''
+        parts = Path(path).as_posix().split('/')
+        return '/'.join(parts[0:len(self.run_tags)]), '/'.join(parts[len(self.run_tags):])
+
+    def tags(self, run_dir):
+        '''
+        Return a dictionary mapping run tags to their values for a run directory.
+        '''
+        return { k:v for [k, v] in zip(self.run_tags, run_dir.split('/')) }
+
+    def finished_runs(self):
+        '''
+        Return a list of directories (relative posix paths) of all finished runs.
+        '''
+        return sorted(f.parent.relative_to(self.result_dir).as_posix() for f in self.result_dir.glob(self.run_glob('report.json')))
+
+class RunArchive:
+    '''
+    Read access to a run packed into a zip archive.
+    '''
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.mtime_ns = path.stat().st_mtime_ns
+        self.zip = zipfile.ZipFile(path)
+        self.names = set(self.zip.namelist())
+        self.mutex = threading.Lock()
+
+    def close(self):
+        self.zip.close()
+
+    def contains(self, name):
+        return name in self.names
+
+    def read(self, name):
+        '''
+        Read a file from the archive. Returns None if it does not exist.
+        '''
+        if not name in self.names:
+            return None
+        with self.mutex:
+            return self.zip.read(name)
+
+    def test_reports(self):
+        '''
+        Return the names of all test reports in the archive.
+        '''
+        return sorted(n for n in self.names if n.endswith('/report.json'))
+
+def pack_run(run_dir: Path):
+    '''
+    Pack all files of a run (except the run report and journal) into the run's archive and remove them.
+    Files already in an existing archive are kept unless they have been written again since.
+    Images are stored uncompressed, other files are deflated.
+    Returns the number of packed files and their total size.
+    '''
+    archive_file = run_dir / config.RESULT_ARCHIVE_FILE
+    skip = set([archive_file, run_dir / 'report.json', run_dir / config.JOURNAL_FILE])
+    files = [f for f in sorted(run_dir.glob('**/*')) if f.is_file() and not f in skip and not f.name.startswith('.')]
+    if not files:
+        return 0, 0
+
+    temp_file = run_dir / f'.{config.RESULT_ARCHIVE_FILE}.{uuid.uuid4().hex[:8]}.tmp'
+    size = 0
+    try:
+        with zipfile.ZipFile(temp_file, 'w') as archive:
+            names = set()
+            for f in files:
+                name = f.relative_to(run_dir).as_posix()
+                names.add(name)
+                compress_type = zipfile.ZIP_STORED if f.suffix.lower() in config.IMAGE_EXTENSIONS else zipfile.ZIP_DEFLATED
+                archive.write(f, name, compress_type=compress_type)
+                size += f.stat().st_size
+            if archive_file.exists():
+                with zipfile.ZipFile(archive_file) as previous:
+                    for info in previous.infolist():
+                        if not info.filename in names:
+                            archive.writestr(info, previous.read(info))
+        os.replace(temp_file, archive_file)
+    finally:
+        if temp_file.exists():
+            temp_file.unlink()
+
+    # Remove packed files and the directories left empty.
+    for f in files:
+        f.unlink()
+    for d in sorted((d for d in run_dir.glob('**/*') if d.is_dir()), key=lambda d: len(d.parts), reverse=True):
+        if not any(d.iterdir()):
+            d.rmdir()
+
+    return len(files), size
+
+def remove_run(result_dir: Path, run_dir):
+    '''
+    Remove a run directory and its parent directories if they are left empty.
+    '''
+    path = result_dir / run_dir
+    shutil.rmtree(path)
+    path = path.parent
+    while path != result_dir and result_dir in path.parents and not any(path.iterdir()):
+        path.rmdir()
+        path = path.parent
@@ -0,0 +1,65 @@
+'''
+Module containing a local database of historical image test runtimes.
+'''
+
+import datetime
+import math
+import sqlite3
+from pathlib import Path
+
+from . import config
+
+class RuntimeDatabase:
+    '''
+    SQLite database recording the duration of successful test runs.
+    Used to predict per-test timeouts from historical runtimes.
+    '''
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(path))
+        self.connection.execute('''
+            CREATE TABLE IF NOT EXISTS runtimes (
+                test TEXT NOT NULL,
+                build_config TEXT NOT NULL,
+                date TEXT NOT NULL,
+                duration REAL NOT NULL
+            )''')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS runtimes_test ON runtimes (test, build_config)')
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def record(self, test_name, build_config, duration):
+        '''
+        Record the duration of a successful test run.
+        '''
+        self.connection.execute(
+            'INSERT INTO runtimes (test, build_config, date, duration) VALUES (?, ?, ?, ?)',
+            (test_name, build_config, datetime.datetime.now().isoformat(), duration))
+        self.connection.commit()
+
+    def durations(self, test_name, build_config, limit=config.ADAPTIVE_TIMEOUT_HISTORY):
+        '''
+        Return the most recent durations of a test.
+        '''
+        rows = self.connection.execute(
+            'SELECT duration FROM runtimes WHERE test = ? AND build_config = ? ORDER BY rowid DESC LIMIT ?',
+            (test_name, build_config, limit))
+        return [row[0] for row in rows]
+
+    def predict_timeout(self, test_name, build_config, default_timeout):
+        '''
+        Predict a timeout for a test as the 99th percentile of its recent durations
+        scaled by a safety factor and clamped to a sensible range.
+        Returns default_timeout if there is not enough history.
+        '''
+        durations = sorted(self.durations(test_name, build_config))
+        if len(durations) < config.ADAPTIVE_TIMEOUT_MIN_SAMPLES:
+            return default_timeout
+
+        # Nearest-rank percentile.
+        p99 = durations[max(0, math.ceil(0.99 * len(durations)) - 1)]
+        timeout = p99 * config.ADAPTIVE_TIMEOUT_FACTOR
+        return min(max(timeout, config.ADAPTIVE_TIMEOUT_MIN), config.ADAPTIVE_TIMEOUT_MAX)
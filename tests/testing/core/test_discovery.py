@@ -0,0 +1,65 @@
+'''
+Tests of parsing image test script headers.
+
+Run from the tests/testing directory:
+
+    python -m pytest core
+'''
+
+import re
+import unittest
+from pathlib import Path
+
+from . import config
+from .discovery import parse_header
+
+# Directory containing the image test scripts.
+IMAGE_TESTS_DIR = Path(__file__).parents[3] / config.IMAGE_TESTS_DIR
+
+def parse_header_legacy(source):
+    '''
+    Header parser used before headers were parsed with ast.literal_eval (matching curly braces and using eval).
+    '''
+    m = re.match(r'IMAGE_TEST\s*=\s*({.*})', source, re.DOTALL)
+    if m:
+        depth = 0
+        for i, c in enumerate(m.group(1)):
+            if c == '{':
+                depth += 1
+            if c == '}':
+                depth -= 1
+                if depth == 0:
+                    return eval(m.group(1)[0:i+1])
+    return {}
+
+class TestParseHeader(unittest.TestCase):
+    def test_existing_headers(self):
+        scripts = sorted(IMAGE_TESTS_DIR.glob('**/test_*.py'))
+        self.assertGreater(len(scripts), 0)
+        for script in scripts:
+            with self.subTest(script=script.relative_to(IMAGE_TESTS_DIR).as_posix()):
+                source = script.read_text()
+                self.assertEqual(parse_header(source, script), parse_header_legacy(source))
+
+    def test_header(self):
+        source = "IMAGE_TEST = {\n    'tolerance': 1e-8,\n    'skip': 'Broken',\n    'device_types': ['d3d12', 'vulkan']\n}\n\nimport falcor\n"
+        self.assertEqual(parse_header(source, 'test.py'), {'tolerance': 1e-8, 'skip': 'Broken', 'device_types': ['d3d12', 'vulkan']})
+
+    def test_no_header(self):
+        self.assertEqual(parse_header('import falcor\n', 'test.py'), {})
+        self.assertEqual(parse_header('', 'test.py'), {})
+        # The header has to be the first statement.
+        self.assertEqual(parse_header("# Comment\nIMAGE_TEST = {'tolerance': 1}\n", 'test.py'), {})
+        self.assertEqual(parse_header("IMAGE_TEST_RUN_ONLY = True\n", 'test.py'), {})
+
+    def test_invalid_header(self):
+        # Headers may only contain literals, so they cannot run code.
+        with self.assertRaises(Exception):
+            parse_header("IMAGE_TEST = {'tolerance': __import__('os').getpid()}\n", 'test.py')
+        with self.assertRaises(Exception):
+            parse_header("IMAGE_TEST = ['tolerance']\n", 'test.py')
+        with self.assertRaises(Exception):
+            parse_header("IMAGE_TEST = {'tolerance': 1\n", 'test.py')
+
+if __name__ == '__main__':
+    unittest.main()
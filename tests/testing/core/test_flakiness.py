@@ -0,0 +1,103 @@
+'''
+Tests of the flakiness tracker (tolerance suggestions and quarantine).
+
+Run from the tests/testing directory:
+
+    python -m pytest core
+'''
+
+import statistics
+import tempfile
+import unittest
+from pathlib import Path
+
+from . import config
+from .flakiness import FlakinessTracker
+
+TEST = 'renderpasses/test_Foo'
+BUILD_CONFIG = 'windows-vs2022-Release'
+
+def image_report(name, error, success=True, tolerance=0.1, metric='mse', lower_bound=False):
+    return {'name': name, 'error': error, 'tolerance': tolerance, 'success': success, 'metric': metric, 'error_is_lower_bound': lower_bound}
+
+class TestFlakinessTracker(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.tracker = FlakinessTracker(Path(self.temp_dir.name) / 'flakiness.db')
+
+    def tearDown(self):
+        self.tracker.close()
+        self.temp_dir.cleanup()
+
+    def record_errors(self, errors, **kwargs):
+        for error in errors:
+            self.tracker.record(TEST, BUILD_CONFIG, 'PASSED', 1, [image_report('frame.exr', error, **kwargs)])
+
+    def test_no_suggestion_without_enough_samples(self):
+        self.record_errors([0.01] * (config.FLAKY_MIN_SAMPLES - 1))
+        self.assertEqual(self.tracker.suggest_tolerance(TEST, BUILD_CONFIG, 'mse', 0.1), None)
+        self.record_errors([0.01])
+        self.assertNotEqual(self.tracker.suggest_tolerance(TEST, BUILD_CONFIG, 'mse', 0.1), None)
+
+    def test_suggestion_is_mean_plus_sigma_std(self):
+        errors = [0.01, 0.02, 0.03, 0.02, 0.01, 0.03]
+        self.record_errors(errors)
+        expected = statistics.mean(errors) + config.FLAKY_TOLERANCE_SIGMA * statistics.stdev(errors)
+        self.assertAlmostEqual(self.tracker.suggest_tolerance(TEST, BUILD_CONFIG, 'mse', 1.0), expected)
+
+    def test_suggestion_uses_worst_image(self):
+        for i in range(config.FLAKY_MIN_SAMPLES):
+            self.tracker.record(TEST, BUILD_CONFIG, 'PASSED', 1, [image_report('a.exr', 0.01), image_report('b.exr', 0.05 + 0.01 * (i % 2))])
+        b_errors = [0.05 + 0.01 * (i % 2) for i in range(config.FLAKY_MIN_SAMPLES)]
+        expected = statistics.mean(b_errors) + config.FLAKY_TOLERANCE_SIGMA * statistics.stdev(b_errors)
+        self.assertAlmostEqual(self.tracker.suggest_tolerance(TEST, BUILD_CONFIG, 'mse', 1.0), expected)
+
+    def test_suggestion_is_capped(self):
+        self.record_errors([0.5, 0.9, 0.7, 0.6, 0.8])
+        tolerance = 0.1
+        self.assertAlmostEqual(self.tracker.suggest_tolerance(TEST, BUILD_CONFIG, 'mse', tolerance), config.FLAKY_MAX_TOLERANCE_FACTOR * tolerance)
+
+    def test_failed_comparisons_are_ignored(self):
+        self.record_errors([0.01] * config.FLAKY_MIN_SAMPLES)
+        # A regression must not raise the suggested tolerance.
+        self.record_errors([10.0] * config.FLAKY_MIN_SAMPLES, success=False)
+        self.assertAlmostEqual(self.tracker.suggest_tolerance(TEST, BUILD_CONFIG, 'mse', 0.1), 0.01)
+
+    def test_lower_bounds_are_not_recorded(self):
+        self.record_errors([0.01] * config.FLAKY_MIN_SAMPLES, lower_bound=True)
+        self.assertEqual(self.tracker.errors(TEST, BUILD_CONFIG, 'mse'), {})
+        self.assertEqual(self.tracker.suggest_tolerance(TEST, BUILD_CONFIG, 'mse', 0.1), None)
+
+    def test_errors_are_per_metric_and_build_config(self):
+        self.record_errors([0.01] * config.FLAKY_MIN_SAMPLES, metric='mse')
+        self.assertEqual(self.tracker.suggest_tolerance(TEST, BUILD_CONFIG, 'rmse', 0.1), None)
+        self.assertEqual(self.tracker.suggest_tolerance(TEST, 'linux-gcc-Release', 'mse', 0.1), None)
+
+    def test_error_history_is_limited(self):
+        self.record_errors([1.0] * config.FLAKY_ERROR_HISTORY + [0.01] * config.FLAKY_ERROR_HISTORY)
+        errors = self.tracker.errors(TEST, BUILD_CONFIG, 'mse')['frame.exr']
+        self.assertEqual(errors, [0.01] * config.FLAKY_ERROR_HISTORY)
+
+    def test_quarantine(self):
+        def record_run(result, attempts):
+            self.tracker.record(TEST, BUILD_CONFIG, result, attempts, [])
+
+        # Runs that passed after a rerun are flaky, failed runs are not.
+        for i in range(config.FLAKY_QUARANTINE_COUNT - 1):
+            record_run('PASSED', 2)
+        record_run('FAILED', 3)
+        record_run('PASSED', 1)
+        self.assertEqual(self.tracker.flake_stats(TEST, BUILD_CONFIG), (config.FLAKY_QUARANTINE_COUNT - 1, config.FLAKY_QUARANTINE_COUNT + 1))
+        self.assertFalse(self.tracker.is_quarantined(TEST, BUILD_CONFIG))
+
+        record_run('PASSED', 2)
+        self.assertTrue(self.tracker.is_quarantined(TEST, BUILD_CONFIG))
+        self.assertFalse(self.tracker.is_quarantined(TEST, 'linux-gcc-Release'))
+
+        # Flaky runs older than the run history are forgotten.
+        for i in range(config.FLAKY_RUN_HISTORY):
+            record_run('PASSED', 1)
+        self.assertFalse(self.tracker.is_quarantined(TEST, BUILD_CONFIG))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+'''
+Tests of the duration regression thresholds of test trends.
+
+Run from the tests/testing directory:
+
+    python -m pytest core
+'''
+
+import unittest
+
+from . import config
+from .trends import duration_thresholds, build_trend
+
+class TestDurationThresholds(unittest.TestCase):
+    def test_no_threshold_without_history(self):
+        thresholds = duration_thresholds([10.0] * (config.TREND_MIN_HISTORY + 1))
+        self.assertEqual(thresholds[:config.TREND_MIN_HISTORY], [None] * config.TREND_MIN_HISTORY)
+        self.assertNotEqual(thresholds[config.TREND_MIN_HISTORY], None)
+
+    def test_relative_increase_without_noise(self):
+        # Without noise (MAD of 0) the threshold is the larger of the minimum relative and absolute increase.
+        thresholds = duration_thresholds([100.0] * config.TREND_MIN_HISTORY + [0.0])
+        self.assertAlmostEqual(thresholds[-1], 100.0 * (1 + config.TREND_MIN_RELATIVE_INCREASE))
+        thresholds = duration_thresholds([1.0] * config.TREND_MIN_HISTORY + [0.0])
+        self.assertAlmostEqual(thresholds[-1], 1.0 + config.TREND_MIN_DURATION_INCREASE)
+
+    def test_mad_noise_band(self):
+        history = [100.0, 90.0, 110.0, 70.0, 130.0]
+        median = 100.0
+        mad = 10.0
+        thresholds = duration_thresholds(history + [0.0])
+        self.assertAlmostEqual(thresholds[-1], median + config.TREND_NOISE_FACTOR * 1.4826 * mad)
+
+    def test_outliers_do_not_widen_noise_band(self):
+        # A single slow run shifts neither the median nor the MAD much (unlike mean and standard deviation).
+        thresholds = duration_thresholds([100.0, 100.0, 1000.0, 100.0, 100.0, 0.0])
+        self.assertAlmostEqual(thresholds[-1], 100.0 * (1 + config.TREND_MIN_RELATIVE_INCREASE))
+
+    def test_missing_durations_are_skipped(self):
+        durations = [10.0, None, 10.0, None, 10.0, 0.0]
+        thresholds = duration_thresholds(durations)
+        self.assertEqual(len(thresholds), len(durations))
+        self.assertEqual(thresholds[:5], [None] * 5)
+        self.assertAlmostEqual(thresholds[5], 12.0)
+
+    def test_window(self):
+        thresholds = duration_thresholds([1000.0] * 10 + [100.0] * 3 + [0.0], window=3)
+        self.assertAlmostEqual(thresholds[-1], 100.0 * (1 + config.TREND_MIN_RELATIVE_INCREASE))
+
+class TestBuildTrend(unittest.TestCase):
+    def test_regression(self):
+        durations = [100.0] * config.TREND_MIN_HISTORY + [110.0, 150.0]
+        runs = [{'run_dir': f'run{i}', 'date': f'2026-01-0{i + 1}'} for i in range(len(durations))]
+        results = {run['run_dir']: ('test_Foo', 'PASSED', duration, 0.5) for run, duration in zip(runs, durations)}
+        trend = build_trend('test_Foo', runs, results)
+        self.assertEqual([p['regression'] for p in trend['points']], [False] * (config.TREND_MIN_HISTORY + 1) + [True])
+        self.assertTrue(trend['regression'])
+        self.assertEqual(trend['regression_count'], 1)
+
+    def test_skipped_runs_have_no_duration(self):
+        runs = [{'run_dir': f'run{i}', 'date': f'2026-01-0{i + 1}'} for i in range(2)]
+        results = {'run0': ('test_Foo', 'PASSED', 100.0, 0.5), 'run1': ('test_Foo', 'SKIPPED', 0.0, None)}
+        trend = build_trend('test_Foo', runs, results)
+        self.assertEqual(trend['latest']['duration'], None)
+        self.assertFalse(trend['regression'])
+
+if __name__ == '__main__':
+    unittest.main()
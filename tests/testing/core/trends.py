@@ -0,0 +1,75 @@
+'''
+Module computing trends of image tests across runs.
+
+Trends are built from the per-run rollups of the result index (test duration
+and the largest ratio of image error to tolerance, see core/result_index.py)
+of the most recent runs. A test duration is flagged as a performance
+regression if it exceeds the noise band of the durations of the preceding
+runs, defined by their median and median absolute deviation (MAD):
+
+    threshold = median + max(TREND_NOISE_FACTOR * 1.4826 * MAD,
+                             TREND_MIN_RELATIVE_INCREASE * median,
+                             TREND_MIN_DURATION_INCREASE)
+'''
+
+import statistics
+
+from . import config
+
+def duration_thresholds(durations, window=config.TREND_WINDOW):
+    '''
+    Return the regression threshold of each duration (None if there are not enough preceding durations).
+    Durations of None (test not run) are skipped.
+    '''
+    thresholds = []
+    history = []
+    for duration in durations:
+        if len(history) >= min(window, config.TREND_MIN_HISTORY):
+            median = statistics.median(history)
+            mad = statistics.median(abs(d - median) for d in history)
+            thresholds.append(median + max(
+                config.TREND_NOISE_FACTOR * 1.4826 * mad,
+                config.TREND_MIN_RELATIVE_INCREASE * median,
+                config.TREND_MIN_DURATION_INCREASE))
+        else:
+            thresholds.append(None)
+        if duration != None:
+            history = (history + [duration])[-window:]
+    return thresholds
+
+def build_trend(name, runs, results):
+    '''
+    Build the trend of a test given the runs (sorted by date, oldest first) and
+    a dictionary mapping run directories to tuples (test directory, result, duration, error ratio).
+    '''
+    runs = [run for run in runs if run['run_dir'] in results]
+    # Skipped tests do not have a meaningful duration.
+    durations = [None if results[run['run_dir']][1] == 'SKIPPED' else results[run['run_dir']][2] for run in runs]
+    points = []
+    for run, duration, threshold in zip(runs, durations, duration_thresholds(durations)):
+        test_dir, result, _, error_ratio = results[run['run_dir']]
+        points.append({
+            'run_dir': run['run_dir'],
+            'test_dir': test_dir,
+            'date': run['date'],
+            'result': result,
+            'duration': duration,
+            'error_ratio': error_ratio,
+            'threshold': threshold,
+            'regression': threshold != None and duration != None and duration > threshold
+        })
+    latest = points[-1] if points else None
+    return {
+        'name': name,
+        'points': points,
+        'latest': latest,
+        'regression': latest != None and latest['regression'],
+        'regression_count': sum(p['regression'] for p in points)
+    }
+
+def build_trends(runs, test_results):
+    '''
+    Build the trends of all tests (sorted by name) given the runs (sorted by date, oldest first) and
+    a dictionary mapping test names to their results (see build_trend).
+    '''
+    return [build_trend(name, runs, results) for name, results in sorted(test_results.items())]
@@ -0,0 +1,79 @@
+'''
+Module containing a watchdog reporting stalled image tests.
+'''
+
+import threading
+import time
+
+class Watchdog:
+    '''
+    Monitors the log files of running tests and reports tests whose log has
+    not grown for longer than stall_timeout seconds. Progress is judged from
+    log output rather than total elapsed time, so slow but healthy tests are
+    not reported.
+    '''
+
+    class Entry:
+        def __init__(self, log_file):
+            self.log_file = log_file
+            self.size = -1
+            self.last_progress = time.time()
+            self.report_count = 0
+            self.stalls = []
+
+    def __init__(self, stall_timeout, report=print, interval=5):
+        self.stall_timeout = stall_timeout
+        self.report = report
+        self.interval = interval
+        self.entries = {}
+        self.mutex = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, name='watchdog', daemon=True)
+        self.thread.start()
+
+    def watch(self, name, log_file):
+        '''
+        Start monitoring the log file of a test.
+        '''
+        with self.mutex:
+            self.entries[name] = Watchdog.Entry(log_file)
+
+    def unwatch(self, name):
+        '''
+        Stop monitoring a test. Returns a list of messages describing detected stalls.
+        '''
+        with self.mutex:
+            entry = self.entries.pop(name, None)
+        return entry.stalls if entry else []
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def check(self):
+        '''
+        Check all monitored log files for progress.
+        '''
+        now = time.time()
+        with self.mutex:
+            for name, entry in self.entries.items():
+                try:
+                    size = entry.log_file.stat().st_size
+                except OSError:
+                    size = 0
+                if size != entry.size:
+                    entry.size = size
+                    entry.last_progress = now
+                    entry.report_count = 0
+                    continue
+                stalled_time = now - entry.last_progress
+                # Report once per stall period.
+                if stalled_time >= self.stall_timeout * (entry.report_count + 1):
+                    message = f'No progress in log file for {stalled_time:.0f} s (log size {size} bytes)'
+                    entry.report_count += 1
+                    entry.stalls.append(message)
+                    self.report(f'  {name:<60} : STALLED ({message})')
+
+    def _run(self):
+        while not self.stop_event.wait(self.interval):
+            self.check()
@@ -0,0 +1,290 @@
+'''
+Module containing a pool of persistent image test workers.
+
+A worker is a long-lived process (usually a headless Mogwai instance) that
+connects back to the runner over a local TCP socket and executes test scripts
+on request. Messages are JSON objects, one per line:
+
+    worker -> runner: {"type": "hello", "token": <token>, "pid": <pid>}
+    runner -> worker: {"type": "run", ...request...}
+    worker -> runner: {"type": "result", "success": <bool>, "messages": [...]}
+    runner -> worker: {"type": "exit"}
+
+Workers are recycled after a configurable number of tests or whenever a test
+fails, times out or the connection is lost.
+'''
+
+import json
+import os
+import secrets
+import socket
+import threading
+import time
+
+# Host used for the listening socket (workers are always local).
+WORKER_HOST = '127.0.0.1'
+
+# Time in seconds to wait for a freshly launched worker to connect.
+WORKER_CONNECT_TIMEOUT = 120
+
+class WorkerError(Exception):
+    '''
+    Raised when communication with a worker fails.
+    '''
+    pass
+
+def send_message(stream, message):
+    '''
+    Write a single message to a socket file stream.
+    '''
+    stream.write((json.dumps(message) + '\n').encode('utf-8'))
+    stream.flush()
+
+def receive_message(stream):
+    '''
+    Read a single message from a socket file stream.
+    Raises WorkerError if the connection was closed.
+    '''
+    line = stream.readline()
+    if not line:
+        raise WorkerError('Connection to worker closed')
+    return json.loads(line.decode('utf-8'))
+
+def serve(address, token, run_test):
+    '''
+    Worker side of the protocol.
+    Connects to the runner at address and calls run_test(request) for every
+    received request until the runner asks the worker to exit.
+    run_test returns a tuple containing a success flag and a list of messages.
+    '''
+    with socket.create_connection(address) as sock:
+        stream = sock.makefile('rwb')
+        send_message(stream, {'type': 'hello', 'token': token, 'pid': os.getpid()})
+        while True:
+            try:
+                request = receive_message(stream)
+            except WorkerError:
+                return
+            if request['type'] == 'exit':
+                return
+            try:
+                success, messages = run_test(request)
+            except Exception as e:
+                success, messages = False, [f'Worker failed to run test ({e})']
+            send_message(stream, {'type': 'result', 'success': success, 'messages': messages})
+
+class Worker:
+    '''
+    Runner side handle of a single worker process.
+    '''
+
+    def __init__(self, name, key, process, sock, stream):
+        self.name = name
+        self.key = key
+        self.process = process
+        self.sock = sock
+        self.stream = stream
+        self.test_count = 0
+
+    def run(self, request, timeout):
+        '''
+        Send a request to the worker and wait for the result.
+        Raises WorkerError on timeout or when the connection is lost.
+        '''
+        self.test_count += 1
+        self.sock.settimeout(timeout)
+        try:
+            send_message(self.stream, dict(request, type='run'))
+            reply = receive_message(self.stream)
+        except socket.timeout:
+            raise WorkerError('Process killed due to timeout')
+        except (OSError, ValueError) as e:
+            raise WorkerError(f'Lost connection to worker ({e})')
+        if reply.get('type') != 'result':
+            raise WorkerError(f'Unexpected reply from worker: {reply}')
+        return reply['success'], reply['messages']
+
+    def shutdown(self, timeout=10):
+        '''
+        Ask the worker to exit and kill it if it does not comply.
+        '''
+        try:
+            self.sock.settimeout(timeout)
+            send_message(self.stream, {'type': 'exit'})
+            self.process.wait(timeout)
+        except Exception:
+            self.kill()
+        self.close()
+
+    def kill(self):
+        '''
+        Kill the worker process.
+        '''
+        try:
+            self.process.kill()
+            self.process.wait()
+        except Exception:
+            pass
+        self.close()
+
+    def close(self):
+        try:
+            self.stream.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+class WorkerPool:
+    '''
+    Pool of persistent workers.
+
+    Workers are launched lazily by calling launch_worker(key, address, token),
+    which has to start a process that connects back to address and identifies
+    itself with token (see serve()). Workers are keyed (e.g. by device type) and
+    a request is only ever executed by a worker with a matching key.
+    '''
+
+    def __init__(self, worker_count, launch_worker, max_tests_per_worker, process_controller=None):
+        self.worker_count = worker_count
+        self.launch_worker = launch_worker
+        self.max_tests_per_worker = max_tests_per_worker
+        self.process_controller = process_controller
+
+        self.listener = socket.create_server((WORKER_HOST, 0))
+        self.listener.listen(worker_count)
+        self.address = self.listener.getsockname()
+        self.listener_mutex = threading.Lock()
+        self.pending_connections = {}
+
+        # Idle workers and number of slots not occupied by a worker.
+        self.condition = threading.Condition()
+        self.idle_workers = []
+        self.free_slots = worker_count
+        self.next_worker_id = 0
+        self.is_closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def run_test(self, key, request, timeout):
+        '''
+        Run a single request on a worker with the given key.
+        Returns a tuple containing a success flag and a list of messages.
+        '''
+        try:
+            worker = self._acquire(key)
+        except WorkerError as e:
+            return False, [str(e)]
+
+        try:
+            success, messages = worker.run(request, timeout)
+        except WorkerError as e:
+            worker.kill()
+            self._release(None)
+            return False, [str(e)]
+
+        # Recycle worker after failures or once it has executed enough tests.
+        if not success or worker.test_count >= self.max_tests_per_worker:
+            worker.shutdown()
+            worker = None
+        self._release(worker)
+        return success, messages
+
+    def close(self):
+        '''
+        Shut down all workers.
+        '''
+        with self.condition:
+            self.is_closed = True
+            workers, self.idle_workers = self.idle_workers, []
+            self.condition.notify_all()
+        for worker in workers:
+            worker.shutdown()
+        self.listener.close()
+
+    def _acquire(self, key):
+        stale = None
+        with self.condition:
+            while True:
+                if self.is_closed:
+                    raise WorkerError('Worker pool is closed')
+                # Prefer an idle worker with matching key.
+                for worker in self.idle_workers:
+                    if worker.key == key:
+                        self.idle_workers.remove(worker)
+                        return worker
+                if self.free_slots > 0:
+                    self.free_slots -= 1
+                    break
+                # Retire an idle worker with a different key to make room.
+                if self.idle_workers:
+                    stale = self.idle_workers.pop(0)
+                    break
+                self.condition.wait()
+
+            worker_id = self.next_worker_id
+            self.next_worker_id += 1
+
+        if stale:
+            stale.shutdown()
+
+        try:
+            return self._launch(f'worker{worker_id}', key)
+        except WorkerError:
+            self._release(None)
+            raise
+
+    def _release(self, worker):
+        with self.condition:
+            if worker and not self.is_closed:
+                self.idle_workers.append(worker)
+            else:
+                self.free_slots += 1
+            self.condition.notify()
+        if worker and self.is_closed:
+            worker.shutdown()
+
+    def _launch(self, name, key):
+        '''
+        Launch a new worker process and wait for it to connect.
+        '''
+        token = secrets.token_hex(16)
+        process = self.launch_worker(key, self.address, token)
+        if self.process_controller and not self.process_controller.add_process(name, process):
+            raise WorkerError('Process killed due to global exit')
+
+        # Accept connections until the worker with our token shows up. Connections of
+        # other workers launching concurrently are parked in pending_connections.
+        deadline = time.time() + WORKER_CONNECT_TIMEOUT
+        while True:
+            with self.listener_mutex:
+                if token in self.pending_connections:
+                    sock, stream = self.pending_connections.pop(token)
+                    break
+                if time.time() > deadline or process.poll() != None:
+                    process.kill()
+                    raise WorkerError('Worker did not connect in time')
+                self.listener.settimeout(1)
+                try:
+                    sock, _ = self.listener.accept()
+                except socket.timeout:
+                    continue
+                except OSError as e:
+                    process.kill()
+                    raise WorkerError(f'Failed to accept worker connection ({e})')
+                sock.settimeout(WORKER_CONNECT_TIMEOUT)
+                stream = sock.makefile('rwb')
+                try:
+                    hello = receive_message(stream)
+                except (OSError, ValueError, WorkerError):
+                    sock.close()
+                    continue
+                if hello.get('type') == 'hello':
+                    self.pending_connections[hello.get('token')] = (sock, stream)
+                else:
+                    sock.close()
+
+        return Worker(name, key, process, sock, stream)
@@ -15,87 +15,25 @@ import shutil
 from pathlib import Path
 from enum import Enum
 
-import concurrent.futures
+import asyncio
 import multiprocessing
-import signal
-import threading
 from xml.etree import ElementTree as ET
 
 from core import Environment, helpers, config
 from core.environment import find_most_recent_build_config
+from core.worker_pool import WorkerPool
+from core.discovery import TestIndex
+from core.impact import DependencyMap, get_changed_files
+from core.ref_store import RefStore, LocalManifest
+from core.journal import RunJournal, read_journal, summarize_journal
+from core.runtime_db import RuntimeDatabase
+from core.watchdog import Watchdog
+from core.flakiness import FlakinessTracker
+from core.profiler import load_profile
+from core.orchestrator import Orchestrator, EventLog
+from core.live import LiveServer, LIVE_LOCAL_HOST
 from core.termcolor import colored
 
-print_mutex = multiprocessing.Lock()
-
-class ProcessController:
-    is_exiting = threading.Event()
-    all_processes_mutex = multiprocessing.Lock()
-    all_processes = {}
-    thread_count = 1
-
-    def __init__(self, thread_count):
-
-        self.thread_count = thread_count
-
-        def signal_handler(signum, frame):
-            with self.all_processes_mutex:
-                self.is_exiting.set()
-                for p in self.all_processes:
-                    p.kill()
-
-        signal.signal(signal.SIGTERM, signal_handler)
-
-
-    def is_interrupted(self):
-        with self.all_processes_mutex:
-            return self.is_exiting.is_set()
-
-    def interrupt_and_exit(self):
-        print("Received interrupt (e.g. Ctrl-C), shutting down tests and exiting")
-        with self.all_processes_mutex:
-            self.is_exiting.set()
-            for name, p in self.all_processes.items():
-                p.kill()
-
-    def add_process(self, name, p):
-        with self.all_processes_mutex:
-            if self.is_exiting.is_set():
-                p.kill()
-                return False
-            self.all_processes[name] = p
-            return True
-
-def read_header(script_file):
-    '''
-    Check if script has a IMAGE_TEST dictionary defined at the top and return it's content.
-    '''
-    with open(script_file) as f:
-        script = f.read()
-        # Find IMAGE_TEST={} at the top of the script
-        m = re.match(r'IMAGE_TEST\s*=\s*({.*})', script, re.DOTALL)
-        if m:
-            header = None
-            # Match curly braces
-            depth = 0
-            for i, c in enumerate(m.group(1)):
-                if c == '{':
-                    depth += 1
-                if c == '}':
-                    depth -= 1
-                    if depth == 0:
-                        header = m.group(1)[0:i+1]
-                        break
-            if depth != 0:
-                raise Exception(f'Failed to parse script header in {script_file} (curly braces do not match)')
-            # Evaluate dictionary
-            if header:
-                try:
-                    return eval(header)
-                except Exception as e:
-                    raise Exception(f'Failed to parse script header in {script_file} ({e})')
-
-    return {}
-
 class Test:
     '''
     Represents a single image test.
@@ -118,7 +56,10 @@ class Test:
         Result.SKIPPED: 'SKIPPED'
     }
 
-    process_controller = None
+    orchestrator = None
+    worker_pool = None
+    watchdog = None
+    full_compare = False
 
     def __init__(self, script_file, root_dir: Path, device_type, header):
         self.script_file = script_file
@@ -144,6 +85,12 @@ class Test:
         # Get timeout.
         self.timeout = self.header.get('timeout', config.DEFAULT_TIMEOUT)
 
+        # Get image comparison metric.
+        self.metric = self.header.get('metric', config.DEFAULT_METRIC)
+
+        # Phase timings and resource usage of the last run.
+        self.profile = {'phases': {}, 'resources': {}}
+
     def __repr__(self):
         return f'Test(name={self.name},script_file={self.script_file})'
 
@@ -167,7 +114,7 @@ class Test:
         files = filter(lambda f: f.suffix.lower() in config.IMAGE_EXTENSIONS, files)
         return list(files)
 
-    def generate_images(self, output_dir: Path, mogwai_exe: Path, run_only: bool, temp_dir: Path):
+    async def generate_images(self, output_dir: Path, mogwai_exe: Path, run_only: bool, temp_dir: Path):
         '''
         Run Mogwai to generate a set of images and store them in output_dir.
         Returns a tuple containing the result code and a list of messages.
@@ -196,14 +143,22 @@ class Test:
         short_name = self.name.split('/')[-1]
 
         # Write helper script to run test.
+        # The renderer is wrapped in a proxy measuring the time spent in the different test phases.
         generate_file = temp_dir / f'{short_name}_{hashlib.sha1(hash_str.encode()).hexdigest()[:8]}.py'
+        profile_file = output_dir / config.PROFILE_FILE
         with open(generate_file, 'w') as f:
+            f.write("import sys\n")
+            f.write(f'sys.path.insert(0, r"{Path(__file__).parent.resolve()}")\n')
+            f.write("from core import profiler\n")
+            f.write("sys.path.pop(0)\n")
+            f.write("m = profiler.RendererProxy(m)\n")
             # Hack to pass run only flag to helpers.py
             if run_only:
                 f.write("import falcor\n")
                 f.write(f'falcor.__dict__["IMAGE_TEST_RUN_ONLY"]=True\n')
             f.write(f'm.frameCapture.outputDir = r"{output_dir}"\n')
             f.write(f'm.script(r"{relative_to_cwd(self.script_file)}")\n')
+            f.write(f'm.write_profile(r"{profile_file}")\n')
 
         # Run Mogwai to generate images.
         args = [
@@ -217,20 +172,17 @@ class Test:
         rerun_env = {}
         rerun_env["cwd"] = str(cwd)
         rerun_env["args"] = args[1:]
-        p = subprocess.Popen(args, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if not self.process_controller.add_process(self.name + ":run", p):
-            return Test.Result.FAILED, ['Process killed due to global exit'], rerun_env
+
+        # Run Mogwai while the watchdog monitors the log file for progress.
+        if self.watchdog:
+            self.watchdog.watch(self.name, output_dir / 'log.txt')
         try:
-            outs, errs = p.communicate(timeout=self.timeout)
-        except subprocess.TimeoutExpired:
-            p.kill()
-            return Test.Result.FAILED, ['Process killed due to timeout'], rerun_env
+            success, errors = await self.run_mogwai(args, cwd, output_dir, run_only)
+        finally:
+            stalls = self.watchdog.unwatch(self.name) if self.watchdog else []
 
-        # Check for success.
-        if p.returncode != 0:
-            # Generate list of errors from stderr.
-            errors = list(map(lambda l: l.rstrip(), errs.decode('utf-8').splitlines()))
-            return Test.Result.FAILED, errors + [f'{mogwai_exe} exited with return code {p.returncode}'], rerun_env
+        if not success:
+            return Test.Result.FAILED, errors + stalls, rerun_env
 
         # Bail out if no images have been generated.
         if not run_only and len(self.collect_images(output_dir)) == 0:
@@ -238,15 +190,91 @@ class Test:
 
         return Test.Result.PASSED, [], rerun_env
 
-    def compare_images(self, ref_dir: Path, result_dir: Path, image_compare_exe: Path):
+    async def run_mogwai(self, args, cwd: Path, output_dir: Path, run_only: bool):
+        '''
+        Run the test script in Mogwai, either in a new process using the given
+        arguments or on a persistent worker if a worker pool is set.
+        Requests to persistent workers block, so they are sent from the orchestrator's threads.
+        Returns a tuple containing a success flag and a list of error messages.
+        '''
+        profile_file = output_dir / config.PROFILE_FILE
+        if profile_file.exists():
+            profile_file.unlink()
+
+        if self.worker_pool:
+            # Run test script on a persistent Mogwai worker.
+            request = self.worker_request(output_dir, profile_file, run_only)
+            launch_time = time.time()
+            success, errors = await self.orchestrator.run_in_thread(self.worker_pool.run_test, self.device_type, request, self.timeout)
+            self.profile.update(self.read_profile(profile_file, launch_time, launch_time, False))
+            return success, errors
+
+        p = await self.orchestrator.run_process(self.name + ":run", args, cwd, self.timeout)
+        if p.killed:
+            return False, ['Process killed due to global exit']
+        self.profile.update(self.read_profile(profile_file, p.launch_time, p.spawned_time, True))
+        if p.timed_out:
+            return False, [f'Process killed due to timeout ({self.timeout:.0f} s)']
+
+        # Check for success.
+        if p.returncode != 0:
+            # Generate list of errors from stderr.
+            errors = list(map(lambda l: l.rstrip(), p.stderr))
+            return False, errors + [f'{args[0]} exited with return code {p.returncode}']
+
+        return True, []
+
+    def worker_request(self, output_dir: Path, profile_file: Path, run_only: bool):
+        '''
+        Create a request running the test script on a persistent Mogwai worker.
+        '''
+        return {
+            'script_file': str(self.script_file),
+            'output_dir': str(output_dir),
+            'log_file': str(output_dir / 'log.txt'),
+            'profile_file': str(profile_file),
+            'run_only': run_only
+        }
+
+    def read_profile(self, profile_file: Path, launch_time, spawned_time, fresh_process):
+        '''
+        Read and remove the profile written by the test script (see core/profiler.py).
+        '''
+        profile = load_profile(profile_file, launch_time, spawned_time, time.time(), fresh_process)
+        if profile_file.exists():
+            profile_file.unlink()
+        return profile
+
+    async def compare_images(self, ref_dir: Path, result_dir: Path, image_compare_exe: Path):
         '''
         Run ImageCompare on a set of images in ref_dir and result_dir.
         Checks if error between reference and result image is within a given tolerance.
         Returns a tuple containing the result code, a list of messages and a list of image reports.
         '''
+        result, messages, pairs, missing = self.prepare_compare(ref_dir, result_dir)
+        if pairs == None:
+            return result, messages, []
+
+        processes = await asyncio.gather(*[self.orchestrator.run_process(self.name + ":image:" + str(image), self.compare_args(image_compare_exe, *pair), merge_stderr=True) for image, pair in pairs.items()])
+        if any(p.killed for p in processes):
+            return Test.Result.FAILED, ['Process killed due to global exit'], []
+
+        outputs = {}
+        for image, p in zip(pairs.keys(), processes):
+            outputs[image] = (p.returncode, '\n'.join(p.stdout))
+
+        return self.check_compared(result, messages, outputs, missing)
+
+    def prepare_compare(self, ref_dir: Path, result_dir: Path):
+        '''
+        Determine the images to compare against reference images.
+        Returns a tuple containing the result code, a list of messages, a dictionary mapping images
+        to tuples of reference, result and error image files (None if no comparison is needed)
+        and a list of reference images without a result image.
+        '''
         # Bail out if test is skipped.
         if self.skipped:
-            return Test.Result.SKIPPED, [self.skip_message] if self.skip_message != '' else [], []
+            return Test.Result.SKIPPED, [self.skip_message] if self.skip_message != '' else [], None, []
 
         # Determine full directory paths for references and results.
         ref_dir = ref_dir / self.test_dir
@@ -254,9 +282,9 @@ class Test:
 
         # Make sure directories exist.
         if not ref_dir.exists():
-            return Test.Result.FAILED, [f'Reference directory "{ref_dir}" does not exist.'], []
+            return Test.Result.FAILED, [f'Reference directory "{ref_dir}" does not exist.'], None, []
         elif not result_dir.exists():
-            return Test.Result.FAILED, [f'Result directory "{result_dir}" does not exist.'], []
+            return Test.Result.FAILED, [f'Result directory "{result_dir}" does not exist.'], None, []
 
         # Collect all reference and result images.
         ref_images = self.collect_images(ref_dir)
@@ -264,89 +292,128 @@ class Test:
 
         # Bail out if no images have been generated.
         if len(result_images) == 0:
-            return Test.Result.FAILED, ['Test did not generate any images.'], []
+            return Test.Result.FAILED, ['Test did not generate any images.'], None, []
 
         result = Test.Result.PASSED
         messages = []
-        image_reports = []
 
         # Compare every result image with the corresponding reference image and report missing references.
-        processes = {}
+        pairs = {}
         for image in result_images:
             if not image in ref_images:
                 result = Test.Result.FAILED
                 messages.append(f'Test has generated image "{image}" with no corresponding reference image.')
                 continue
 
-            ref_file = ref_dir / image
-            result_file = result_dir / image
-            error_file = result_dir / (str(image) + config.ERROR_IMAGE_SUFFIX)
+            pairs[image] = (ref_dir / image, result_dir / image, result_dir / (str(image) + config.ERROR_IMAGE_SUFFIX))
 
-            args = [str(image_compare_exe), '-m', 'mse', '-t', str(self.tolerance), str(ref_file), str(result_file)]
-            if error_file:
-                args += ['-e', str(error_file)]
-            processes[image] = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-            if not self.process_controller.add_process(self.name + ":image:" + str(image), processes[image]):
-                return Test.Result.FAILED, ['Process killed due to global exit']
+            # Remove the error image of a previous comparison (error images are only written for full comparisons).
+            pairs[image][2].unlink(missing_ok=True)
 
-        for image, process in processes.items():
+        missing = [image for image in ref_images if not image in result_images]
 
-            output = process.communicate()[0]
-            compare_success =  process.returncode == 0
-            compare_error = float(output.strip())
+        return result, messages, pairs, missing
+
+    def compare_args(self, image_compare_exe: Path, ref_file: Path, result_file: Path, error_file: Path):
+        '''
+        Return the ImageCompare arguments for comparing a result image against a reference image.
+        '''
+        # Unless a full comparison is requested, stop comparing as soon as the error is known to exceed
+        # the tolerance (errors of failed comparisons are then only lower bounds). ImageCompare needs the
+        # error of every pixel for writing an error image, so error images are only written for full
+        # comparisons (the viewer computes loss maps of failed images on demand).
+        args = [str(image_compare_exe), '-m', self.metric, '-t', str(self.tolerance), str(ref_file), str(result_file)]
+        if self.full_compare:
+            args += ['-e', str(error_file)]
+        else:
+            args += ['-x']
+        return args
+
+    def check_compared(self, result, messages, outputs, missing):
+        '''
+        Check the ImageCompare outputs (tuples of return code and output by image) against the tolerance.
+        Returns a tuple containing the result code, a list of messages and a list of image reports.
+        '''
+        image_reports = []
+        for image, (returncode, output) in outputs.items():
+            compare_success = returncode == 0
+            # Errors of comparisons stopped early are reported as "<error> (lower bound)".
+            value, lower_bound = output.strip(), False
+            if value.endswith(config.LOWER_BOUND_SUFFIX):
+                value, lower_bound = value[:-len(config.LOWER_BOUND_SUFFIX)], True
+            try:
+                compare_error = float(value)
+            except ValueError:
+                compare_success = False
+                compare_error = None
+                messages.append(f'Failed to compare test image "{image}": {output.strip()}')
 
             if not compare_success:
                 result = Test.Result.FAILED
-                messages.append(f'Test image "{image}" failed with error {compare_error}.')
+                if compare_error != None and lower_bound:
+                    messages.append(f'Test image "{image}" failed with error of at least {compare_error} (comparison stopped early).')
+                elif compare_error != None:
+                    messages.append(f'Test image "{image}" failed with error {compare_error}.')
 
             image_reports.append({
                 'name': str(image),
                 'success': compare_success,
                 'error': compare_error,
-                'tolerance': self.tolerance
+                'error_is_lower_bound': compare_error != None and lower_bound,
+                'tolerance': self.tolerance,
+                'metric': self.metric
             })
 
         # Report missing result images for existing reference images.
-        for image in ref_images:
-            if not image in result_images:
-                result = Test.Result.FAILED
-                messages.append(f'Test has not generated an image for the corresponding reference image "{image}".')
+        for image in missing:
+            result = Test.Result.FAILED
+            messages.append(f'Test has not generated an image for the corresponding reference image "{image}".')
 
         return result, messages, image_reports
 
-    def run(self, run_only: bool, compare_only: bool, ref_dir: Path, result_dir: Path, mogwai_exe: Path, image_compare_exe: Path, temp_dir: Path):
+    async def run(self, run_only: bool, compare_only: bool, ref_dir: Path, result_dir: Path, mogwai_exe: Path, image_compare_exe: Path, temp_dir: Path):
         '''
         Run the image test.
         First, result images are generated (unless compare_only is True).
         Second, result images are compared against reference images.
         Third, writes a JSON report to the result_dir containing details on the test run.
-        Returns a tuple containing the result code and a list of messages.
+        Returns a tuple containing the result code, a list of messages and a list of image reports.
         '''
-        # Setup report.
-        report = {
-            'name': self.name,
-            'ref_dir': str(ref_dir / self.test_dir),
-            'images': []
-        }
-
         start_time = time.time()
         result = Test.Result.PASSED
         messages = []
         rerun_env = {}
+        images = []
+        self.profile = {'phases': {}, 'resources': {}}
 
         # Generate results images.
         if not compare_only:
-            result, messages, rerun_env = self.generate_images(result_dir, mogwai_exe, run_only, temp_dir)
+            result, messages, rerun_env = await self.generate_images(result_dir, mogwai_exe, run_only, temp_dir)
 
         # Compare to references.
         if not run_only and result == Test.Result.PASSED:
-            result, messages, report['images'] = self.compare_images(ref_dir, result_dir, image_compare_exe)
+            compare_start_time = time.time()
+            result, messages, images = await self.compare_images(ref_dir, result_dir, image_compare_exe)
+            self.profile['phases']['compare'] = time.time() - compare_start_time
+
+        return self.write_report(ref_dir, result_dir, start_time, result, messages, images, rerun_env)
 
-        # Finish report.
+    def write_report(self, ref_dir: Path, result_dir: Path, start_time, result, messages, images, rerun_env):
+        '''
+        Write a JSON report to the result_dir containing details on the test run.
+        Returns a tuple containing the result code, a list of messages and a list of image reports.
+        '''
+        # Setup report.
+        report = {
+            'name': self.name,
+            'ref_dir': str(ref_dir / self.test_dir),
+            'images': images
+        }
         report['result'] = Test.RESULT_STRING[result]
         report['messages'] = messages
         report['duration'] = time.time() - start_time
         report['rerun_env'] = rerun_env
+        report['profile'] = self.profile
 
         # Write JSON report.
         report_dir = result_dir / self.test_dir
@@ -355,96 +422,482 @@ class Test:
         with open(report_file, 'w') as f:
             json.dump(report, f, indent=4)
 
-        return result, messages
+        return result, messages, report['images']
 
-def generate_ref(env: Environment, test: Test, ref_dir: Path, process_controller):
-    if process_controller.is_interrupted():
+def launch_mogwai_worker(env: Environment, device_type, address, token):
+    '''
+    Launch a headless Mogwai process acting as a persistent test worker (see core/mogwai_worker.py).
+    '''
+    env.temp_dir.mkdir(parents=True, exist_ok=True)
+    worker_name = f'worker_{device_type}_{token[:8]}'
+    bootstrap_file = env.temp_dir / f'{worker_name}.py'
+    with open(bootstrap_file, 'w') as f:
+        f.write('import sys\n')
+        f.write(f'sys.path.insert(0, r"{Path(__file__).parent.resolve()}")\n')
+        f.write('from core import mogwai_worker\n')
+        f.write(f'mogwai_worker.run(m, globals(), ("{address[0]}", {address[1]}), "{token}")\n')
+
+    args = [
+        str(env.mogwai_exe),
+        '--device-type', str(device_type),
+        '--script', str(bootstrap_file),
+        '--logfile', str(env.temp_dir / f'{worker_name}.log'),
+        '--headless',
+        '--precise'
+    ]
+    return subprocess.Popen(args, cwd=env.temp_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+async def generate_ref(env: Environment, test: Test, ref_dir: Path, orchestrator: Orchestrator, worker_pool):
+    if orchestrator.is_interrupted():
         return
-    with print_mutex:
-        print(f'  {test.name:<60} : STARTED')
-    test.process_controller = process_controller
+    orchestrator.emit('test_started', test=test.name)
+    test.orchestrator = orchestrator
+    test.worker_pool = worker_pool
     start_time = time.time()
-    result, messages, rerun_env = test.generate_images(ref_dir, env.mogwai_exe, False, env.temp_dir)
+    result, messages, rerun_env = await test.generate_images(ref_dir, env.mogwai_exe, False, env.temp_dir)
     elapsed_time = time.time() - start_time
     return {"name": test.name, "elapsed_time": elapsed_time, "result": result, "messages": messages, "rerun_env": rerun_env}
 
-
-def generate_refs(env: Environment, tests: list[Test], ref_dir, process_controller):
+async def install_refs(env: Environment, test: Test, ref_dir: Path, staging_dir: Path):
+    '''
+    Replace the references of a test in ref_dir with images regenerated into staging_dir.
+    Images identical to the existing references are left untouched, changed images are
+    compared against the existing references to tell changes within tolerance apart.
+    Images that ImageCompare fails to compare are installed as well and reported as 'compare failed'.
+    Returns a list of (image, status, message) tuples, where status is one of 'identical',
+    'within tolerance', 'changed', 'compare failed', 'added' or 'removed', or None if the
+    comparisons were killed due to global exit (in which case no references are installed).
+    '''
+    new_dir = staging_dir / test.test_dir
+    old_dir = ref_dir / test.test_dir
+    new_images = test.collect_images(new_dir)
+    old_images = test.collect_images(old_dir) if old_dir.exists() else []
+
+    # Hash images on the orchestrator's threads to keep the event loop responsive.
+    is_identical = lambda image: helpers.hash_file(new_dir / image) == helpers.hash_file(old_dir / image)
+
+    changes = []
+    compares = {}
+    for image in new_images:
+        if not image in old_images:
+            changes.append((image, 'added', ''))
+        elif await test.orchestrator.run_in_thread(is_identical, image):
+            changes.append((image, 'identical', ''))
+        else:
+            args = [str(env.image_compare_exe), '-m', test.metric, '-t', str(test.tolerance), str(old_dir / image), str(new_dir / image)]
+            compares[image] = test.orchestrator.run_process(test.name + ":image:" + str(image), args, merge_stderr=True)
+    processes = await asyncio.gather(*compares.values())
+    if any(p.killed for p in processes):
+        return None
+    for image, p in zip(compares.keys(), processes):
+        output = '\n'.join(p.stdout).strip()
+        try:
+            error = float(output)
+        except ValueError:
+            changes.append((image, 'compare failed', output or f'{env.image_compare_exe} exited with return code {p.returncode}'))
+            continue
+        status = 'within tolerance' if p.returncode == 0 else 'changed'
+        changes.append((image, status, f'error {error}, tolerance {test.tolerance}'))
+    changes += [(image, 'removed', '') for image in old_images if not image in new_images]
+
+    # Install changed images and the new log, keeping identical images untouched.
+    old_dir.mkdir(parents=True, exist_ok=True)
+    for image, status, _ in changes:
+        if status == 'removed':
+            (old_dir / image).unlink()
+        elif status != 'identical':
+            shutil.copyfile(new_dir / image, old_dir / image)
+    if (new_dir / 'log.txt').exists():
+        shutil.copyfile(new_dir / 'log.txt', old_dir / 'log.txt')
+
+    return sorted(changes)
+
+async def generate_stale_ref(env: Environment, test: Test, ref_dir: Path, staging_dir: Path, orchestrator: Orchestrator, worker_pool):
+    '''
+    Regenerate the references of a test into staging_dir and install them into ref_dir.
+    '''
+    run_result = await generate_ref(env, test, staging_dir, orchestrator, worker_pool)
+    if run_result != None and run_result["result"] == Test.Result.PASSED:
+        changes = await install_refs(env, test, ref_dir, staging_dir)
+        if changes == None:
+            run_result["result"] = Test.Result.FAILED
+            run_result["messages"].append('Process killed due to global exit')
+        else:
+            run_result["changes"] = changes
+    return run_result
+
+def generate_refs(env: Environment, tests: list[Test], ref_dir, orchestrator: Orchestrator, worker_pool=None, dependency_map: DependencyMap = None, only_stale=False):
     '''
     Computes references for a set of tests and stores them into ref_dir.
+    The dependency hash of each test is recorded in the reference manifest. If only_stale
+    is True, only references whose dependency hash changed are regenerated, leaving all
+    other references untouched, and changes to the existing references are reported.
     '''
     print(f'Reference directory: {ref_dir}')
-    print(f'Generating references for {len(tests)} tests on {process_controller.thread_count} processes')
-    if process_controller.thread_count > 1:
-        print(colored('Test timings (both indidivual and total) are unreliable when running tests in parallel.', 'red'))
 
-    # Remove existing references.
-    if ref_dir.exists():
-        shutil.rmtree(ref_dir, ignore_errors=True)
+    hashes = {}
+    if dependency_map:
+        hashes = {test.name: dependency_map.get_hash(test.script_file) for test in tests}
+
+    manifest = LocalManifest(ref_dir)
+    if only_stale:
+        tests = [t for t in tests if not (ref_dir / t.test_dir).exists() or manifest.tests.get(t.name) != hashes.get(t.name)]
+        print(f'Found {len(tests)} stale references')
+        staging_dir = env.temp_dir / 'refs'
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    else:
+        # Remove existing references.
+        if ref_dir.exists():
+            shutil.rmtree(ref_dir, ignore_errors=True)
+        manifest = LocalManifest(ref_dir)
+
+    print(f'Generating references for {len(tests)} tests on {orchestrator.thread_count} processes')
+    if orchestrator.thread_count > 1:
+        print(colored('Test timings (both indidivual and total) are unreliable when running tests in parallel.', 'red'))
 
     success = True
     total_elapsed_time = 0
+    change_counts = {}
+
+    def record_result(run_result):
+        '''
+        Record and print the result of a generated reference.
+        '''
+        nonlocal success
+
+        if run_result == None:
+            return
+        test_name    = run_result["name"]
+        elapsed_time = run_result["elapsed_time"]
+        result       = run_result["result"]
+        messages     = run_result["messages"]
+        changes      = run_result.get("changes", [])
+
+        if result == Test.Result.FAILED:
+            success = False
+        elif result == Test.Result.PASSED and test_name in hashes:
+            manifest.tests[test_name] = hashes[test_name]
+
+        # Print result and messages.
+        status = Test.COLORED_RESULT_STRING[result]
+        print(f'  {test_name:<60} : {status} ({elapsed_time:.1f} s)')
+        for message in messages:
+            print(f'    {message}')
+        for image, change, message in changes:
+            change_counts[change] = change_counts.get(change, 0) + 1
+            if change != 'identical':
+                print(f'    {str(image):<56} : {change}' + (f' ({message})' if message else ''))
+
+    async def generate(test):
+        async with orchestrator.slots:
+            if only_stale:
+                return await generate_stale_ref(env, test, ref_dir, staging_dir, orchestrator, worker_pool)
+            return await generate_ref(env, test, ref_dir, orchestrator, worker_pool)
+
+    async def generate_all():
+        tasks = [asyncio.create_task(generate(test)) for test in tests]
+        try:
+            for task in asyncio.as_completed(tasks):
+                record_result(await task)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
 
     try:
-        with concurrent.futures.ThreadPoolExecutor(process_controller.thread_count) as executor:
-            futures = {executor.submit(generate_ref, env, test, ref_dir, process_controller) for test in tests}
-            try:
-                for future in concurrent.futures.as_completed(futures):
-                    run_result   = future.result()
-                    if run_result == None:
-                        continue
-                    test_name    = run_result["name"]
-                    elapsed_time = run_result["elapsed_time"]
-                    result       = run_result["result"]
-                    messages     = run_result["messages"]
-
-                    if result == Test.Result.FAILED:
-                        success = False
-
-                    # Print result and messages.
-                    status = Test.COLORED_RESULT_STRING[result]
-                    with print_mutex:
-                        print(f'  {test_name:<60} : {status} ({elapsed_time:.1f} s)')
-                        for message in messages:
-                            print(f'    {message}')
-            except KeyboardInterrupt:
-                process_controller.interrupt_and_exit()
-                raise
+        orchestrator.run(generate_all())
     except KeyboardInterrupt:
+        orchestrator.interrupt_and_exit()
         return False
+    finally:
+        # Update file hashes and record dependency hashes of the generated references.
+        if ref_dir.exists():
+            manifest.update()
+            manifest.save()
 
     status = colored('PASSED', 'green') if success else colored('FAILED', 'red')
     print(f'\nGenerating references {status} ({total_elapsed_time:.1f} s).')
-    if process_controller.thread_count > 1:
+    if only_stale:
+        print('Reference changes: ' + ', '.join(f'{change_counts.get(c, 0)} {c}' for c in ['identical', 'within tolerance', 'changed', 'compare failed', 'added', 'removed']))
+    if orchestrator.thread_count > 1:
         print(colored('Test timings (both indidivual and total) are unreliable when running tests in parallel.','red'))
 
     return success
 
-def run_test(env: Environment, test: Test, run_only: bool, compare_only: bool, ref_dir: Path, result_dir: Path, min_tolerance, process_controller: ProcessController, build_id: str):
-    if process_controller.is_interrupted():
-        return
-    with print_mutex:
-        print(f'  {test.name:<60} : STARTED')
-    test.tolerance = max(test.tolerance, min_tolerance)
-    test.process_controller = process_controller
+async def run_test(env: Environment, test: Test, run_only: bool, compare_only: bool, ref_dir: Path, result_dir: Path, min_tolerance, orchestrator: Orchestrator, build_id: str, worker_pool: WorkerPool, watchdog: Watchdog, reruns: int = 0):
+    '''
+    Run a test on the orchestrator's event loop, rerunning it if it fails.
+    At most orchestrator.thread_count tests run at the same time.
+    '''
+    async with orchestrator.slots:
+        if orchestrator.is_interrupted():
+            return
+        orchestrator.emit('test_started', test=test.name)
+        test.tolerance = max(test.tolerance, min_tolerance)
+        test.orchestrator = orchestrator
+        test.worker_pool = worker_pool
+        test.watchdog = watchdog
+        start_time = time.time()
+
+        # Rerun failed tests (comparing the same images again would not change the result).
+        image_reports = []
+        attempts = 0
+        while True:
+            attempts += 1
+            result, messages, images = await test.run(run_only, compare_only, ref_dir, result_dir, env.mogwai_exe, env.image_compare_exe, env.temp_dir)
+            image_reports += images
+            if result != Test.Result.FAILED or compare_only or attempts > reruns or orchestrator.is_interrupted():
+                break
+            orchestrator.emit('test_rerun', test=test.name, attempt=attempts, reruns=reruns)
+        elapsed_time = time.time() - start_time
+
+    return test_run_result(env, test, build_id, elapsed_time, result, messages, attempts, image_reports)
+
+async def compare_tests(env: Environment, tests: list[Test], ref_dir: Path, result_dir: Path, min_tolerance, orchestrator: Orchestrator, build_id: str):
+    '''
+    Compare previous results of a set of tests against references (used for --compare-only).
+    All (reference, result) image pairs are collected up front and split across orchestrator.thread_count
+    ImageCompare processes running in batch mode. Pairs whose references have identical content (by hash)
+    are assigned to the same process and listed next to each other, so ImageCompare's cache of decoded
+    images decodes every distinct reference only once.
+    Returns a list of run results.
+    '''
     start_time = time.time()
-    result, messages = test.run(run_only, compare_only, ref_dir, result_dir, env.mogwai_exe, env.image_compare_exe, env.temp_dir)
+
+    # Collect image pairs of all tests.
+    prepared = []
+    jobs = []
+    for test in tests:
+        test.tolerance = max(test.tolerance, min_tolerance)
+        test.profile = {'phases': {}, 'resources': {}}
+        result, messages, pairs, missing = test.prepare_compare(ref_dir, result_dir)
+        prepared.append((test, result, messages, pairs, missing))
+        for image, pair in (pairs or {}).items():
+            jobs.append((test, image) + pair)
+
+    # Group pairs by reference content, using the hashes cached in the reference manifest.
+    ref_hashes = {}
+    if jobs:
+        local = LocalManifest(ref_dir)
+        ref_hashes = await orchestrator.run_in_thread(local.update, sorted(set(job[2].relative_to(ref_dir).as_posix() for job in jobs)))
+        local.save()
+    groups = {}
+    for job in jobs:
+        digest = ref_hashes.get(job[2].relative_to(ref_dir).as_posix(), str(job[2]))
+        groups.setdefault(digest, []).append(job)
+
+    # Distribute groups across processes, largest groups first.
+    shards = [[] for _ in range(max(1, min(orchestrator.thread_count, len(groups))))]
+    for group in sorted(groups.values(), key=len, reverse=True):
+        shard = min(shards, key=len)
+        # Compare against the first file of each group, so all pairs share one cache entry.
+        shard += [job[0:2] + (group[0][2],) + job[3:] for job in group]
+
+    async def run_shard(index, shard):
+        '''
+        Compare the pairs of a shard in a single ImageCompare process.
+        Returns a list of (return code, output) tuples, one per pair.
+        '''
+        if not shard:
+            return []
+        batch_file = env.temp_dir / f'compare_{index}.txt'
+        with open(batch_file, 'w') as f:
+            for test, image, ref_file, result_file, error_file in shard:
+                f.write(f'{test.metric}\t{test.tolerance}\t{ref_file}\t{result_file}\t{error_file if Test.full_compare else ""}\n')
+
+        # Same as Test.compare_args, error images are only written for full comparisons.
+        args = [str(env.image_compare_exe), '--batch', str(batch_file)]
+        if not Test.full_compare:
+            args += ['-x']
+        p = await orchestrator.run_process(f'compare:{index}', args)
+        if p.killed:
+            return [(1, 'Process killed due to global exit')] * len(shard)
+
+        outputs = []
+        for line in p.stdout:
+            status, _, value = line.partition(' ')
+            outputs.append((0 if status == 'passed' else 1, value))
+        if len(outputs) < len(shard):
+            error = '\n'.join(p.stderr).strip() or f'{args[0]} exited with return code {p.returncode}'
+            outputs += [(1, error)] * (len(shard) - len(outputs))
+        return outputs
+
+    if jobs:
+        env.temp_dir.mkdir(parents=True, exist_ok=True)
+        print(f'Comparing {len(jobs)} images ({len(groups)} distinct references) on {len(shards)} processes')
+    outputs = {}
+    for shard, shard_outputs in zip(shards, await asyncio.gather(*[run_shard(index, shard) for index, shard in enumerate(shards)])):
+        for job, output in zip(shard, shard_outputs):
+            outputs.setdefault(job[0], {})[job[1]] = output
     elapsed_time = time.time() - start_time
 
+    # Check results and write reports.
+    run_results = []
+    for test, result, messages, pairs, missing in prepared:
+        images = []
+        if pairs != None:
+            test_outputs = outputs.get(test, {})
+            result, messages, images = test.check_compared(result, messages, {image: test_outputs[image] for image in pairs}, missing)
+            test.profile['phases']['compare'] = elapsed_time
+        result, messages, images = test.write_report(ref_dir, result_dir, start_time, result, messages, images, {})
+        run_results.append(test_run_result(env, test, build_id, elapsed_time, result, messages, 1, images))
+
+    return run_results
+
+def test_run_result(env: Environment, test: Test, build_id: str, elapsed_time, result, messages, attempts, image_reports):
+    '''
+    Create the run result of a finished test.
+    '''
+    if attempts > 1 and result == Test.Result.PASSED:
+        messages.append(f'Test is flaky, passed after {attempts} attempts.')
     if result != Test.Result.SKIPPED:
         messages.append(f'View test at: http://{env.hostname}:8080/{env.vcs_root}/{build_id}/{test.name}')
 
-    return {"name": test.name, "elapsed_time": elapsed_time, "result": result, "messages": messages}
+    return {"name": test.name, "elapsed_time": elapsed_time, "result": result, "messages": messages, "attempts": attempts, "images": image_reports}
 
-def run_tests(env: Environment, tests: list[Test], run_only: bool, compare_only: bool, ref_dir: Path, result_dir: Path, min_tolerance, xml_report, process_controller: ProcessController, build_id: str):
+def print_progress(event):
+    '''
+    Print progress events of the orchestrator that are not printed when recording results.
+    '''
+    if event['type'] == 'test_started':
+        print(f'  {event["test"]:<60} : STARTED')
+    elif event['type'] == 'test_rerun':
+        print(f'  {event["test"]:<60} : RERUN ({event["attempt"]} of {event["reruns"]})')
+
+def write_xml_report(run_results, xml_report):
+    '''
+    Write a JUnit XML report for a list of run results.
+    '''
+    testsuites = ET.Element("testsuites")
+    suite = ET.SubElement(testsuites, "testsuite", name="Image Tests")
+    for run_result in run_results:
+        testcase = ET.SubElement(suite, "testcase", name=run_result["name"], time="%.3f" % run_result["elapsed_time"])
+        if run_result["result"] == Test.Result.SKIPPED:
+            ET.SubElement(testcase, "skipped")
+        elif run_result["result"] == Test.Result.FAILED and run_result.get("quarantined", False):
+            ET.SubElement(testcase, "skipped", message="Quarantined flaky test failed:\n" + "\n".join(run_result["messages"]))
+        elif run_result["result"] == Test.Result.FAILED:
+            ET.SubElement(testcase, "failure", message="\n".join(run_result["messages"]))
+
+    tree = ET.ElementTree(testsuites)
+    tree.write(xml_report)
+
+def load_journal_results(journal_file):
     '''
-    Runs a set of tests, stores them into result_dir and compares them to ref_dir.
+    Load the run entry and the list of run results recorded in a run journal.
+    '''
+    entries, _ = read_journal(journal_file)
+    run, tests = summarize_journal(entries)
+    run_results = []
+    for entry in tests.values():
+        run_results.append({
+            "name": entry["name"],
+            "elapsed_time": entry["elapsed_time"],
+            "result": Test.Result[entry["result"]],
+            "messages": entry["messages"],
+            "quarantined": entry.get("quarantined", False)
+        })
+    return run, run_results
+
+def select_canaries(tests: list[Test], count, result_dir: Path, runtime_db: RuntimeDatabase = None, build_config=None):
+    '''
+    Select a small set of fast tests covering as many test directories and device types as possible.
+    Tests with "canary": True in their header are always selected. Remaining slots are filled
+    round-robin with the fastest tests of each group, based on the median duration in runtime_db
+    or the duration recorded in previous reports in result_dir (falling back to the test timeout).
+    '''
+    def duration(test):
+        durations = sorted(runtime_db.durations(test.name, build_config)) if runtime_db else []
+        if durations:
+            return durations[len(durations) // 2]
+        try:
+            with open(result_dir / test.test_dir / 'report.json') as f:
+                return json.load(f)['duration']
+        except (OSError, ValueError, KeyError):
+            return test.timeout
+
+    candidates = [t for t in tests if not t.skipped]
+    canaries = [t for t in candidates if t.header.get('canary', False)]
+
+    groups = {}
+    for test in sorted(candidates, key=duration):
+        if not test in canaries:
+            groups.setdefault((test.script_file.parent, test.device_type), []).append(test)
+
+    groups = list(groups.values())
+    while len(canaries) < count and groups:
+        for group in groups:
+            if len(canaries) < count:
+                canaries.append(group.pop(0))
+        groups = [g for g in groups if g]
+
+    return canaries
+
+class RunOptions:
+    '''
+    Options of a test run (see run_tests).
+    '''
+
+    def __init__(self, *, run_only=False, compare_only=False, min_tolerance=config.DEFAULT_TOLERANCE, xml_report=None, build_id='unknown', resume=False,
+                 max_failures=0, canary_count=0, adaptive_timeouts=False, reruns=0, apply_tolerances=False, quarantine=False, live_url=None):
+        # Only run tests or only compare previous results against the references.
+        self.run_only = run_only
+        self.compare_only = compare_only
+        # Tolerances are at least this value.
+        self.min_tolerance = min_tolerance
+        # JUnit XML report file (optional).
+        self.xml_report = xml_report
+        self.build_id = build_id
+        # Do not run tests already recorded in the run journal again.
+        self.resume = resume
+        # Abort the run once this many tests have failed (0 disables the limit).
+        self.max_failures = max_failures
+        # If non-zero, a small set of canary tests is run first and the remaining
+        # tests are skipped if any of the canaries fail.
+        self.canary_count = canary_count
+        # Predict test timeouts from the durations recorded in the runtime database.
+        self.adaptive_timeouts = adaptive_timeouts
+        # Rerun failed tests up to this many times.
+        self.reruns = reruns
+        # Raise tolerances to the ones suggested from the recorded errors of passing
+        # comparisons (see FlakinessTracker.suggest_tolerance).
+        self.apply_tolerances = apply_tolerances
+        # Failures of chronically flaky tests do not fail the run.
+        self.quarantine = quarantine
+        # If given, the URL is written to the result directory while the run is in progress,
+        # so the viewer can subscribe to the progress events served there (see core/live.py).
+        self.live_url = live_url
+
+    @classmethod
+    def from_args(cls, args, live_url=None):
+        '''
+        Create the options from the command line arguments.
+        '''
+        return cls(
+            run_only=args.run_only,
+            compare_only=args.compare_only,
+            min_tolerance=args.tolerance,
+            xml_report=args.xml_report,
+            build_id=args.build_id,
+            resume=args.resume,
+            max_failures=args.max_failures,
+            canary_count=args.canary,
+            adaptive_timeouts=args.adaptive_timeouts,
+            reruns=args.reruns,
+            apply_tolerances=args.apply_tolerances,
+            quarantine=args.quarantine,
+            live_url=live_url
+        )
+
+def run_tests(env: Environment, tests: list[Test], ref_dir: Path, result_dir: Path, orchestrator: Orchestrator, options: RunOptions, *, worker_pool: WorkerPool = None, runtime_db: RuntimeDatabase = None, watchdog: Watchdog = None, flakiness: FlakinessTracker = None):
+    '''
+    Runs a set of tests, stores them into result_dir and compares them to ref_dir (see RunOptions for the options of the run).
+    Every finished test is appended to the run journal in result_dir.
+    Tests are run on persistent workers from worker_pool if given and monitored by watchdog.
+    Durations of passed tests are recorded in runtime_db and outcomes and image errors in flakiness.
     '''
     print(f'Result directory: {result_dir}')
     print(f'Reference directory: {ref_dir}')
-    print(f'Running {len(tests)} tests on {process_controller.thread_count} processes')
-    if process_controller.thread_count > 1:
-        print(colored('Test timings (both indidivual and total) are unreliable when running tests in parallel.', 'red'))
 
     success = True
     run_date = datetime.datetime.now()
@@ -452,71 +905,213 @@ def run_tests(env: Environment, tests: list[Test], run_only: bool, compare_only:
     run_results = []
     total_elapsed_time = 0
 
+    # Skip tests already recorded in the journal when resuming.
+    journal_file = result_dir / config.JOURNAL_FILE
+    resume = options.resume and journal_file.exists()
+    if resume:
+        run, run_results = load_journal_results(journal_file)
+        if run:
+            run_date = datetime.datetime.fromisoformat(run['date'])
+        finished = set(r["name"] for r in run_results)
+        print(f'Resuming run with {len(finished)} tests already finished')
+        for run_result in run_results:
+            if run_result["result"] == Test.Result.FAILED and not run_result["quarantined"]:
+                success = False
+        all_tests = sorted(set(run['tests'] if run else []) | set(t.name for t in tests))
+        tests = [t for t in tests if not t.name in finished]
+    else:
+        all_tests = [t.name for t in tests]
+
+    print(f'Running {len(tests)} tests on {orchestrator.thread_count} processes')
+    if orchestrator.thread_count > 1:
+        print(colored('Test timings (both indidivual and total) are unreliable when running tests in parallel.', 'red'))
+
+    # Predict timeouts from historical runtimes.
+    if runtime_db and options.adaptive_timeouts:
+        for test in tests:
+            test.timeout = runtime_db.predict_timeout(test.name, env.build_config, test.timeout)
+
+    # Apply tolerances suggested from the recorded error distributions.
+    if flakiness and options.apply_tolerances:
+        for test in tests:
+            suggestion = flakiness.suggest_tolerance(test.name, env.build_config, test.metric, test.tolerance)
+            if suggestion != None and suggestion > test.tolerance:
+                print(f'Using tolerance {suggestion:.6g} instead of {test.tolerance:.6g} for {test.name}')
+                test.tolerance = suggestion
+
+    # The run report is only written once the run has finished. Remove the report (and live progress file)
+    # of a previous run in the same result directory, so the viewer shows this run as running.
+    result_dir.mkdir(parents=True, exist_ok=True)
+    report_file = result_dir / 'report.json'
+    report_file.unlink(missing_ok=True)
+    live_file = result_dir / config.LIVE_FILE
+    live_file.unlink(missing_ok=True)
+
+    journal = RunJournal(journal_file, resume)
+    journal.append({'type': 'run', 'date': run_date.isoformat(), 'tests': all_tests})
+
+    if options.live_url:
+        with open(live_file, 'w') as f:
+            json.dump({'url': options.live_url, 'pid': os.getpid()}, f)
+
+    failure_count = 0
+    aborted = False
+
+    emit = orchestrator.emit
+    emit('run_started', tests=[t.name for t in tests], result_dir=str(result_dir), ref_dir=str(ref_dir))
+
+    def record_result(run_result):
+        '''
+        Record and print the result of a finished test.
+        '''
+        nonlocal success, failure_count, aborted
+
+        if run_result == None:
+            return
+
+        test_name    = run_result["name"]
+        elapsed_time = run_result["elapsed_time"]
+        result       = run_result["result"]
+        messages     = run_result["messages"]
+
+        # Tests killed by an abort are not recorded, so --resume runs them again.
+        if aborted:
+            print(f'  {test_name:<60} : ABORTED ({elapsed_time:.1f} s)')
+            return
+
+        if flakiness and result != Test.Result.SKIPPED and not options.run_only:
+            flakiness.record(test_name, env.build_config, Test.RESULT_STRING[result], run_result["attempts"], run_result["images"])
+
+        # Failures of quarantined tests are reported but do not fail the run.
+        if result == Test.Result.FAILED and options.quarantine and flakiness and flakiness.is_quarantined(test_name, env.build_config):
+            run_result["quarantined"] = True
+            flaky, runs = flakiness.flake_stats(test_name, env.build_config)
+            messages.append(f'Test is quarantined (flaky in {flaky} of the last {runs} runs), ignoring failure.')
+
+        run_results.append(run_result)
+        journal.append({
+            'type': 'test',
+            'name': test_name,
+            'result': Test.RESULT_STRING[result],
+            'elapsed_time': elapsed_time,
+            'messages': messages,
+            'quarantined': run_result.get("quarantined", False)
+        })
+        emit('test_finished', test=test_name, result=Test.RESULT_STRING[result], elapsed_time=elapsed_time, attempts=run_result["attempts"], messages=messages, quarantined=run_result.get("quarantined", False))
+
+        if result == Test.Result.FAILED and not run_result.get("quarantined", False):
+            success = False
+            failure_count += 1
+        elif result == Test.Result.PASSED and runtime_db and not options.compare_only and run_result["attempts"] == 1:
+            runtime_db.record(test_name, env.build_config, elapsed_time)
+
+        # Print result and messages.
+        status = Test.COLORED_RESULT_STRING[result]
+        if run_result.get("quarantined", False):
+            status += colored(' (QUARANTINED)', 'yellow')
+        print(f'  {test_name:<60} : {status} ({elapsed_time:.1f} s)')
+        for message in messages:
+            print(f'    {message}')
+
+        # Stop early once too many tests have failed.
+        if options.max_failures and failure_count >= options.max_failures:
+            aborted = True
+            orchestrator.abort(colored(f'Reached maximum number of failures ({options.max_failures}), aborting remaining tests', 'red'))
+
+    async def run_batch(batch):
+        '''
+        Run a batch of tests in parallel and record their results.
+        '''
+        # Compare all images of the batch at once when only comparing previous results.
+        if options.compare_only:
+            for run_result in await compare_tests(env, batch, ref_dir, result_dir, options.min_tolerance, orchestrator, options.build_id):
+                record_result(run_result)
+            return
+
+        tasks = [asyncio.create_task(run_test(env, test, options.run_only, options.compare_only, ref_dir, result_dir, options.min_tolerance, orchestrator, options.build_id, worker_pool, watchdog, options.reruns)) for test in batch]
+        try:
+            for task in asyncio.as_completed(tasks):
+                record_result(await task)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def run_all(tests):
+        '''
+        Run all tests, starting with the canary tests if requested.
+        '''
+        nonlocal aborted
+
+        # Run canary tests first and only continue with the remaining tests if they all pass.
+        if options.canary_count > 0:
+            canaries = select_canaries(tests, options.canary_count, result_dir, runtime_db, env.build_config)
+            print(f'Running {len(canaries)} canary tests')
+            # Only failures of the canaries count, not the ones loaded from the journal when resuming.
+            previous_failure_count = failure_count
+            await run_batch(canaries)
+            tests = [t for t in tests if not t in canaries]
+            if failure_count > previous_failure_count and not aborted:
+                aborted = True
+                print(colored('Canary tests failed, skipping remaining tests', 'red'))
+            elif not aborted:
+                print(f'Canary tests passed, running remaining {len(tests)} tests')
+
+        if not aborted:
+            await run_batch(tests)
+
     try:
-        # Run tests on #CPU - 2 (to retain some performance control)
-        with concurrent.futures.ThreadPoolExecutor(process_controller.thread_count) as executor:
-            futures = {executor.submit(run_test, env, test, run_only, compare_only, ref_dir, result_dir, min_tolerance, process_controller,build_id) for test in tests}
-            try:
-                for future in concurrent.futures.as_completed(futures):
-                    run_result   = future.result()
-                    if run_result == None:
-                        continue
-
-                    run_results.append(run_result)
-
-                    test_name    = run_result["name"]
-                    elapsed_time = run_result["elapsed_time"]
-                    result       = run_result["result"]
-                    messages     = run_result["messages"]
-
-                    if result == Test.Result.FAILED:
-                        success = False
-
-                    # Print result and messages.
-                    status = Test.COLORED_RESULT_STRING[result]
-                    with print_mutex:
-                        print(f'  {test_name:<60} : {status} ({elapsed_time:.1f} s)')
-                        for message in messages:
-                            print(f'    {message}')
-            except KeyboardInterrupt:
-                process_controller.interrupt_and_exit()
-                raise
+        # Run all processes on a single event loop.
+        orchestrator.run(run_all(tests))
     except KeyboardInterrupt:
+        orchestrator.interrupt_and_exit()
+        journal.close()
+        live_file.unlink(missing_ok=True)
+        print(f'Partial results are recorded in {journal_file} (use --resume to continue)')
+        if options.xml_report:
+            write_xml_report(load_journal_results(journal_file)[1], options.xml_report)
         return False
 
+    journal.close()
+    live_file.unlink(missing_ok=True)
+
+    # Report tests that have not been run due to an abort.
+    if aborted:
+        success = False
+        finished = set(r["name"] for r in run_results)
+        not_run = [name for name in all_tests if not name in finished]
+        print(f'{len(not_run)} tests have not been run (use --resume to run them)')
+        for name in not_run:
+            run_results.append({"name": name, "elapsed_time": 0, "result": Test.Result.SKIPPED, "messages": ["Test was not run due to early abort"]})
+
     total_elapsed_time = time.time() - run_start_time
 
+    emit('run_finished', result='PASSED' if success else 'FAILED', elapsed_time=total_elapsed_time)
+
     status = colored('PASSED', 'green') if success else colored('FAILED', 'red')
     print(f'\nImage tests {status} ({total_elapsed_time:.1f} s).')
-    if process_controller.thread_count > 1:
+    if orchestrator.thread_count > 1:
         print(colored('Test timings (both indidivual and total) are unreliable when running tests in parallel.','red'))
 
-    # Setup report.
+    # Setup report (including the tags identifying the runs of one branch, see compact_image_tests.py).
     report = {
         'date': run_date.isoformat(),
         'result': 'PASSED' if success else 'FAILED',
-        'tests': [t.name for t in tests],
-        'duration': time.time() - run_start_time
+        'tests': all_tests,
+        'duration': time.time() - run_start_time,
+        'vcs_root': env.vcs_root,
+        'hostname': env.hostname,
+        'branch': env.branch,
+        'build_config': env.build_config
     }
 
     # Write JSON report.
-    report_file = result_dir / 'report.json'
     with open(report_file, 'w') as f:
         json.dump(report, f, indent=4)
 
     # Write XML report.
-    if xml_report:
-        testsuites = ET.Element("testsuites")
-        suite = ET.SubElement(testsuites, "testsuite", name="Image Tests")
-        for run_result in run_results:
-            testcase = ET.SubElement(suite, "testcase", name=run_result["name"], time="%.3f" % run_result["elapsed_time"])
-            if run_result["result"] == Test.Result.SKIPPED:
-                ET.SubElement(testcase, "skipped")
-            elif run_result["result"] == Test.Result.FAILED:
-                ET.SubElement(testcase, "failure", message="\n".join(run_result["messages"]))
-
-        tree = ET.ElementTree(testsuites)
-        tree.write(xml_report)
+    if options.xml_report:
+        write_xml_report(run_results, options.xml_report)
 
     return success
 
@@ -528,21 +1123,36 @@ def list_tests(tests: list[Test]):
     for test in tests:
         print(f'  {test.name}')
 
-def collect_tests(root_dir, filter_regex, tags)->list[Test]:
+def collect_tests(root_dir, filter_regex, tags, index_file=None)->list[Test]:
     '''
     Collect a list of all tests found in root_dir that are matching the filter_regex and tags.
     A test script needs to be named test_*.py to be detected.
+    Parsed script headers are cached in index_file (if given).
     '''
     # Find all script files.
     script_files = list(root_dir.glob('**/test_*.py'))
 
+    # Parse headers.
+    index = TestIndex(index_file)
+    try:
+        headers = index.headers(script_files)
+    except Exception as e:
+        print(e)
+        sys.exit(1)
+    try:
+        index.save()
+    except OSError as e:
+        print(f'Failed to write test index {index_file} ({e})')
+
     # Create tests.
     tests = []
     for script_file in script_files:
-        try:
-            header = read_header(script_file)
-        except Exception as e:
-            print(e)
+        header = headers[script_file]
+
+        # Check image comparison metric.
+        metric = header.get('metric', config.DEFAULT_METRIC)
+        if not metric in config.IMAGE_COMPARE_METRICS:
+            print(f'Unknown image comparison metric "{metric}" in {script_file} (available: {", ".join(config.IMAGE_COMPARE_METRICS)})')
             sys.exit(1)
 
         # Check if test is enabled for current platform.
@@ -569,26 +1179,61 @@ def collect_tests(root_dir, filter_regex, tags)->list[Test]:
 
     return tests
 
-def push_refs(ref_dir, remote_ref_dir):
+def list_flaky_tests(tests: list[Test], flakiness: FlakinessTracker, build_config):
     '''
-    Pushes reference images from ref_dir to remote_ref_dir.
+    Print flakiness statistics and suggested tolerances of tests with recorded history.
+    '''
+    print(f'{"Test":<60} {"Flaky runs":>12} {"Tolerance":>12} {"Suggested":>12}')
+    for test in tests:
+        flaky, runs = flakiness.flake_stats(test.name, build_config)
+        if runs == 0:
+            continue
+        suggestion = flakiness.suggest_tolerance(test.name, build_config, test.metric, test.tolerance)
+        suggestion = f'{suggestion:.6g}' if suggestion != None else '-'
+        quarantined = ' (quarantined)' if flakiness.is_quarantined(test.name, build_config) else ''
+        print(f'{test.name:<60} {f"{flaky}/{runs}":>12} {test.tolerance:>12.6g} {suggestion:>12}{quarantined}')
+
+def list_dependencies(tests: list[Test], dependency_map: DependencyMap):
+    '''
+    Print the dependencies of a list of tests.
+    '''
+    for test in tests:
+        dependencies = dependency_map.get_dependencies(test.script_file)
+        print(f'  {test.name}')
+        for key in ['files', 'passes', 'pass_dirs', 'scenes']:
+            print(f'    {key:<10}: {", ".join(dependencies[key])}')
+
+def select_changed_tests(tests: list[Test], dependency_map: DependencyMap, rev):
+    '''
+    Select tests whose dependencies intersect the files changed since the given git revision.
+    '''
+    try:
+        changed_files = get_changed_files(dependency_map.project_dir, rev)
+    except Exception as e:
+        print(e)
+        sys.exit(1)
+    selected = [t for t in tests if dependency_map.is_affected(t.script_file, changed_files)]
+    print(f'Selected {len(selected)} of {len(tests)} tests affected by {len(changed_files)} files changed since {rev}')
+    return selected
+
+def push_refs(ref_dir, remote_ref_dir, branch, build_config):
+    '''
+    Pushes reference images from ref_dir to the reference store in remote_ref_dir.
     '''
     print(f'Pushing reference images to {remote_ref_dir} : ', end='', flush=True)
-    success, log = helpers.mirror_folders(ref_dir, remote_ref_dir)
+    success, log = RefStore(remote_ref_dir).push(ref_dir, branch, build_config)
     print(colored('OK', 'green') if success else colored('FAILED', 'red'))
-    if not success:
-        print(log)
+    print(log)
     return success
 
-def pull_refs(remote_ref_dir, ref_dir):
+def pull_refs(remote_ref_dir, ref_dir, branch, build_config):
     '''
-    Pulls reference images from remote_ref_dir to ref_dir.
+    Pulls reference images from the reference store in remote_ref_dir to ref_dir.
     '''
     print(f'Pulling reference images from {remote_ref_dir} : ', end='', flush=True)
-    success, log = helpers.mirror_folders(remote_ref_dir, ref_dir)
+    success, log = RefStore(remote_ref_dir).pull(ref_dir, branch, build_config)
     print(colored('OK', 'green') if success else colored('FAILED', 'red'))
-    if not success:
-        print(log)
+    print(log)
     return success
 
 def main():
@@ -603,13 +1248,32 @@ def main():
     parser.add_argument('-l', '--list', action='store_true', help='List available tests')
     parser.add_argument('-t', '--tags', type=str, action='store', help='Comma separated list of tags for filtering tests to run', default='default')
     parser.add_argument('-f', '--filter', type=str, action='store', help='Regular expression for filtering tests to run')
+    parser.add_argument('--changed-since', type=str, action='store', help='Only select tests depending on files changed since the given git revision')
+    parser.add_argument('--list-dependencies', action='store_true', help='List the files, render passes and scenes the selected tests depend on')
     parser.add_argument('-x', '--xml-report', type=str, action='store', help='XML report output file')
     parser.add_argument('-b', '--ref-branch', help='Reference branch to compare against (defaults to master branch)', default='master')
     parser.add_argument('--run-only', action='store_true', help='Run tests without comparing images')
     parser.add_argument('--compare-only', action='store_true', help='Compare previous results against references without generating new images')
+    parser.add_argument('--full-compare', action='store_true', help='Compare full images and write error images instead of stopping as soon as an image is known to fail')
     parser.add_argument('--tolerance', type=float, action='store', help='Override tolerance to be at least this value.', default=config.DEFAULT_TOLERANCE)
     parser.add_argument('--parallel', type=int, action='store', help='Set the number of Mogwai processes to be used in parallel', default=default_processes_count)
     parser.add_argument('--gen-refs', action='store_true', help='Generate reference images instead of running tests')
+    parser.add_argument('--only-stale', action='store_true', help='With --gen-refs, only regenerate references whose dependencies have changed')
+    parser.add_argument('--reruns', type=int, action='store', help=f'Rerun failed tests up to this many times before reporting them as failed (default: {config.DEFAULT_RERUN_COUNT})', default=config.DEFAULT_RERUN_COUNT)
+    parser.add_argument('--apply-tolerances', action='store_true', help='Raise tolerances to the ones suggested from the recorded error distributions')
+    parser.add_argument('--quarantine', action='store_true', help='Do not fail the run on failures of chronically flaky tests')
+    parser.add_argument('--list-flaky', action='store_true', help='List flakiness statistics and suggested tolerances of tests')
+    parser.add_argument('--resume', action='store_true', help='Resume an interrupted run, only running tests missing from its run journal')
+    parser.add_argument('--max-failures', type=int, action='store', help='Abort the run once this many tests have failed', default=0)
+    parser.add_argument('--adaptive-timeouts', action='store_true', help='Predict test timeouts from historical runtimes instead of using the static timeout')
+    parser.add_argument('--stall-timeout', type=float, action='store', help=f'Report tests whose log has not grown for this many seconds (default: {config.DEFAULT_STALL_TIMEOUT})', default=config.DEFAULT_STALL_TIMEOUT)
+    parser.add_argument('--canary', type=int, nargs='?', action='store', help=f'Run a small set of canary tests first and abort if any of them fail (default count: {config.DEFAULT_CANARY_COUNT})', const=config.DEFAULT_CANARY_COUNT, default=0)
+    parser.add_argument('--workers', action='store_true', help='Run tests on persistent Mogwai worker processes instead of starting Mogwai for every test')
+    parser.add_argument('--events-file', type=str, action='store', help='Write structured progress events to this JSON lines file')
+    parser.add_argument('--live', action='store_true', help='Serve progress events over HTTP while tests are running, for live updates in the viewer')
+    parser.add_argument('--live-port', type=int, action='store', help=f'Port of the live progress server (default: {config.DEFAULT_LIVE_PORT})', default=config.DEFAULT_LIVE_PORT)
+    parser.add_argument('--live-remote', action='store_true', help='Allow connections to the live progress server from other machines (by default, only local connections are accepted)')
+    parser.add_argument('--worker-max-tests', type=int, action='store', help=f'Number of tests a persistent worker runs before it is recycled (default: {config.DEFAULT_WORKER_MAX_TESTS})', default=config.DEFAULT_WORKER_MAX_TESTS)
 
     additional_group = parser.add_argument_group('extended arguments ', 'Additional options used for testing pipelines on TeamCity.')
     additional_group.add_argument('--pull-refs', action='store_true', help='Pull reference images from remote before running tests')
@@ -636,19 +1300,47 @@ def main():
         sys.exit(1)
 
     # Collect tests to run.
-    tests = collect_tests(env.image_tests_dir, args.filter, args.tags)
+    tests = collect_tests(env.image_tests_dir, args.filter, args.tags, env.image_tests_index_file)
+
+    # Select tests affected by changes.
+    dependency_map = DependencyMap(env.project_dir)
+    if args.changed_since:
+        tests = select_changed_tests(tests, dependency_map, args.changed_since)
+
+    Test.full_compare = args.full_compare
 
     # The number of processes on Windows is 61, which should be enough for anything, so just hard coding it capped here
     args.parallel = min(args.parallel, 61)
-    process_controller = ProcessController(args.parallel)
+    orchestrator = Orchestrator(args.parallel)
+    orchestrator.add_listener(print_progress)
+    event_log = None
+    if args.events_file:
+        event_log = EventLog(args.events_file)
+        orchestrator.add_listener(event_log)
+
+    # Setup persistent workers.
+    worker_pool = None
+    if args.workers and not (args.list or args.list_dependencies or args.list_flaky):
+        launch_worker = lambda device_type, address, token: launch_mogwai_worker(env, device_type, address, token)
+        worker_pool = WorkerPool(args.parallel, launch_worker, args.worker_max_tests, orchestrator)
 
     if args.list:
         # List available tests.
         list_tests(tests)
+    elif args.list_dependencies:
+        # List test dependencies.
+        list_dependencies(tests, dependency_map)
+    elif args.list_flaky:
+        # List flaky tests.
+        flakiness = FlakinessTracker(env.image_tests_flakiness_db)
+        list_flaky_tests(tests, flakiness, env.build_config)
+        flakiness.close()
     elif args.gen_refs:
         # Generate references.
         ref_dir = env.resolve_image_dir(env.image_tests_ref_dir, env.branch, args.build_id)
-        result = generate_refs(env, tests, ref_dir, process_controller)
+        result = generate_refs(env, tests, ref_dir, orchestrator, worker_pool, dependency_map, args.only_stale)
+        if worker_pool:
+            worker_pool.close()
         shutil.rmtree(env.temp_dir, ignore_errors=True)
         if not result:
             sys.exit(1)
@@ -659,7 +1351,7 @@ def main():
                 print("Remote reference directory is not configured for this environment.")
                 sys.exit(1)
             remote_ref_dir = env.resolve_image_dir(env.image_tests_remote_ref_dir, env.branch, args.build_id)
-            if not push_refs(ref_dir, remote_ref_dir):
+            if not push_refs(ref_dir, remote_ref_dir, env.branch, env.build_config):
                 sys.exit(1)
     else:
         # Determine result and reference directories.
@@ -672,7 +1364,7 @@ def main():
                 print("Remote reference directory is not configured for this environment.")
                 sys.exit(1)
             remote_ref_dir = env.resolve_image_dir(env.image_tests_remote_ref_dir, args.ref_branch, args.build_id)
-            if not pull_refs(remote_ref_dir, ref_dir):
+            if not pull_refs(remote_ref_dir, ref_dir, args.ref_branch, env.build_config):
                 sys.exit(1)
 
         # Give some instructions on how to acquire reference images if not available.
@@ -693,7 +1385,31 @@ def main():
             sys.exit(1)
 
         # Run tests.
-        result = run_tests(env, tests, args.run_only, args.compare_only, ref_dir, result_dir, args.tolerance, args.xml_report, process_controller, args.build_id)
+        runtime_db = RuntimeDatabase(env.image_tests_runtime_db)
+        flakiness = FlakinessTracker(env.image_tests_flakiness_db)
+        watchdog = Watchdog(args.stall_timeout, report=lambda message: orchestrator.call_soon_threadsafe(print, message))
+        live_server = None
+        live_url = None
+        if args.live:
+            try:
+                live_server = LiveServer(args.live_port, args.live_remote)
+            except OSError as e:
+                print(f'Failed to start live progress server on port {args.live_port} ({e})')
+                sys.exit(1)
+            orchestrator.add_listener(live_server)
+            live_url = f'http://{env.hostname if args.live_remote else LIVE_LOCAL_HOST}:{live_server.port}'
+            print(f'Live progress at: {live_url}/events')
+        options = RunOptions.from_args(args, live_url)
+        result = run_tests(env, tests, ref_dir, result_dir, orchestrator, options, worker_pool=worker_pool, runtime_db=runtime_db, watchdog=watchdog, flakiness=flakiness)
+        if live_server:
+            live_server.close()
+        watchdog.stop()
+        flakiness.close()
+        runtime_db.close()
+        if event_log:
+            event_log.close()
+        if worker_pool:
+            worker_pool.close()
         shutil.rmtree(env.temp_dir, ignore_errors=True)
 
         # Print out url to test viewer
@@ -2,20 +2,34 @@
 Script for viewing image test results.
 '''
 
+import os
 import sys
 import time
 import datetime
 import threading
 import re
 import json
+import gzip
+import io
+import math
+import socketserver
 import argparse
+import urllib.parse
+import mimetypes
 import webbrowser
 from pathlib import Path
+from wsgiref.simple_server import WSGIServer
 
 import libs.bottle as bottle
-from libs.bottle import route, view, request, run, template, static_file
+from libs.bottle import route, view, request, response, run, template, static_file, HTTPError
 
 from core import Environment, config, helpers
+from core.helpers import hash_file
+from core.results import ResultLayout, RunArchive
+from core.result_index import ResultIndex
+from core.previews import PreviewCache
+from core.trends import build_trends
+from core.logs import LogIndexCache, read_chunk, grep_log
 
 # Directory containing viewer files.
 VIEWER_DIR = Path(__file__).parent / 'viewer'
@@ -48,113 +62,217 @@ MIME_TYPES = {
     '.wasm': 'application/wasm',
 }
 
+# MIME types of responses compressed with gzip.
+GZIP_MIME_TYPES = ['text/html', 'application/json', 'text/css', 'text/javascript', 'text/plain']
+
+# Minimum size in bytes of responses compressed with gzip.
+GZIP_MIN_SIZE = 1024
+
 # Global database instance.
 database = None
 
 class Database:
     '''
     Helper for accessing image test results.
+    Runs and test reports are served from an index of the result directory (see core/result_index.py),
+    which is updated incrementally at most every RESULT_INDEX_SCAN_INTERVAL seconds.
     '''
     def __init__(self, env: Environment):
-        result_dir_template = env.image_tests_result_dir
-        ref_dir_template = env.image_tests_ref_dir
-
-        # Substitute project_dir as it is a static part of the path.
-        result_dir_template = result_dir_template.replace('${project_dir}', str(env.project_dir))
-        ref_dir_template = ref_dir_template.replace('${project_dir}', str(env.project_dir))
-        result_dir_template = result_dir_template.replace('${project_drive}', str(env.project_dir.drive))
-        ref_dir_template = ref_dir_template.replace('${project_drive}', str(env.project_dir.drive))
-
-        # Extract result directory and run pattern.
-        index = result_dir_template.index('$')
-        result_dir = result_dir_template[0:index]
-        run_pattern = result_dir_template[index:].replace('\\', '/')
+        self.layout = ResultLayout(env)
+        self.result_dir = self.layout.result_dir
+        self.ref_dir = self.layout.ref_dir
+        self.run_tags = self.layout.run_tags
+        self.index = ResultIndex(env.image_tests_result_index_db, self.layout)
+        self.previews = PreviewCache(env.image_tests_preview_cache_dir, env.image_compare_exe)
+        self.log_indices = LogIndexCache()
+
+        # Open archives of packed runs (run_dir -> RunArchive).
+        self.archives = {}
+        self.archives_mutex = threading.Lock()
+
+    def load_runs(self, tags={}, result=None, date_from=None, date_to=None, offset=0, limit=None):
+        '''
+        Load list of runs matching the given filters (not including reports of individual tests).
+        Returns a tuple containing the list of runs and the total number of matching runs.
+        '''
+        self.index.scan(config.RESULT_INDEX_SCAN_INTERVAL)
+        return self.index.runs(tags, result, date_from, date_to, offset, limit)
 
-        # Extract reference directory.
-        index = ref_dir_template.index('$')
-        ref_dir = ref_dir_template[0:index]
+    def load_run(self, run_dir):
+        '''
+        Load a single run (not including reports of individual tests, see load_tests).
+        '''
+        self.index.scan(config.RESULT_INDEX_SCAN_INTERVAL)
+        run = self.index.run(run_dir)
+        if not run:
+            return None
 
-        # Extract the tags that make up a run directory.
-        run_tags = run_pattern.split('/')
-        run_tags = list(map(lambda f: re.fullmatch(r'\$\{([a-z_]+)\}', f)[1], run_tags))
+        # Runs in progress may serve live progress events (see run_image_tests.py --live).
+        if run['result'] == 'RUNNING':
+            live = load_json(self.result_dir / run_dir / config.LIVE_FILE)
+            if live and 'url' in live:
+                run['live_url'] = live['url']
 
-        # Create glob pattern for collecting runs.
-        run_glob = '/'.join(['*'] * len(run_tags)) + '/report.json'
+        run['result_counts'] = self.index.result_counts(run_dir)
 
-        self.result_dir = Path(result_dir)
-        self.ref_dir = Path(ref_dir)
-        self.run_tags = run_tags
-        self.run_glob = run_glob
+        return run
 
-    def run_report_file(self, run_dir):
+    def load_tests(self, run_dir, result=None, search=None, offset=0, limit=None):
         '''
-        Return full path to run report file.
+        Load the reports of the tests of a run matching the given filters.
+        Returns a tuple containing the list of tests and the total number of matching tests.
         '''
-        return self.result_dir / run_dir / 'report.json'
+        return self.index.tests(run_dir, result, search, offset, limit)
 
-    def test_report_file(self, run_dir, test_dir):
+    def load_trends(self, tags={}, name=None):
         '''
-        Return full path to test report file.
+        Load the trends of all tests (or a single test) across the most recent TREND_RUN_COUNT runs matching the given tags.
+        Returns a tuple containing the runs (oldest first) and the list of trends (see core/trends.py).
         '''
-        return self.result_dir / run_dir / test_dir / 'report.json'
+        self.index.scan(config.RESULT_INDEX_SCAN_INTERVAL)
+        runs, _ = self.index.runs(tags, limit=config.TREND_RUN_COUNT)
+        runs.reverse()
+        return runs, build_trends(runs, self.index.test_trends([run['run_dir'] for run in runs], name))
 
-    def load_runs(self):
+    def load_image_trends(self, runs, name):
         '''
-        Load list of all runs (not including reports of individual tests).
+        Load the error and tolerance of the images of a test in the given runs.
+        Returns a list of dictionaries containing the image name and one point per run the image was compared in.
         '''
-        runs = []
-
-        for run_report_file in self.result_dir.glob(self.run_glob):
-            run = self.load_run(run_report_file, load_tests=False)
-            if run:
-                runs.append(run)
-
-        # Sort by date.
-        runs.sort(key=lambda r: r['date'], reverse=True)
-
-        return runs
-
-    def load_run(self, run_report_file, load_tests=True):
+        results = self.index.image_trends([run['run_dir'] for run in runs], name)
+        trends = []
+        for image, image_results in sorted(results.items()):
+            points = []
+            for run in runs:
+                if run['run_dir'] in image_results:
+                    error, tolerance, success = image_results[run['run_dir']]
+                    points.append({'run_dir': run['run_dir'], 'date': run['date'], 'error': error, 'tolerance': tolerance, 'success': success})
+            trends.append({'name': image, 'points': points})
+        return trends
+
+    def archive(self, run_dir):
         '''
-        Load a single run (including reports of individual tests by default).
+        Return the archive of a packed run (or None). Archives are reopened when they have been modified.
         '''
-        run_dir = run_report_file.parent.relative_to(self.result_dir).as_posix()
-        run = load_json(run_report_file)
-        if not run:
+        archive_file = resolve_path(self.result_dir, Path(run_dir) / config.RESULT_ARCHIVE_FILE)
+        with self.archives_mutex:
+            archive = self.archives.get(run_dir, None)
+            try:
+                mtime_ns = archive_file.stat().st_mtime_ns
+            except OSError:
+                mtime_ns = None
+            if archive and archive.mtime_ns != mtime_ns:
+                archive.close()
+                archive = None
+                del self.archives[run_dir]
+            if not archive and mtime_ns != None:
+                archive = RunArchive(archive_file)
+                self.archives[run_dir] = archive
+            return archive
+
+    def read_result_file(self, path):
+        '''
+        Read a file in the result directory given its relative path, falling back to the run's archive.
+        Returns None if the file does not exist. Raises HTTPError if the path is outside the result directory.
+        '''
+        full_path = resolve_path(self.result_dir, path)
+        if full_path.exists():
+            return full_path.read_bytes()
+        run_dir, name = self.layout.split_path(path)
+        archive = self.archive(run_dir)
+        return archive.read(name) if archive else None
+
+    def result_file_exists(self, path):
+        if resolve_path(self.result_dir, path).exists():
+            return True
+        run_dir, name = self.layout.split_path(path)
+        archive = self.archive(run_dir)
+        return archive != None and archive.contains(name)
+
+    def read_test_report(self, run_dir, test_dir):
+        '''
+        Read a test report from the result directory (bypassing the index). Returns None if it does not exist.
+        '''
+        try:
+            return json.loads(self.read_result_file(Path(run_dir) / test_dir / 'report.json'))
+        except:
             return None
 
-        run_values = str(run_dir).split('/')
-        run_tags = { k:v for [k, v] in zip(self.run_tags, run_values)}
-        run['run_dir'] = str(run_dir)
-        run['run_tags'] = run_tags
-
-        if load_tests:
-            tests = []
-
-            for test_report_file in (self.result_dir / run_dir).glob('*/**/report.json'):
-                test = self.load_test(test_report_file, load_log=False)
-                if test:
-                    tests.append(test)
-
-            run['tests'] = tests
-
-        return run
-
-    def load_test(self, test_report_file, load_log=True):
+    def load_test(self, run_dir, test_dir):
         '''
-        Load a single test (including test log file by default).
+        Load a single test (the test log is loaded separately, see open_log).
+        Tests finished since the last scan of the index are read from their report.
         '''
-        test = load_json(test_report_file)
-        if not test:
-            return None
+        self.index.scan(config.RESULT_INDEX_SCAN_INTERVAL)
+        return self.index.test(run_dir, test_dir) or self.read_test_report(run_dir, test_dir)
 
-        if load_log:
-            log_file = test_report_file.parent / 'log.txt'
-            if log_file.exists():
-                test['log'] = log_file.read_text('utf-8')
+    def open_log(self, run_dir, test_dir):
+        '''
+        Locate the log of a test. Returns a tuple containing a key identifying the log's contents and
+        a function opening the log as a binary file, or None if the test has no log.
+        Raises HTTPError if the log is outside the result directory.
+        '''
+        path = Path(run_dir) / test_dir / 'log.txt'
+        full_path = resolve_path(self.result_dir, path)
+        try:
+            stat = full_path.stat()
+            return (str(full_path), stat.st_size, stat.st_mtime_ns), lambda: open(full_path, 'rb')
+        except OSError:
+            pass
+        # Logs of packed runs are compressed, so they are decompressed into memory.
+        run_dir, name = self.layout.split_path(path)
+        archive = self.archive(run_dir)
+        if archive and archive.contains(name):
+            return (str(archive.path), name, archive.mtime_ns), lambda: io.BytesIO(archive.read(name))
+        return None
 
-        return test
 
+class GzipMiddleware:
+    '''
+    WSGI middleware compressing HTML, JSON and other text responses for clients accepting gzip.
+    '''
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        if not 'gzip' in environ.get('HTTP_ACCEPT_ENCODING', ''):
+            return self.app(environ, start_response)
+
+        captured = []
+        def capture_start_response(status, headers, exc_info=None):
+            captured[:] = [status, headers, exc_info]
+        body = self.app(environ, capture_start_response)
+        status, headers, exc_info = captured
+
+        header_dict = {k.lower(): v for k, v in headers}
+        content_type = header_dict.get('content-type', '').split(';')[0].strip()
+        if not status.startswith('200') or not content_type in GZIP_MIME_TYPES or 'content-encoding' in header_dict:
+            start_response(status, headers, exc_info)
+            return body
+
+        try:
+            data = b''.join(body)
+        finally:
+            if hasattr(body, 'close'):
+                body.close()
+        if len(data) < GZIP_MIN_SIZE:
+            start_response(status, headers, exc_info)
+            return [data]
+
+        # The compressed representation needs its own ETag.
+        data = gzip.compress(data, compresslevel=6)
+        headers = [(k, v) for k, v in headers if not k.lower() in ['content-length', 'etag']]
+        if 'etag' in header_dict:
+            headers.append(('ETag', header_dict['etag'][:-1] + '-gzip"'))
+        headers += [('Content-Encoding', 'gzip'), ('Content-Length', str(len(data))), ('Vary', 'Accept-Encoding')]
+        start_response(status, headers, exc_info)
+        return [data]
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    '''
+    WSGI server handling every request in its own thread, so slow downloads do not block other clients.
+    '''
+    daemon_threads = True
 
 def load_json(path):
     '''
@@ -170,12 +288,13 @@ def run_stats(run):
     '''
     Compute stats bar data for a run.
     '''
-    total_count = len(run['tests'])
+    counts = run['result_counts']
+    total_count = sum(counts.values())
     if total_count == 0:
         return []
     stats = []
     for result, color in zip(['PASSED', 'SKIPPED', 'FAILED'], ['#32b643', '#ffb700', '#e85600']):
-        count = len(list(filter(lambda test: test['result'] == result, run['tests'])))
+        count = counts.get(result, 0)
         stats.append({
             'title': result,
             'percentage': round(100 * count / total_count, 1),
@@ -200,9 +319,34 @@ def test_stats(test):
         })
     return stats
 
-def create_jeri_data(result_image, ref_image, error_image, extra_metrics=['L1', 'L2', 'MAPE', 'MRSE', 'SMAPE', 'SSIM']):
+def chart(series, width=600, height=150):
+    '''
+    Compute chart data for the chart snippet.
+    Series are dictionaries containing a title, color, list of values (None for missing values)
+    and optionally a list of indices of values to mark. All series are drawn on the same scale.
+    '''
+    count = max([len(s['values']) for s in series] + [1])
+    maximum = max([v for s in series for v in s['values'] if v != None] + [0]) or 1
+    x = lambda i: round(width * (i + 0.5) / count, 1)
+    y = lambda v: round(height - 2 - (height - 4) * min(v / maximum, 1), 1)
+    return {
+        'width': width,
+        'height': height,
+        'max': maximum,
+        'series': [{
+            'title': s['title'],
+            'color': s['color'],
+            'dashed': s.get('dashed', False),
+            'points': ' '.join(f'{x(i)},{y(v)}' for i, v in enumerate(s['values']) if v != None),
+            'markers': [(x(i), y(s['values'][i])) for i in s.get('markers', []) if s['values'][i] != None]
+        } for s in series]
+    }
+
+def create_jeri_data(result_image, ref_image, error_image, loss_maps):
     '''
     Create a jeri config object for comparing two images.
+    The error image is optional (it is not written for passing images by default).
+    Loss maps are given as a dictionary mapping loss functions to the URLs of the maps (see core/previews.py).
     '''
     jeri_data = {
         'title': 'root',
@@ -214,24 +358,24 @@ def create_jeri_data(result_image, ref_image, error_image, extra_metrics=['L1',
             {
                 'title': 'Reference',
                 'image': str(ref_image)
-            },
+            }
+        ]
+    }
+
+    if error_image:
+        jeri_data['children'].append(
             {
                 'title': 'Error',
                 'image': str(error_image),
                 'tonemapGroup': 'error'
             }
-        ]
-    }
+        )
 
-    for metric in extra_metrics:
+    for function, loss_map in loss_maps.items():
         jeri_data['children'].append(
             {
-                'title': metric,
-                'lossMap': {
-                    'function': metric,
-                    'imageA': str(ref_image),
-                    'imageB': str(result_image)
-                },
+                'title': function,
+                'image': loss_map,
                 'tonemapGroup': 'metric'
             }
         )
@@ -254,10 +398,74 @@ def format_duration(duration):
     '''
     return str(datetime.timedelta(seconds=round(duration)))
 
+def format_size(size):
+    '''
+    Convert a size in bytes to a human readable string.
+    '''
+    return f'{size / (1 << 20):.1f} MB'
+
+# Results runs and tests can be filtered by.
+RUN_RESULTS = ['PASSED', 'FAILED', 'RUNNING']
+TEST_RESULTS = ['PASSED', 'FAILED', 'SKIPPED']
+
+# Profiled test phases (see core/profiler.py) and their titles.
+PROFILE_PHASES = {
+    'process_spawn': 'Process Spawn',
+    'mogwai_init': 'Mogwai Init',
+    'scene_load': 'Scene Load',
+    'frame_render': 'Frame Rendering',
+    'capture_write': 'Capture Writes',
+    'script_other': 'Script (Other)',
+    'shutdown': 'Shutdown',
+    'mogwai': 'Mogwai',
+    'compare': 'Compare'
+}
+
+
+
+def query_arg(name):
+    '''
+    Return a query argument of the current request (or None if it is missing or empty).
+    '''
+    value = request.query.getunicode(name, default='').strip()
+    return value if value else None
+
+def page_url(page):
+    '''
+    Return the URL of a page of the current request, keeping all other query arguments.
+    '''
+    query = {k: request.query.getunicode(k) for k in request.query.keys() if k != 'page'}
+    if page > 0:
+        query['page'] = page + 1
+    return request.path + ('?' + urllib.parse.urlencode(query) if query else '')
+
+def paginate(total):
+    '''
+    Determine the page requested by the current request.
+    Returns a tuple containing the offset of the first item and pagination data for the pagination snippet.
+    '''
+    page_count = max(1, math.ceil(total / config.VIEWER_PAGE_SIZE))
+    try:
+        page = min(max(int(request.query.get('page', 1)) - 1, 0), page_count - 1)
+    except ValueError:
+        page = 0
+
+    # Link the first, last and neighbouring pages.
+    pages = sorted(set([0, page_count - 1] + list(range(max(page - 2, 0), min(page + 3, page_count)))))
+    pagination = {
+        'total': total,
+        'previous': page_url(page - 1) if page > 0 else None,
+        'next': page_url(page + 1) if page < page_count - 1 else None,
+        'pages': [{'title': p + 1, 'link': page_url(p), 'active': p == page} for p in pages] if page_count > 1 else []
+    }
+    return page * config.VIEWER_PAGE_SIZE, pagination
 
 
 # routes
 # / - list of runs
+# /trend - trends of all tests across runs
+# /trend?test=xxx - trend of a single test
+# /trend.json[?test=xxx] - trend data
 # /run_id - display selected run
 # /run_id/test_id - display selected test
 # /run_id/test_id?action=compare,image=xxx - compare single image
@@ -265,6 +473,12 @@ def format_duration(duration):
 # /<path to file> - static file
 # /result/<path to image> - result images
 # /ref/<path to image> - reference images
+# /run_id/test_id?action=diff,against=run_id[,image=xxx] - compare images of a test between two runs
+# /loss/<function>/<path to result image>.exr - loss map of a result image
+# /diff/<function>/<run_id>/<path to result image>.exr - loss map of a result image compared to another run
+# /log/run_id/test_id?action=chunk,offset=xxx - chunk of a test log starting at a byte offset
+# /log/run_id/test_id?action=index - line count and error and warning lines of a test log
+# /log/run_id/test_id?action=grep,pattern=xxx - lines of a test log containing a string
 
 def parse_path(path):
     '''
@@ -289,18 +503,323 @@ def parse_path(path):
     return run_dir, test_dir
 
 
+def resolve_path(root, path):
+    '''
+    Resolve a path (e.g. taken from a URL) relative to a root directory.
+    Raises HTTPError if the resolved path is outside the root directory (e.g. using '..' or an absolute path).
+    All paths taken from requests need to be resolved with this function before accessing any files.
+    '''
+    root = Path(os.path.abspath(root))
+    full_path = Path(os.path.abspath(root / path))
+    if not full_path.is_relative_to(root):
+        raise HTTPError(403, 'Access denied.')
+    return full_path
+
+def etag_matches(etag):
+    '''
+    Check if an ETag matches the If-None-Match header of the current request.
+    '''
+    header = request.environ.get('HTTP_IF_NONE_MATCH', None)
+    if not header:
+        return False
+    # Compressed responses have the same ETag with a suffix (see GzipMiddleware).
+    tags = [tag.strip().replace('-gzip"', '"') for tag in header.split(',')]
+    return '*' in tags or etag in tags or 'W/' + etag in tags
+
+def serve_file(filename, root, mimetype='auto'):
+    '''
+    Same as static_file (which handles If-Modified-Since and Range requests),
+    additionally sending an ETag derived from the file's size and modification time.
+    '''
+    try:
+        stat = resolve_path(root, filename).stat()
+    except OSError:
+        return static_file(filename, root, mimetype=mimetype)
+
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    if etag_matches(etag):
+        return bottle.HTTPResponse(status=304, ETag=etag)
+    result = static_file(filename, root, mimetype=mimetype)
+    if result.status_code in [200, 206, 304]:
+        result.set_header('ETag', etag)
+    return result
+
+def serve_data(data, mtime_ns, mimetype):
+    '''
+    Serve file contents read into memory (e.g. from an archive) with the same caching and Range support as serve_file.
+    '''
+    etag = f'"{mtime_ns:x}-{len(data):x}"'
+    if etag_matches(etag):
+        return bottle.HTTPResponse(status=304, ETag=etag)
+
+    headers = {
+        'Content-Type': mimetype,
+        'ETag': etag,
+        'Last-Modified': time.strftime("%a, %d %b %Y %H:%M:%S GMT", time.gmtime(mtime_ns // 1000000000)),
+        'Accept-Ranges': 'bytes'
+    }
+    if 'HTTP_RANGE' in request.environ:
+        ranges = list(bottle.parse_range_header(request.environ['HTTP_RANGE'], len(data)))
+        if not ranges:
+            return HTTPError(416, 'Requested Range Not Satisfiable')
+        offset, end = ranges[0]
+        headers['Content-Range'] = f'bytes {offset}-{end - 1}/{len(data)}'
+        return bottle.HTTPResponse(data[offset:end], status=206, **headers)
+    return bottle.HTTPResponse(data, **headers)
+
+def find_test_image(path):
+    '''
+    Find the test of a result image given its path relative to the result directory.
+    Returns a tuple containing the run directory, test directory, image name and test report, or None.
+    '''
+    run_dir, test_path = parse_path(path)
+    parts = test_path.split('/') if test_path else []
+    for i in range(1, len(parts)):
+        test_dir, image_name = '/'.join(parts[:i]), '/'.join(parts[i:])
+        test = database.read_test_report(run_dir, test_dir)
+        if test and any(image['name'] == image_name for image in test['images']):
+            return run_dir, test_dir, image_name, test
+    return None
+
+def locate_result_image(path):
+    '''
+    Locate a result image given its path relative to the result directory.
+    Returns a tuple containing the root directory and the path of the image file relative to it,
+    or None and the image contents for images of packed runs. Raises HTTPError if the image does not exist
+    or is outside the result directory.
+    '''
+    if resolve_path(database.result_dir, path).exists():
+        return database.result_dir, path
+
+    # Images of packed runs are read from the run's archive.
+    data = database.read_result_file(path)
+    if data != None:
+        return None, data
+
+    # Use the reference for images dropped as identical to it (see compact_image_tests.py).
+    found = find_test_image(path)
+    if found:
+        _, _, image_name, test = found
+        image = next(i for i in test['images'] if i['name'] == image_name)
+        if image.get('dropped', False):
+            ref_file = Path(test['ref_dir']) / image_name
+            if ref_file.exists() and hash_file(ref_file) == image['sha256']:
+                return database.ref_dir, ref_file.relative_to(database.ref_dir).as_posix()
+            raise HTTPError(404, 'Result image was dropped as identical to its reference, but the reference has changed since.')
+
+    raise HTTPError(404, 'File does not exist.')
+
+def result_image_source(path):
+    '''
+    Return a result image as a path or its contents (for images of packed runs), see locate_result_image.
+    '''
+    root, image = locate_result_image(path)
+    return root / image if root != None else image
+
 @route('/result/<path:path>')
 def result_image(path):
-    return static_file(path, database.result_dir)
+    root, image = locate_result_image(path)
+    if root == None:
+        archive = database.archive(database.layout.split_path(path)[0])
+        mimetype, _ = mimetypes.guess_type(path)
+        return serve_data(image, archive.mtime_ns, mimetype or 'application/octet-stream')
+    return serve_file(image, root)
 
 @route('/ref/<path:path>')
 def result_image(path):
-    return static_file(path, database.ref_dir)
+    return serve_file(path, database.ref_dir)
+
+@route('/preview/<size>/<source:re:result|ref>/<path:path>')
+def preview_image(size, source, path):
+    if not size in config.PREVIEW_SIZES:
+        raise HTTPError(404, 'Unknown preview size.')
+
+    if source == 'result':
+        root, image = locate_result_image(path)
+    else:
+        root, image = database.ref_dir, path
+        if not resolve_path(root, image).exists():
+            raise HTTPError(404, 'File does not exist.')
+
+    preview_file = database.previews.get(root / image if root != None else image, Path(path).suffix, config.PREVIEW_SIZES[size])
+    if preview_file:
+        return serve_file(preview_file.name, preview_file.parent, mimetype='image/png')
+
+    # Browsers can show formats other than EXR and PFM, so fall back to the full image.
+    if not Path(path).suffix.lower() in ['.exr', '.pfm']:
+        bottle.redirect(f'/{source}/{path}')
+    raise HTTPError(404, 'Cannot generate preview.')
+
+@route('/loss/<function>/<path:path>')
+def loss_map(function, path):
+    # Loss maps are EXR images, which is indicated to JERI by the additional extension.
+    if not function in config.LOSS_MAP_FUNCTIONS or not path.endswith('.exr'):
+        raise HTTPError(404, 'File does not exist.')
+    path = path[:-len('.exr')]
+    # Reject paths outside the result directory before looking up any test reports.
+    resolve_path(database.result_dir, path)
+
+    found = find_test_image(path)
+    if not found:
+        raise HTTPError(404, 'File does not exist.')
+    _, _, image_name, test = found
+    ref_file = Path(test['ref_dir']) / image_name
+    if not ref_file.exists():
+        raise HTTPError(404, 'Reference image does not exist.')
+
+    suffix = Path(path).suffix
+    map_file = database.previews.loss_map(result_image_source(path), ref_file, suffix, suffix, function)
+    if not map_file:
+        raise HTTPError(404, 'Cannot generate loss map.')
+    return serve_file(map_file.name, map_file.parent, mimetype='image/x-exr')
+
+@route('/diff/<function>/<path:path>')
+def diff_map(function, path):
+    # The path starts with the run the result image is compared to (see loss_map).
+    if not function in config.LOSS_MAP_FUNCTIONS or not path.endswith('.exr'):
+        raise HTTPError(404, 'File does not exist.')
+    parts = path[:-len('.exr')].split('/')
+    run_tag_count = len(database.run_tags)
+    against_path = '/'.join(parts[:run_tag_count] + parts[2 * run_tag_count:])
+    path = '/'.join(parts[run_tag_count:])
+    # Reject paths outside the result directory (both images are looked up in it).
+    for image_path in [path, against_path]:
+        resolve_path(database.result_dir, image_path)
+
+    suffix = Path(path).suffix
+    map_file = database.previews.loss_map(result_image_source(path), result_image_source(against_path), suffix, suffix, function)
+    if not map_file:
+        raise HTTPError(404, 'Cannot generate loss map.')
+    return serve_file(map_file.name, map_file.parent, mimetype='image/x-exr')
+
+@route('/log/<path:path>')
+def test_log(path):
+    run_dir, test_dir = parse_path(path)
+    log = database.open_log(run_dir, test_dir) if run_dir and test_dir else None
+    if not log:
+        raise HTTPError(404, 'Log does not exist.')
+    key, open_log = log
+
+    action = request.query.get('action', 'chunk')
+    if action == 'chunk':
+        try:
+            offset = max(int(request.query.get('offset', 0)), 0)
+        except ValueError:
+            raise HTTPError(400, 'Invalid offset.')
+        with open_log() as f:
+            text, next_offset = read_chunk(f, offset)
+        data = {'offset': offset, 'next': next_offset, 'text': text}
+    elif action == 'index':
+        data = database.log_indices.get(key, open_log)
+    elif action == 'grep':
+        pattern = query_arg('pattern')
+        if not pattern:
+            raise HTTPError(400, 'Missing pattern.')
+        if len(pattern) > config.LOG_GREP_MAX_PATTERN_LENGTH:
+            raise HTTPError(400, f'Pattern is longer than {config.LOG_GREP_MAX_PATTERN_LENGTH} characters.')
+        with open_log() as f:
+            matches, truncated = grep_log(f, pattern)
+        data = {'matches': matches, 'truncated': truncated}
+    else:
+        raise HTTPError(400, 'Unknown action.')
+
+    response.content_type = 'application/json'
+    return json.dumps(data)
+
+@route('/trend')
+def trend_page():
+    filter_tags = [tag for tag in config.VIEWER_FILTER_TAGS if tag in database.run_tags]
+    filters = {tag: query_arg(tag) for tag in filter_tags + ['test', 'search', 'regressions']}
+    tags = {tag: filters[tag] for tag in filter_tags if filters[tag]}
+    tag_query = urllib.parse.urlencode(tags)
+    nav = [
+        { 'title': 'Home', 'link': '/'},
+        { 'title': 'Trends', 'link': '/trend' + ('?' + tag_query if tag_query else '') }
+    ]
+
+    if filters['test']:
+        # Show trend of a single test.
+        runs, trends = database.load_trends(tags, filters['test'])
+        if not trends:
+            return template('error', message=f'No results of test "{filters["test"]}" found.')
+        trend = trends[0]
+        points = trend['points']
+        duration_chart = chart([
+            { 'title': 'Duration', 'color': '#5755d9', 'values': [p['duration'] for p in points],
+                'markers': [i for i, p in enumerate(points) if p['regression']] },
+            { 'title': 'Regression threshold', 'color': '#bcc3ce', 'dashed': True, 'values': [p['threshold'] for p in points] }
+        ])
+        image_charts = []
+        for image in database.load_image_trends(runs, filters['test']):
+            image_charts.append({
+                'name': image['name'],
+                'chart': chart([
+                    { 'title': 'Error', 'color': '#e85600', 'values': [p['error'] for p in image['points']],
+                        'markers': [i for i, p in enumerate(image['points']) if not p['success']] },
+                    { 'title': 'Tolerance', 'color': '#bcc3ce', 'dashed': True, 'values': [p['tolerance'] for p in image['points']] }
+                ])
+            })
+        nav.append({ 'title': 'Test: ' + trend['name'] })
+        return template(
+            'trend',
+            nav=nav,
+            trend=trend,
+            duration_chart=duration_chart,
+            image_charts=image_charts,
+            format_date=format_date,
+            format_duration=format_duration
+        )
+
+    # Show trends of all tests, with performance regressions in the most recent run first.
+    runs, trends = database.load_trends(tags)
+    if filters['search']:
+        trends = [t for t in trends if filters['search'].lower() in t['name'].lower()]
+    if filters['regressions']:
+        trends = [t for t in trends if t['regression_count'] > 0]
+    trends.sort(key=lambda t: (not t['regression'], t['regression_count'] == 0, t['name']))
+    offset, pagination = paginate(len(trends))
+    trends = trends[offset:offset + config.VIEWER_PAGE_SIZE]
+    for trend in trends:
+        trend['chart'] = chart([
+            { 'title': 'Duration', 'color': '#5755d9', 'values': [p['duration'] for p in trend['points']],
+                'markers': [i for i, p in enumerate(trend['points']) if p['regression']] }
+        ], 200, 30)
+    return template(
+        'trends',
+        nav=nav,
+        tag_titles=TAG_TITLES,
+        runs=runs,
+        trends=trends,
+        filters=filters,
+        filter_tags=filter_tags,
+        tag_values={tag: database.index.tag_values(tag) for tag in filter_tags},
+        tag_query=tag_query,
+        pagination=pagination,
+        format_duration=format_duration
+    )
+
+@route('/trend.json')
+def trend_data():
+    filter_tags = [tag for tag in config.VIEWER_FILTER_TAGS if tag in database.run_tags]
+    tags = {tag: query_arg(tag) for tag in filter_tags if query_arg(tag)}
+    name = query_arg('test')
+    runs, trends = database.load_trends(tags, name)
+    data = {'runs': [{k: run[k] for k in ['run_dir', 'date', 'result']} for run in runs], 'trends': trends}
+    if name:
+        data['images'] = database.load_image_trends(runs, name)
+    response.content_type = 'application/json'
+    return json.dumps(data)
 
 @route('/')
 @view('index')
 def index_page():
-    runs = database.load_runs()
+    # Filter runs by tags, result and date range.
+    filter_tags = [tag for tag in config.VIEWER_FILTER_TAGS if tag in database.run_tags]
+    filters = {tag: query_arg(tag) for tag in filter_tags + ['result', 'date_from', 'date_to']}
+    tags = {tag: filters[tag] for tag in filter_tags if filters[tag]}
+    _, total = database.load_runs(tags, filters['result'], filters['date_from'], filters['date_to'], limit=0)
+    offset, pagination = paginate(total)
+    runs, _ = database.load_runs(tags, filters['result'], filters['date_from'], filters['date_to'], offset, config.VIEWER_PAGE_SIZE)
     nav = [
         { 'title': 'Home', 'link': '/'}
     ]
@@ -311,6 +830,11 @@ def index_page():
         result_dir=database.result_dir,
         runs=runs,
         run_tags=database.run_tags,
+        filters=filters,
+        filter_tags=filter_tags,
+        tag_values={tag: database.index.tag_values(tag) for tag in filter_tags},
+        results=RUN_RESULTS,
+        pagination=pagination,
         format_date=format_date,
         format_duration=format_duration
     )
@@ -320,14 +844,14 @@ def catch_all(path):
     # Return static files.
     if path in STATIC_FILES:
         mimetype = MIME_TYPES.get(Path(path).suffix, 'auto')
-        return static_file(path, STATIC_DIR, mimetype=mimetype)
+        return serve_file(path, STATIC_DIR, mimetype=mimetype)
 
     # Parse path.
     run_dir, test_dir = parse_path(path)
 
     if run_dir and not test_dir:
         # Show run page.
-        run = database.load_run(database.run_report_file(run_dir))
+        run = database.load_run(run_dir)
         if not run:
             return template('error', message=f'Run "{run_dir}" does not exist.')
 
@@ -336,6 +860,13 @@ def catch_all(path):
             { 'title': 'Run: ' + run_dir, 'link': '/' + run_dir }
         ]
         stats = run_stats(run)
+
+        # Filter tests by result and name.
+        filters = {name: query_arg(name) for name in ['result', 'search']}
+        _, total = database.load_tests(run_dir, filters['result'], filters['search'], limit=0)
+        offset, pagination = paginate(total)
+        tests, _ = database.load_tests(run_dir, filters['result'], filters['search'], offset, config.VIEWER_PAGE_SIZE)
+
         return template(
             'run',
             nav=nav,
@@ -343,6 +874,10 @@ def catch_all(path):
             stats=stats,
             run_dir=run_dir,
             run=run,
+            tests=tests,
+            filters=filters,
+            results=TEST_RESULTS,
+            pagination=pagination,
             run_tags=database.run_tags,
             format_date=format_date,
             format_duration=format_duration
@@ -350,19 +885,101 @@ def catch_all(path):
 
     elif run_dir and test_dir:
         # Show test page.
-        test = database.load_test(database.test_report_file(run_dir, test_dir))
+        test = database.load_test(run_dir, test_dir)
         if not test:
             return template('error', message=f'Test "{test_dir}" does not exist for run "{run_dir}".')
 
         action = request.query.get('action', None)
-        if action == 'compare':
+        if action == 'preview':
+            # Show previews of the images (full images are only loaded by the detailed comparison).
+            image = Path(request.query['image']).as_posix()
+            nav = [
+                { 'title': 'Home', 'link': '/'},
+                { 'title': 'Run: ' + run_dir, 'link': '/' + run_dir },
+                { 'title': 'Test: ' + test_dir, 'link': '/' + run_dir + '/' + test_dir },
+                { 'title': 'Image: ' + image }
+            ]
+            ref_dir = Path(test['ref_dir']).relative_to(database.ref_dir).as_posix()
+            previews = [
+                { 'title': 'Result', 'source': f'result/{run_dir}/{test_dir}/{image}' },
+                { 'title': 'Reference', 'source': f'ref/{ref_dir}/{image}' }
+            ]
+            if database.result_file_exists(Path(run_dir) / test_dir / (image + config.ERROR_IMAGE_SUFFIX)):
+                previews.append({ 'title': 'Error', 'source': f'result/{run_dir}/{test_dir}/{image}{config.ERROR_IMAGE_SUFFIX}' })
+            return template(
+                'preview',
+                nav=nav,
+                image=image,
+                run_dir=run_dir,
+                test_dir=test_dir,
+                test_image=next((i for i in test['images'] if i['name'] == image), None),
+                previews=previews
+            )
+        elif action == 'diff':
+            # Compare the images of the test to the ones of another run.
+            # Compare to the previous run of the test by default.
+            test_runs = [r[0] for r in database.index.test_runs(test['name'])]
+            other_runs = [r for r in test_runs if r != run_dir]
+            previous_runs = test_runs[test_runs.index(run_dir) + 1:] if run_dir in test_runs else []
+            against = query_arg('against') or next(iter(previous_runs + other_runs), None)
+            against_test = database.load_test(against, test_dir) if against else None
+            nav = [
+                { 'title': 'Home', 'link': '/'},
+                { 'title': 'Run: ' + run_dir, 'link': '/' + run_dir },
+                { 'title': 'Test: ' + test_dir, 'link': '/' + run_dir + '/' + test_dir },
+                { 'title': 'Diff' }
+            ]
+            image = query_arg('image')
+            if image and against_test:
+                # Compare a single image.
+                result_image = f'/result/{run_dir}/{test_dir}/{image}'
+                against_image = f'/result/{against}/{test_dir}/{image}'
+                loss_maps = {function: f'/diff/{function}/{against}/{run_dir}/{test_dir}/{image}.exr' for function in config.LOSS_MAP_FUNCTIONS}
+                jeri_data = create_jeri_data(result_image, against_image, None, loss_maps)
+                jeri_data['children'][0]['title'] = 'Run: ' + run_dir
+                jeri_data['children'][1]['title'] = 'Run: ' + against
+                return template(
+                    'compare',
+                    image=str(image),
+                    jeri_data=json.dumps(jeri_data)
+                )
+
+            images = []
+            if against_test:
+                against_images = {i['name']: i for i in against_test['images']}
+                for i in test['images']:
+                    diff = { 'name': i['name'], 'metric': i.get('metric', 'mse'), 'exists': i['name'] in against_images, 'error': None }
+                    if diff['exists']:
+                        path = f"{run_dir}/{test_dir}/{i['name']}"
+                        against_path = f"{against}/{test_dir}/{i['name']}"
+                        suffix = Path(i['name']).suffix
+                        try:
+                            diff['error'] = database.previews.error(result_image_source(path), result_image_source(against_path), suffix, suffix, diff['metric'])
+                        except HTTPError:
+                            pass
+                    images.append(diff)
+            return template(
+                'diff',
+                nav=nav,
+                run_dir=run_dir,
+                test_dir=test_dir,
+                test=test,
+                against=against,
+                against_test=against_test,
+                other_runs=other_runs,
+                images=images
+            )
+        elif action == 'compare':
             # Compare images.
             image = Path(request.query['image']).as_posix()
             result_image = Path('/result') / run_dir / test_dir / image
             error_image = Path(str(result_image) + config.ERROR_IMAGE_SUFFIX)
+            if not database.result_file_exists(Path(run_dir) / test_dir / (image + config.ERROR_IMAGE_SUFFIX)):
+                error_image = None
             ref_dir = Path(test['ref_dir']).relative_to(database.ref_dir)
             ref_image = Path('/ref') / ref_dir / image
-            jeri_data = create_jeri_data(result_image, ref_image, error_image)
+            loss_maps = {function: f'/loss/{function}/{run_dir}/{test_dir}/{image}.exr' for function in config.LOSS_MAP_FUNCTIONS}
+            jeri_data = create_jeri_data(result_image, ref_image, error_image, loss_maps)
             return template(
                 'compare',
                 image=str(image),
@@ -384,7 +1001,10 @@ def catch_all(path):
                 test_dir=test_dir,
                 ref_dir=ref_dir,
                 test=test,
-                format_duration=format_duration
+                has_log=database.result_file_exists(Path(run_dir) / test_dir / 'log.txt'),
+                profile_phases=PROFILE_PHASES,
+                format_duration=format_duration,
+                format_size=format_size
             )
     else:
         return template('error', message='Invalid URL.')
@@ -399,6 +1019,7 @@ def main():
     parser.add_argument('--port', type=int, action='store', help='Server port', default=8080)
     parser.add_argument('--debug', action='store_true', help='Debug mode')
     parser.add_argument('--no-browser', action='store_true', help='Do not open browser window')
+    parser.add_argument('--single-threaded', action='store_true', help='Handle one request at a time instead of every request in its own thread')
 
     args = parser.parse_args()
 
@@ -423,7 +1044,9 @@ def main():
 
     # Trampoline function for running server.
     def run_server():
-        run(host=args.host, port=args.port, debug=args.debug, reloader=args.debug, quiet=not args.debug)
+        app = GzipMiddleware(bottle.default_app())
+        server_class = WSGIServer if args.single_threaded else ThreadingWSGIServer
+        run(app=app, host=args.host, port=args.port, server_class=server_class, debug=args.debug, reloader=args.debug, quiet=not args.debug)
 
     # Start server thread.
     server_thread = threading.Thread(target=run_server, name='server', daemon=True)
@@ -0,0 +1,60 @@
+// Subscribes to the progress events of a run in progress (see core/live.py)
+// and updates the live section of the run page.
+function subscribeLive(url) {
+    var source = new EventSource(url + '/events');
+    var status = document.getElementById('live-status');
+    var running = {};
+
+    function text(id, value) {
+        document.getElementById(id).textContent = value;
+    }
+
+    function updateRunning() {
+        var now = Date.now() / 1000;
+        var names = Object.keys(running).sort();
+        text('live-running', names.length == 0 ? '-' : names.map(function (name) {
+            return name + ' (' + Math.round(now - running[name]) + ' s)';
+        }).join(', '));
+    }
+
+    function addResult(event) {
+        var row = document.createElement('tr');
+        [event.test, event.result, event.elapsed_time.toFixed(1) + ' s', event.attempts].forEach(function (value) {
+            var cell = document.createElement('td');
+            cell.textContent = value;
+            row.appendChild(cell);
+        });
+        var body = document.getElementById('live-results');
+        body.insertBefore(row, body.firstChild);
+    }
+
+    source.onopen = function () {
+        status.textContent = 'Connected';
+    };
+    source.onerror = function () {
+        status.textContent = 'Disconnected (retrying)';
+    };
+
+    ['run_started', 'test_started', 'test_rerun', 'test_finished', 'run_finished', 'interrupted', 'aborted'].forEach(function (type) {
+        source.addEventListener(type, function (message) {
+            var event = JSON.parse(message.data);
+            if (type == 'test_started') {
+                running[event.test] = event.time;
+            } else if (type == 'test_finished') {
+                delete running[event.test];
+                addResult(event);
+            } else if (type == 'aborted' || type == 'interrupted') {
+                status.textContent = 'Aborted';
+            } else if (type == 'run_finished') {
+                source.close();
+                status.textContent = 'Finished (' + event.result + ')';
+                // Show the final report once it has been written.
+                setTimeout(function () { window.location.reload(); }, 2000);
+            }
+            text('live-queued', event.queue_depth);
+            updateRunning();
+        });
+    });
+
+    setInterval(updateRunning, 1000);
+}
@@ -0,0 +1,115 @@
+// Loads a test log in chunks (see /log route in view_image_tests.py) and
+// provides links to the indexed error and warning lines and a log search.
+function loadLog(url) {
+    var log = document.getElementById('log');
+    var more = document.getElementById('log-more');
+    var summary = document.getElementById('log-summary');
+    var matches = document.getElementById('log-matches');
+    var search = document.getElementById('log-search');
+    var nextOffset = 0;
+    var loading = false;
+    // Incremented when jumping to another line, so chunks requested before are dropped.
+    var generation = 0;
+
+    function fetchJson(query) {
+        return fetch(url + '?' + query).then(function (response) {
+            if (!response.ok) {
+                throw new Error(response.status + ' ' + response.statusText);
+            }
+            return response.json();
+        });
+    }
+
+    function loadMore() {
+        if (loading || nextOffset == null) {
+            return;
+        }
+        loading = true;
+        var current = generation;
+        fetchJson('action=chunk&offset=' + nextOffset).then(function (chunk) {
+            if (current != generation) {
+                return;
+            }
+            log.appendChild(document.createTextNode(chunk.text));
+            nextOffset = chunk.next;
+            more.style.display = nextOffset == null ? 'none' : '';
+            loading = false;
+        }).catch(function (error) {
+            log.appendChild(document.createTextNode('Cannot load log (' + error.message + ').\n'));
+            loading = false;
+        });
+    }
+
+    // Show the log starting at a line (given by its byte offset).
+    function showFrom(line) {
+        log.textContent = '';
+        generation++;
+        loading = false;
+        if (line.offset > 0) {
+            var link = document.createElement('a');
+            link.href = '#';
+            link.textContent = '[Showing log from line ' + line.line + ', show from start]\n';
+            link.onclick = function (e) { e.preventDefault(); showFrom({line: 1, offset: 0}); };
+            log.appendChild(link);
+        }
+        nextOffset = line.offset;
+        loadMore();
+        log.scrollIntoView();
+    }
+
+    function lineList(title, lines) {
+        var container = document.createElement('div');
+        var header = document.createElement('b');
+        header.textContent = title;
+        container.appendChild(header);
+        lines.forEach(function (line) {
+            var item = document.createElement('div');
+            var link = document.createElement('a');
+            link.href = '#';
+            link.textContent = line.line + ': ' + line.text;
+            link.onclick = function (e) { e.preventDefault(); showFrom(line); };
+            item.appendChild(link);
+            container.appendChild(item);
+        });
+        return container;
+    }
+
+    fetchJson('action=index').then(function (index) {
+        var counts = Object.keys(index.levels).map(function (level) {
+            return index.levels[level].length + (index.truncated ? '+' : '') + ' ' + level + 's';
+        });
+        summary.appendChild(document.createTextNode(index.lines + ' lines, ' + counts.join(', ')));
+        Object.keys(index.levels).forEach(function (level) {
+            if (index.levels[level].length > 0) {
+                summary.appendChild(lineList(level.charAt(0).toUpperCase() + level.slice(1) + 's', index.levels[level]));
+            }
+        });
+    });
+
+    search.onsubmit = function (e) {
+        e.preventDefault();
+        var pattern = search.elements['pattern'].value;
+        matches.textContent = '';
+        if (!pattern) {
+            return;
+        }
+        var query = 'action=grep&pattern=' + encodeURIComponent(pattern);
+        fetchJson(query).then(function (result) {
+            var title = result.matches.length + (result.truncated ? '+' : '') + ' matching lines';
+            matches.appendChild(lineList(title, result.matches));
+        }).catch(function (error) {
+            matches.textContent = 'Cannot search log (' + error.message + ').';
+        });
+    };
+
+    more.onclick = loadMore;
+    // Load the next chunk when scrolling to the end of the log.
+    if ('IntersectionObserver' in window) {
+        new IntersectionObserver(function (entries) {
+            if (entries[0].isIntersecting) {
+                loadMore();
+            }
+        }).observe(more);
+    }
+    loadMore();
+}
@@ -0,0 +1,79 @@
+% rebase('base', title='Diff: ' + test['name'])
+
+% include('snippets/nav', nav=nav)
+
+<h4>Diff: {{test['name']}}</h4>
+
+<div class="properties">
+    <div class="property">
+        <div class="property-field">Run</div>
+        <div class="property-value">{{run_dir}}</div>
+    </div>
+    <div class="property">
+        <div class="property-field">Compared to</div>
+        <div class="property-value">{{against or '-'}}</div>
+    </div>
+</div>
+
+% if len(other_runs) == 0:
+<p>No other runs of this test found.</p>
+% else:
+<form class="filters" method="get">
+    <input type="hidden" name="action" value="diff">
+    <select class="form-select" name="against">
+        % for other_run in other_runs:
+        <option value="{{other_run}}" {{'selected' if other_run == against else ''}}>{{other_run}}</option>
+        % end
+    </select>
+    <button class="btn" type="submit">Compare</button>
+</form>
+% end
+
+% if against and not against_test:
+<p>Test does not exist for run "{{against}}".</p>
+% elif against_test:
+<div class="divider"></div>
+<h5>Images</h5>
+<table class="table table-striped table-hover">
+    <thead>
+        <tr>
+            <th>Image</th>
+            <th>{{run_dir}}</th>
+            <th>{{against}}</th>
+            <th>Metric</th>
+            <th>Error</th>
+            <th>Result</th>
+        </tr>
+    </thead>
+    <tbody>
+        % for image in images:
+        % if image['exists']:
+        <tr class="c-hand" onclick="window.location='/{{run_dir}}/{{test_dir}}?action=diff&against={{against}}&image={{image['name']}}';">
+        % else:
+        <tr>
+        % end
+            <td>{{image['name']}}</td>
+            <td><img class="thumbnail" loading="lazy" src="/preview/thumbnail/result/{{run_dir}}/{{test_dir}}/{{image['name']}}" alt=""></td>
+            <td>
+                % if image['exists']:
+                <img class="thumbnail" loading="lazy" src="/preview/thumbnail/result/{{against}}/{{test_dir}}/{{image['name']}}" alt="">
+                % end
+            </td>
+            <td>{{image['metric']}}</td>
+            <td>{{image['error'] if image['error'] != None else '-'}}</td>
+            <td>
+                % if not image['exists']:
+                <span class="label label-warning">MISSING</span>
+                % elif image['error'] == None:
+                <span class="label">UNKNOWN</span>
+                % elif image['error'] == 0:
+                <span class="label label-success">IDENTICAL</span>
+                % else:
+                <span class="label label-error">DIFFERENT</span>
+                % end
+            </td>
+        </tr>
+        % end
+    </tbody>
+</table>
+% end
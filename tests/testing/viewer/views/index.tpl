@@ -13,10 +13,35 @@
         <div class="property-field">Location</div>
         <div class="property-value">{{result_dir}}</div>
     </div>
+    <div class="property">
+        <div class="property-field">Trends</div>
+        <div class="property-value"><a href="/trend">Error and duration across runs</a></div>
+    </div>
 </div>
 
 <div class="divider"></div>
-<h5>Runs</h5>
+<h5>Runs ({{pagination['total']}})</h5>
+
+<form class="filters" method="get">
+    % for tag in filter_tags:
+    <select class="form-select" name="{{tag}}">
+        <option value="">All {{tag_titles[tag]}}s</option>
+        % for value in tag_values[tag]:
+        <option value="{{value}}" {{'selected' if filters[tag] == value else ''}}>{{value}}</option>
+        % end
+    </select>
+    % end
+    <select class="form-select" name="result">
+        <option value="">All Results</option>
+        % for result in results:
+        <option value="{{result}}" {{'selected' if filters['result'] == result else ''}}>{{result}}</option>
+        % end
+    </select>
+    <input class="form-input" type="date" name="date_from" value="{{filters['date_from'] or ''}}" title="From">
+    <input class="form-input" type="date" name="date_to" value="{{filters['date_to'] or ''}}" title="To">
+    <button class="btn" type="submit">Filter</button>
+    <a class="btn btn-link" href="/">Reset</a>
+</form>
 
 % if len(runs) == 0:
 <p>No runs found.</p>
@@ -49,4 +74,5 @@
         % end
     </tbody>
 </table>
+% include('snippets/pagination', pagination=pagination)
 % end
@@ -0,0 +1,42 @@
+% rebase('base', title='Image: ' + image)
+
+% include('snippets/nav', nav=nav)
+
+<h4>Image: {{image}}</h4>
+
+% if test_image:
+<div class="properties">
+    <div class="property">
+        <div class="property-field">Metric</div>
+        <div class="property-value">{{test_image.get('metric', 'mse')}}</div>
+    </div>
+    <div class="property">
+        <div class="property-field">Error</div>
+        <div class="property-value">{{test_image['error']}}{{' (lower bound, comparison stopped early)' if test_image.get('error_is_lower_bound', False) else ''}}</div>
+    </div>
+    <div class="property">
+        <div class="property-field">Tolerance</div>
+        <div class="property-value">{{test_image['tolerance']}}</div>
+    </div>
+    <div class="property">
+        <div class="property-field">Result</div>
+        <div class="property-value">
+            % include('snippets/result', result='PASSED' if test_image['success'] else 'FAILED')
+        </div>
+    </div>
+</div>
+% end
+
+<p>
+    <a class="btn btn-primary" href="/{{run_dir}}/{{test_dir}}?action=compare&image={{image}}">Detailed Comparison</a>
+    <span class="text-gray">Loads the full resolution images.</span>
+</p>
+
+<div class="previews">
+    % for preview in previews:
+    <figure class="preview">
+        <a href="/{{preview['source']}}"><img class="img-responsive" src="/preview/preview/{{preview['source']}}" alt="{{preview['title']}}"></a>
+        <figcaption>{{preview['title']}}</figcaption>
+    </figure>
+    % end
+</div>
@@ -25,15 +25,66 @@
             % include('snippets/result', result=run['result'])
         </div>
     </div>
+    % if 'progress' in run:
+    <div class="property">
+        <div class="property-field">Progress</div>
+        <div class="property-value">{{run['progress']}}</div>
+    </div>
+    % end
+</div>
+
+% if 'live_url' in run:
+<div class="divider"></div>
+<h5>Live</h5>
+<div class="properties">
+    <div class="property">
+        <div class="property-field">Status</div>
+        <div class="property-value" id="live-status">Connecting</div>
+    </div>
+    <div class="property">
+        <div class="property-field">Queued</div>
+        <div class="property-value" id="live-queued">-</div>
+    </div>
+    <div class="property">
+        <div class="property-field">Running</div>
+        <div class="property-value" id="live-running">-</div>
+    </div>
 </div>
+<table class="table table-striped">
+    <thead>
+        <tr>
+            <th>Test</th>
+            <th>Result</th>
+            <th>Duration</th>
+            <th>Attempts</th>
+        </tr>
+    </thead>
+    <tbody id="live-results">
+    </tbody>
+</table>
+<script src="/live.js"></script>
+<script>subscribeLive('{{run['live_url']}}');</script>
+% end
 
 <div class="divider"></div>
-<h5>Tests</h5>
+<h5>Tests ({{pagination['total']}})</h5>
+
+% include('snippets/stats', stats=stats)
+<form class="filters" method="get">
+    <select class="form-select" name="result">
+        <option value="">All Results</option>
+        % for result in results:
+        <option value="{{result}}" {{'selected' if filters['result'] == result else ''}}>{{result}}</option>
+        % end
+    </select>
+    <input class="form-input" type="text" name="search" value="{{filters['search'] or ''}}" placeholder="Search tests">
+    <button class="btn" type="submit">Filter</button>
+    <a class="btn btn-link" href="/{{run_dir}}">Reset</a>
+</form>
 
-% if len(run['tests']) == 0:
+% if len(tests) == 0:
 <p>No tests found.</p>
 % else:
-% include('snippets/stats', stats=stats)
 <table class="table table-striped table-hover">
     <thead>
         <tr>
@@ -45,7 +96,7 @@
         </tr>
     </thead>
     <tbody>
-        % for test in run['tests']:
+        % for test in tests:
         <tr class="c-hand" onclick="window.location='/{{run_dir}}/{{test['name']}}';">
             <td>{{test['name']}}</td>
             <td>{{len(test['images'])}}</td>
@@ -62,4 +113,5 @@
         % end
     </tbody>
 </table>
+% include('snippets/pagination', pagination=pagination)
 %end
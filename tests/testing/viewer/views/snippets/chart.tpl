@@ -0,0 +1,9 @@
+<svg class="chart" width="{{chart['width']}}" height="{{chart['height']}}" viewBox="0 0 {{chart['width']}} {{chart['height']}}">
+    <title>Maximum: {{'%.4g' % chart['max']}}</title>
+    % for series in chart['series']:
+    <polyline points="{{series['points']}}" fill="none" stroke="{{series['color']}}" stroke-width="1.5" {{!'stroke-dasharray="4 3"' if series['dashed'] else ''}}/>
+    % for x, y in series['markers']:
+    <circle cx="{{x}}" cy="{{y}}" r="3" fill="#e85600"/>
+    % end
+    % end
+</svg>
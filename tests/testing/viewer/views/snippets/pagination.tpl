@@ -0,0 +1,20 @@
+% if len(pagination['pages']) > 0:
+<ul class="pagination">
+    <li class="page-item{{'' if pagination['previous'] else ' disabled'}}">
+        <a href="{{pagination['previous'] or '#'}}">Previous</a>
+    </li>
+    % last = 0
+    % for page in pagination['pages']:
+    % if page['title'] > last + 1:
+    <li class="page-item"><span>&hellip;</span></li>
+    % end
+    <li class="page-item{{' active' if page['active'] else ''}}">
+        <a href="{{page['link']}}">{{page['title']}}</a>
+    </li>
+    % last = page['title']
+    % end
+    <li class="page-item{{'' if pagination['next'] else ' disabled'}}">
+        <a href="{{pagination['next'] or '#'}}">Next</a>
+    </li>
+</ul>
+% end
@@ -9,6 +9,14 @@
         <div class="property-field">Duration</div>
         <div class="property-value">{{format_duration(test['duration'])}}</div>
     </div>
+    <div class="property">
+        <div class="property-field">Trend</div>
+        <div class="property-value"><a href="/trend?test={{test['name']}}">Across runs</a></div>
+    </div>
+    <div class="property">
+        <div class="property-field">Diff</div>
+        <div class="property-value"><a href="/{{run_dir}}/{{test_dir}}?action=diff">Compare images to another run</a></div>
+    </div>
     <div class="property">
         <div class="property-field">References</div>
         <div class="property-value">{{ref_dir}}</div>
@@ -32,6 +40,9 @@
     <thead>
         <tr>
             <th>Image</th>
+            <th>Result</th>
+            <th>Reference</th>
+            <th>Metric</th>
             <th>Error</th>
             <th>Tolerance</th>
             <th>Result</th>
@@ -39,9 +50,12 @@
     </thead>
     <tbody>
     % for image in test['images']:
-        <tr class="c-hand" onclick="window.location='/{{run_dir}}/{{test_dir}}?action=compare&image={{image['name']}}';">
+        <tr class="c-hand" onclick="window.location='/{{run_dir}}/{{test_dir}}?action=preview&image={{image['name']}}';">
             <td>{{image['name']}}</td>
-            <td>{{image['error']}}</td>
+            <td><img class="thumbnail" loading="lazy" src="/preview/thumbnail/result/{{run_dir}}/{{test_dir}}/{{image['name']}}" alt=""></td>
+            <td><img class="thumbnail" loading="lazy" src="/preview/thumbnail/ref/{{ref_dir}}/{{image['name']}}" alt=""></td>
+            <td>{{image.get('metric', 'mse')}}</td>
+            <td>{{image['error']}}{{' (lower bound)' if image.get('error_is_lower_bound', False) else ''}}</td>
             <td>{{image['tolerance']}}</td>
             <td>
                 % include('snippets/result', result='PASSED' if image['success'] else 'FAILED')
@@ -52,6 +66,60 @@
 </table>
 % end
 
+% if test.get('profile', {}).get('phases'):
+<div class="divider"></div>
+<h5>Profile</h5>
+% phases = test['profile']['phases']
+% total = sum(phases.values())
+% resources = test['profile'].get('resources', {})
+<div class="properties">
+    % if 'peak_rss' in resources:
+    <div class="property">
+        <div class="property-field">Peak RSS</div>
+        <div class="property-value">{{format_size(resources['peak_rss'])}}</div>
+    </div>
+    % end
+    % if 'cpu_time' in resources:
+    <div class="property">
+        <div class="property-field">CPU Time</div>
+        <div class="property-value">{{'%.2f s' % resources['cpu_time']}}</div>
+    </div>
+    % end
+    % if 'read_bytes' in resources:
+    <div class="property">
+        <div class="property-field">I/O Read</div>
+        <div class="property-value">{{format_size(resources['read_bytes'])}}</div>
+    </div>
+    % end
+    % if 'write_bytes' in resources:
+    <div class="property">
+        <div class="property-field">I/O Write</div>
+        <div class="property-value">{{format_size(resources['write_bytes'])}}</div>
+    </div>
+    % end
+</div>
+<table class="table table-striped">
+    <thead>
+        <tr>
+            <th>Phase</th>
+            <th>Count</th>
+            <th>Duration</th>
+            <th>Share</th>
+        </tr>
+    </thead>
+    <tbody>
+    % for phase, duration in phases.items():
+        <tr>
+            <td>{{profile_phases.get(phase, phase)}}</td>
+            <td>{{test['profile'].get('counts', {}).get(phase, '')}}</td>
+            <td>{{'%.2f s' % duration}}</td>
+            <td>{{'%.1f %%' % (100 * duration / total) if total > 0 else ''}}</td>
+        </tr>
+    % end
+    </tbody>
+</table>
+% end
+
 % if test['messages'] != []:
 <div class="divider"></div>
 <h5>Messages</h5>
@@ -60,8 +128,17 @@
     % end
 % end
 
-% if 'log' in test:
+% if has_log:
 <div class="divider"></div>
 <h5>Log</h5>
-<samp style="white-space: pre-wrap; font-size: 0.8em">{{test['log']}}</samp s>
+<div class="log-summary" id="log-summary"></div>
+<form class="filters" id="log-search">
+    <input class="form-input" type="text" name="pattern" placeholder="Search log">
+    <button class="btn" type="submit">Search</button>
+</form>
+<div class="log-matches" id="log-matches"></div>
+<samp class="log" id="log"></samp>
+<button class="btn btn-link" id="log-more" style="display: none">Load more</button>
+<script src="/log.js"></script>
+<script>loadLog('/log/{{run_dir}}/{{test_dir}}');</script>
 % end
@@ -0,0 +1,65 @@
+% rebase('base', title='Trend: ' + trend['name'])
+
+% include('snippets/nav', nav=nav)
+
+<h4>Trend: {{trend['name']}}</h4>
+
+<div class="properties">
+    <div class="property">
+        <div class="property-field">Runs</div>
+        <div class="property-value">{{len(trend['points'])}}</div>
+    </div>
+    <div class="property">
+        <div class="property-field">Regressions</div>
+        <div class="property-value">{{trend['regression_count']}}</div>
+    </div>
+</div>
+
+<div class="divider"></div>
+<h5>Duration</h5>
+% include('snippets/chart', chart=duration_chart)
+<p class="text-gray">Maximum: {{format_duration(duration_chart['max'])}}. Marked runs exceed the noise band of the preceding runs (dashed).</p>
+
+% if image_charts:
+<div class="divider"></div>
+<h5>Image Errors</h5>
+% for image_chart in image_charts:
+<h6>{{image_chart['name']}}</h6>
+% include('snippets/chart', chart=image_chart['chart'])
+<p class="text-gray">Maximum: {{'%.4g' % image_chart['chart']['max']}}. Marked runs failed, tolerance is dashed.</p>
+% end
+% end
+
+<div class="divider"></div>
+<h5>Runs</h5>
+<table class="table table-striped table-hover">
+    <thead>
+        <tr>
+            <th>Run</th>
+            <th>Date</th>
+            <th>Duration</th>
+            <th>Threshold</th>
+            <th>Error / Tolerance</th>
+            <th>Result</th>
+        </tr>
+    </thead>
+    <tbody>
+        % for point in reversed(trend['points']):
+        <tr class="c-hand" onclick="window.location='/{{point['run_dir']}}/{{point['test_dir']}}';">
+            <td>{{point['run_dir']}}</td>
+            <td>{{format_date(point['date'])}}</td>
+            <td>
+                {{format_duration(point['duration']) if point['duration'] != None else '-'}}
+                % if point['regression']:
+                <span class="label label-error">REGRESSION</span>
+                % end
+            </td>
+            <td>{{format_duration(point['threshold']) if point['threshold'] != None else '-'}}</td>
+            <td>{{'%.3g' % point['error_ratio'] if point['error_ratio'] != None else '-'}}</td>
+            <td>
+                % include('snippets/result', result=point['result'])
+            </td>
+        </tr>
+        % end
+    </tbody>
+</table>
@@ -0,0 +1,82 @@
+% rebase('base', title='Trends')
+
+% include('snippets/nav', nav=nav)
+
+<h4>Trends</h4>
+
+<div class="properties">
+    <div class="property">
+        <div class="property-field">Runs</div>
+        <div class="property-value">{{len(runs)}}</div>
+    </div>
+    % if runs:
+    <div class="property">
+        <div class="property-field">From</div>
+        <div class="property-value">{{runs[0]['run_dir']}}</div>
+    </div>
+    <div class="property">
+        <div class="property-field">To</div>
+        <div class="property-value">{{runs[-1]['run_dir']}}</div>
+    </div>
+    % end
+</div>
+
+<div class="divider"></div>
+<h5>Tests ({{pagination['total']}})</h5>
+
+<form class="filters" method="get">
+    % for tag in filter_tags:
+    <select class="form-select" name="{{tag}}">
+        <option value="">All {{tag_titles[tag]}}s</option>
+        % for value in tag_values[tag]:
+        <option value="{{value}}" {{'selected' if filters[tag] == value else ''}}>{{value}}</option>
+        % end
+    </select>
+    % end
+    <input class="form-input" type="text" name="search" value="{{filters['search'] or ''}}" placeholder="Search tests">
+    <label class="form-checkbox">
+        <input type="checkbox" name="regressions" value="1" {{'checked' if filters['regressions'] else ''}}>
+        <i class="form-icon"></i> Regressions only
+    </label>
+    <button class="btn" type="submit">Filter</button>
+    <a class="btn btn-link" href="/trend">Reset</a>
+</form>
+
+% if len(trends) == 0:
+<p>No tests found.</p>
+% else:
+<table class="table table-striped table-hover">
+    <thead>
+        <tr>
+            <th>Test</th>
+            <th>Runs</th>
+            <th>Duration</th>
+            <th>Latest Duration</th>
+            <th>Error / Tolerance</th>
+            <th>Regressions</th>
+        </tr>
+    </thead>
+    <tbody>
+        % for trend in trends:
+        % latest = trend['latest']
+        <tr class="c-hand" onclick="window.location='/trend?test={{trend['name']}}{{'&' + tag_query if tag_query else ''}}';">
+            <td>{{trend['name']}}</td>
+            <td>{{len(trend['points'])}}</td>
+            <td>
+                % include('snippets/chart', chart=trend['chart'])
+            </td>
+            <td>{{format_duration(latest['duration']) if latest['duration'] != None else '-'}}</td>
+            <td>{{'%.3g' % latest['error_ratio'] if latest['error_ratio'] != None else '-'}}</td>
+            <td>
+                % if trend['regression']:
+                <span class="label label-error">REGRESSION</span>
+                % elif trend['regression_count'] > 0:
+                <span class="label label-warning">{{trend['regression_count']}}</span>
+                % end
+            </td>
+        </tr>
+        % end
+    </tbody>
+</table>
+% include('snippets/pagination', pagination=pagination)
+% end